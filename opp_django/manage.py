@@ -5,6 +5,11 @@ import sys
 if __name__ == "__main__":
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "opp_django.settings.local")
 
+    # periodic commands run with --if-changed exit here, before loading Django, when nothing changed
+    from parser.watermark import precheck
+    if not precheck(sys.argv):
+        sys.exit(0)
+
     from django.core.management import execute_from_command_line
 
     execute_from_command_line(sys.argv)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Link of the votations to the acts they refer to, and final votes detection.
+
+Titles of the votations at la Camera start with the act, followed by
+the phase of its examination::
+
+    Ddl 1234-A - voto finale
+    Moz. 1-00123 - parte motiva
+    Ddl 1234-A - odg 9/1234-A/12
+
+The act is parsed by compiled patterns from the head of the title (shared
+by all the votations of an act, so its normalization is memoized), the
+phase is stored in titolo_aggiuntivo, when empty, and final votes are
+flagged in finale. The act of each votation is kept in VotazioneAtto,
+indexed by act, so that the votations of an act are read without
+scanning the titles::
+
+    from opp import acts
+    acts.link_votations('C', 17)
+    acts.act_votations('C', 17, 'ddl', '1234')
+"""
+import re
+from django.db import transaction
+from opp.models import Votazione, VotazioneAtto
+from opp.search import normalize
+
+__author__ = 'guglielmo'
+
+
+# (act type, pattern of its code), tried in order on the normalized head of the title;
+# the groups of a match are joined by a dash (doc. XXII, n. 12 -> XXII-12)
+ACT_PATTERNS = (
+    ('ddl', re.compile(r'\b(?:ddl|pdl|pdlc|disegno di legge|proposta di legge)\s*(?:n\.\s*)?(\d+(?:-[a-z]+)*)')),
+    ('mozione', re.compile(r'\bmoz(?:ione|ioni|\.)?\s*(?:n\.\s*)?(\d-\d+)')),
+    ('risoluzione', re.compile(r'\bris(?:oluzione|oluzioni|\.)?\s*(?:n\.\s*)?(\d-\d+)')),
+    ('odg', re.compile(r'\b(?:odg|ordine del giorno)\s*(?:n\.\s*)?(\d+/\d+(?:-[a-z]+)*/\d+)')),
+    ('doc', re.compile(r'\bdoc\.?\s*([ivxlc]+)(?:[-,]\s*(?:n\.\s*)?(\d+))?')),
+)
+
+FINAL_PATTERN = re.compile(r'\b(?:voto|votazione) final[ei]\b')
+
+PHASE_SEPARATOR = ' - '
+
+IN_BATCH = 1000
+
+# memoized normalized heads of the titles
+_normalized = {}
+NORMALIZED_MAX = 10000
+
+
+def normalized(text):
+    try:
+        return _normalized[text]
+    except KeyError:
+        if len(_normalized) >= NORMALIZED_MAX:
+            _normalized.clear()
+        value = _normalized[text] = normalize(text)
+        return value
+
+
+def act_number(act_type, code):
+    """
+    the number identifying the act across its readings (1234-A, 1234-B -> 1234)
+    """
+    if act_type == 'ddl':
+        return code.split('-')[0]
+    return code
+
+
+def classify(title):
+    """
+    return the (act type, act code, phase, final) of a votation title;
+    act type and code are None when no act is found
+    """
+    head, _, phase = title.partition(PHASE_SEPARATOR)
+    phase = phase.strip()
+    final = bool(FINAL_PATTERN.search(normalized(phase) if phase else normalized(head)))
+
+    text = normalized(head)
+    for act_type, pattern in ACT_PATTERNS:
+        m = pattern.search(text)
+        if m:
+            return act_type, '-'.join(g for g in m.groups() if g).upper(), phase, final
+    return None, None, phase, final
+
+
+def bulk_update(field, ids_by_value):
+    n = 0
+    for value, ids in ids_by_value.items():
+        for i in range(0, len(ids), IN_BATCH):
+            n += Votazione.objects.filter(id__in=ids[i:i + IN_BATCH]).update(**{field: value})
+    return n
+
+
+def link_votations(house='C', legislature=17, votation_ids=None):
+    """
+    classify the titles of the votations of a legislature, or just the given ones,
+    in one pass, then bulk update finale and titolo_aggiuntivo, and replace their links to the acts
+
+    returns the number of votations linked to an act, and of final votes
+    """
+    votations = Votazione.objects.filter(sitting__house=house, sitting__legislatura=legislature)
+    if votation_ids is not None:
+        votations = votations.filter(id__in=votation_ids)
+
+    finale_updates, phase_updates = {}, {}
+    links = []
+    ids = []
+    n_final = 0
+    for v_id, title, extra_title, finale in votations.values_list(
+        'id', 'titolo', 'titolo_aggiuntivo', 'finale'
+    ).iterator():
+        ids.append(v_id)
+        act_type, code, phase, final = classify(title or '')
+        n_final += final
+        if int(final) != finale:
+            finale_updates.setdefault(int(final), []).append(v_id)
+        if phase and not extra_title:
+            phase_updates.setdefault(phase, []).append(v_id)
+        if act_type:
+            links.append(VotazioneAtto(
+                vote_id=v_id, house=house, legislatura=legislature,
+                act_type=act_type, act_code=code, act_number=act_number(act_type, code), finale=final
+            ))
+
+    with transaction.atomic():
+        bulk_update('finale', finale_updates)
+        bulk_update('titolo_aggiuntivo', phase_updates)
+        if votation_ids is None:
+            VotazioneAtto.objects.filter(house=house, legislatura=legislature).delete()
+        else:
+            for i in range(0, len(ids), IN_BATCH):
+                VotazioneAtto.objects.filter(vote_id__in=ids[i:i + IN_BATCH]).delete()
+        VotazioneAtto.objects.bulk_create(links, batch_size=500)
+    return len(links), n_final
+
+
+def act_votations(house, legislature, act_type, number):
+    """
+    the votations of an act, in all its readings, in order
+    """
+    return Votazione.objects.filter(
+        act__house=house, act__legislatura=legislature, act__act_type=act_type, act__act_number=number
+    ).select_related('sitting', 'act').order_by('sitting__date', 'numero_votazione')
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Per-group breakdown of votations.
+
+For each votation and group, counts how the group members voted,
+computes the group majority position and the number of rebels
+(members voting differently from the majority of their group).
+
+Breakdowns are computed in bulk by the DB writer at import time and
+stored in the ``opp_votazione_gruppo_breakdown`` table; rebel flags
+and counters are updated on ``opp_votazione_has_carica`` and
+``opp_votazione``, too.
+"""
+from collections import defaultdict
+from django.db import transaction
+from opp.models import CaricaHasGruppo, Votazione, VotazioneHasCarica, VotazioneGruppoBreakdown
+
+__author__ = 'guglielmo'
+
+
+VH = VotazioneHasCarica
+
+# voto value -> breakdown counter field
+COUNTERS = {
+    VH.FAVOREVOLE: 'favorevoli',
+    VH.CONTRARIO: 'contrari',
+    VH.ASTENUTO: 'astenuti',
+    VH.ASSENTE: 'assenti',
+    VH.IN_MISSIONE: 'missioni',
+}
+
+
+def group_memberships(charge_ids):
+    """
+    Return a dict mapping each charge id to the list of its
+    (start_date, end_date, group_id) memberships
+    """
+    memberships = defaultdict(list)
+    rows = CaricaHasGruppo.objects.filter(charge_id__in=charge_ids).values_list(
+        'charge_id', 'start_date', 'end_date', 'group_id'
+    )
+    for charge_id, start_date, end_date, group_id in rows:
+        memberships[charge_id].append((start_date, end_date, group_id))
+    return memberships
+
+
+def group_at(memberships, date):
+    """
+    Return the id of the group in the memberships list at the given date, or None
+    """
+    for start_date, end_date, group_id in memberships:
+        if start_date <= date and (end_date is None or date <= end_date):
+            return group_id
+    return None
+
+
+def majority_voting(counts):
+    """
+    Return the majority voting among favorevole, contrario and astenuto,
+    or an empty string when nobody voted or there is a tie
+    """
+    ranking = sorted(((counts.get(v, 0), v) for v in VH.VOTED), reverse=True)
+    if ranking[0][0] == 0 or ranking[0][0] == ranking[1][0]:
+        return ''
+    return ranking[0][1]
+
+
+def compute_breakdowns(votation_ids):
+    """
+    Compute and store the group breakdowns for the given votations.
+
+    Reads the votes and the group memberships with a fixed number of queries,
+    whatever the number of votations, and writes the breakdowns in bulk.
+
+    Returns the number of breakdown rows written.
+    """
+    votation_ids = list(votation_ids)
+    dates = dict(Votazione.objects.filter(id__in=votation_ids).values_list('id', 'sitting__date'))
+    votes = list(VH.objects.filter(vote_id__in=votation_ids).values_list(
+        'id', 'vote_id', 'charge_id', 'voting'
+    ))
+    memberships = group_memberships(set(charge_id for _, _, charge_id, _ in votes))
+
+    # group the votes by votation and group
+    grouped = defaultdict(list)
+    for vhc_id, vote_id, charge_id, voting in votes:
+        group_id = group_at(memberships.get(charge_id, []), dates[vote_id])
+        if group_id is not None:
+            grouped[(vote_id, group_id)].append((vhc_id, voting))
+
+    breakdowns = []
+    rebel_ids = []
+    rebels_per_votation = defaultdict(int)
+    for (vote_id, group_id), group_votes in grouped.items():
+        counts = defaultdict(int)
+        for _, voting in group_votes:
+            counts[voting] += 1
+        majority = majority_voting(counts)
+
+        rebels = [
+            vhc_id for vhc_id, voting in group_votes
+            if majority and voting in VH.VOTED and voting != majority
+        ]
+        rebel_ids.extend(rebels)
+        rebels_per_votation[vote_id] += len(rebels)
+
+        b = VotazioneGruppoBreakdown(
+            vote_id=vote_id, group_id=group_id,
+            majority_voting=majority, rebels=len(rebels)
+        )
+        for voting, n in counts.items():
+            field = COUNTERS.get(voting, 'altri')
+            setattr(b, field, getattr(b, field) + n)
+        breakdowns.append(b)
+
+    with transaction.atomic():
+        VotazioneGruppoBreakdown.objects.filter(vote_id__in=votation_ids).delete()
+        VotazioneGruppoBreakdown.objects.bulk_create(breakdowns, batch_size=1000)
+
+        VH.objects.filter(vote_id__in=votation_ids).update(rebel=0)
+        for i in range(0, len(rebel_ids), 1000):
+            VH.objects.filter(id__in=rebel_ids[i:i + 1000]).update(rebel=1)
+        # one update per distinct number of rebels
+        by_count = defaultdict(list)
+        for vote_id in votation_ids:
+            by_count[rebels_per_votation[vote_id]].append(vote_id)
+        for n, ids in by_count.items():
+            for i in range(0, len(ids), 1000):
+                Votazione.objects.filter(id__in=ids[i:i + 1000]).update(ribelli=n)
+
+    return len(breakdowns)
+
+
+def votation_breakdown(votation_id):
+    """
+    Return the stored group breakdown of a votation, as a list of dicts,
+    sorted by group size
+    """
+    rows = VotazioneGruppoBreakdown.objects.filter(vote_id=votation_id).values(
+        'group_id', 'group__name', 'group__acronym',
+        'favorevoli', 'contrari', 'astenuti', 'assenti', 'missioni', 'altri',
+        'majority_voting', 'rebels'
+    )
+    return sorted(
+        rows,
+        key=lambda r: -(r['favorevoli'] + r['contrari'] + r['astenuti'] +
+                        r['assenti'] + r['missioni'] + r['altri'])
+    )
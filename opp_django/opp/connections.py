@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Reuse of the DB connections.
+
+Connections are persistent (CONN_MAX_AGE in the DATABASES settings):
+the web tier keeps one connection per thread across requests, checking
+its health at the beginning of a request, at most once every
+DB_HEALTH_CHECK_INTERVAL seconds, and reopening it when it's broken
+(e.g. closed by the server after wait_timeout).
+
+Threads of the concurrent workers, that would open (and should close)
+a connection each, share a bounded pool of connections instead::
+
+    from opp.connections import pool
+    with pool.connection():
+        Votazione.objects.filter(...)
+
+Opened connections are counted in opp_db_connections_opened_total.
+"""
+from contextlib import contextmanager
+import threading
+import time
+from Queue import Queue, Empty
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.db.utils import load_backend
+from opp import metrics
+
+__author__ = 'guglielmo'
+
+
+def check_connection(conn):
+    """
+    close the connection if it's obsolete (older than CONN_MAX_AGE), or broken,
+    so that it's reopened at the next query
+    """
+    conn.close_if_unusable_or_obsolete()
+    if conn.connection is None:
+        return
+    now = time.time()
+    if now - getattr(conn, 'opp_checked_at', 0) < settings.DB_HEALTH_CHECK_INTERVAL:
+        return
+    conn.opp_checked_at = now
+    if not conn.is_usable():
+        conn.close()
+
+
+def check_connections(**kwargs):
+    """
+    health check of the persistent connections of the thread, at the beginning of each request
+    """
+    for conn in connections.all():
+        check_connection(conn)
+
+
+def count_connection(sender, connection, **kwargs):
+    metrics.db_connections_opened.inc(alias=connection.alias)
+
+
+request_started.connect(check_connections)
+connection_created.connect(count_connection)
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of connections to a DB, shared by threads.
+
+    A thread borrowing a connection uses it for all its queries to the DB,
+    in place of its own, until it gives it back; threads wait when all the
+    connections are borrowed.
+    """
+
+    def __init__(self, alias=DEFAULT_DB_ALIAS, size=None):
+        self.alias = alias
+        self.size = size or settings.DB_POOL_SIZE
+        self.idle = Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def new_connection(self):
+        db = connections.databases[self.alias]
+        backend = load_backend(db['ENGINE'])
+        # used by one thread at a time, handed over by the pool
+        return backend.DatabaseWrapper(db, self.alias, allow_thread_sharing=True)
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                return self.new_connection()
+            return self.idle.get()
+
+    def put(self, conn):
+        if conn.in_atomic_block:
+            # left within a transaction, discard it
+            conn.close()
+            with self.lock:
+                self.created -= 1
+            return
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        borrow a connection for the enclosed block
+        """
+        conn = self.get()
+        check_connection(conn)
+        own = connections[self.alias]
+        connections[self.alias] = conn
+        try:
+            yield conn
+        finally:
+            connections[self.alias] = own
+            self.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+
+
+pool = ConnectionPool()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Ideal points: a 2D map of the charges of a house, from their votes.
+
+For a time window (the whole legislature, or each of its years), the
+charges x votations matrix of the votes is built from VotazioneHasCarica,
+with favorevole = 1, contrario = -1, astenuto = 0, and missing values
+for absences, missions and charges not in office.
+
+Votations are centered, missing values are imputed by iterating a
+low-rank SVD reconstruction, and the first two principal components
+are the coordinates of the charges, stored in IdealPoint, with their
+group at the end of the window; groups sit at the mean of their members.
+
+Maps are recomputed only when new votations entered their window, so
+after an import only the current year and the whole legislature are::
+
+    from opp import idealpoints
+    idealpoints.compute_maps('C', 17, logger)
+
+Requires numpy.
+"""
+from datetime import date
+import numpy as np
+from django.db import transaction
+from django.db.models import Max, Min
+from opp.breakdown import group_at, group_memberships
+from opp.models import IdealPoint, IdealPointMap, Seduta, Votazione, VotazioneHasCarica
+
+__author__ = 'guglielmo'
+
+
+VH = VotazioneHasCarica
+
+VOTE_VALUES = {
+    VH.FAVOREVOLE: 1.0,
+    VH.CONTRARIO: -1.0,
+    VH.ASTENUTO: 0.0,
+}
+
+# charges with fewer votes, and votations with fewer voters, are left out
+MIN_VOTES = 20
+MIN_VOTERS = 50
+
+IMPUTE_ITERATIONS = 5
+
+LEGISLATURE_WINDOW = 'L'
+
+
+def windows(house, legislature):
+    """
+    the (label, start, end) windows of a legislature: the whole legislature, and each year
+    """
+    dates = Seduta.objects.filter(house=house, legislatura=legislature).aggregate(
+        first=Min('date'), last=Max('date')
+    )
+    first, last = dates['first'], dates['last']
+    if first is None:
+        return []
+    return [(LEGISLATURE_WINDOW, first, last)] + [
+        (str(year), max(first, date(year, 1, 1)), min(last, date(year, 12, 31)))
+        for year in range(first.year, last.year + 1)
+    ]
+
+
+def vote_matrix(house, legislature, start, end):
+    """
+    return the charge ids, the votation ids and the charges x votations matrix of the votes
+    in the window, with NaN for missing votes
+    """
+    rows = VH.objects.filter(
+        vote__sitting__house=house, vote__sitting__legislatura=legislature,
+        vote__sitting__date__gte=start, vote__sitting__date__lte=end,
+        voting__in=list(VOTE_VALUES)
+    ).values_list('charge_id', 'vote_id', 'voting').iterator()
+
+    charges, votes = {}, {}
+    r, c, v = [], [], []
+    for charge_id, vote_id, voting in rows:
+        r.append(charges.setdefault(charge_id, len(charges)))
+        c.append(votes.setdefault(vote_id, len(votes)))
+        v.append(VOTE_VALUES[voting])
+
+    matrix = np.empty((len(charges), len(votes)))
+    matrix.fill(np.nan)
+    matrix[r, c] = v
+
+    charge_ids = np.empty(len(charges), dtype=np.int64)
+    charge_ids[list(charges.values())] = list(charges.keys())
+    vote_ids = np.empty(len(votes), dtype=np.int64)
+    vote_ids[list(votes.values())] = list(votes.keys())
+    return charge_ids, vote_ids, matrix
+
+
+def filter_matrix(charge_ids, matrix):
+    """
+    leave out the votations with few voters, or unanimous, then the charges with few votes
+    """
+    observed = ~np.isnan(matrix)
+    spread = np.nanmax(matrix, axis=0) - np.nanmin(matrix, axis=0) if matrix.size else np.zeros(0)
+    columns = (observed.sum(axis=0) >= MIN_VOTERS) & (spread > 0)
+    matrix = matrix[:, columns]
+    rows = (~np.isnan(matrix)).sum(axis=1) >= MIN_VOTES
+    return charge_ids[rows], matrix[rows]
+
+
+def reduce(matrix, dims=2, iterations=IMPUTE_ITERATIONS):
+    """
+    return the coordinates of the rows on the first principal components of the centered matrix,
+    imputing missing values by the low-rank reconstruction, and the share of variance of each component
+    """
+    missing = np.isnan(matrix)
+    x = matrix - np.nanmean(matrix, axis=0)
+    x[missing] = 0.0
+    for i in range(iterations):
+        # left singular vectors and squared singular values, from the eigen decomposition
+        # of the (charges x charges) Gram matrix, much smaller than the matrix itself
+        eigenvalues, eigenvectors = np.linalg.eigh(np.dot(x, x.T))
+        order = np.argsort(eigenvalues)[::-1]
+        s2 = np.clip(eigenvalues[order], 0.0, None)
+        u = eigenvectors[:, order[:dims]]
+        if i == iterations - 1:
+            break
+        low_rank = np.dot(u, np.dot(u.T, x))
+        x[missing] = low_rank[missing]
+        x -= x.mean(axis=0)
+
+    coords = u * np.sqrt(s2[:dims])
+    return coords, s2[:dims] / s2.sum()
+
+
+def orient(coords, charge_ids, previous=None):
+    """
+    fix the arbitrary signs of the axes: as in the previous map of the window, when given
+    (a dict mapping the charges to their (x, y)), otherwise with the farthest charge on the positive side;
+    coordinates are scaled to [-1, 1]
+    """
+    for dim in range(coords.shape[1]):
+        sign = 0.0
+        if previous:
+            sign = sum(
+                coords[i, dim] * previous[charge_id][dim]
+                for i, charge_id in enumerate(charge_ids.tolist()) if charge_id in previous
+            )
+        if not sign:
+            sign = coords[np.argmax(np.abs(coords[:, dim])), dim]
+        scale = np.abs(coords[:, dim]).max() or 1.0
+        coords[:, dim] *= (1.0 if sign >= 0 else -1.0) / scale
+    return coords
+
+
+def last_votation_id(house, legislature, start, end):
+    """
+    the highest id of the votations of the window, or None:
+    it changes with any votation written since, backfilled ones included,
+    not only when a newer one is
+    """
+    return Votazione.objects.filter(
+        sitting__house=house, sitting__legislatura=legislature, sitting__date__gte=start, sitting__date__lte=end
+    ).aggregate(last=Max('id'))['last']
+
+
+def compute_map(house, legislature, window, start, end, force=False):
+    """
+    compute the map of a window, unless no votation entered it since the last time
+
+    returns the IdealPointMap, or None when unchanged or empty
+    """
+    last_id = last_votation_id(house, legislature, start, end)
+    if last_id is None:
+        return None
+    existing = IdealPointMap.objects.filter(house=house, legislatura=legislature, window=window).first()
+    if existing is not None and existing.last_vote_id == last_id and not force:
+        return None
+
+    charge_ids, vote_ids, matrix = vote_matrix(house, legislature, start, end)
+    charge_ids, matrix = filter_matrix(charge_ids, matrix)
+    if min(matrix.shape) < 2:
+        return None
+
+    coords, variance = reduce(matrix)
+    previous = None
+    if existing is not None:
+        previous = dict(
+            (charge_id, (x, y)) for charge_id, x, y in existing.points.values_list('charge_id', 'x', 'y')
+        )
+    coords = orient(coords, charge_ids, previous)
+
+    memberships = group_memberships(charge_ids.tolist())
+    n_votes = (~np.isnan(matrix)).sum(axis=1)
+    with transaction.atomic():
+        m = existing or IdealPointMap(house=house, legislatura=legislature, window=window)
+        m.start_date, m.end_date, m.last_vote_id = start, end, last_id
+        m.n_charges, m.n_votations = matrix.shape
+        m.variance_x, m.variance_y = float(variance[0]), float(variance[1])
+        m.save()
+        m.points.all().delete()
+        IdealPoint.objects.bulk_create([
+            IdealPoint(
+                map=m, charge_id=int(charge_id), group_id=group_at(memberships[charge_id], end),
+                x=float(coords[i, 0]), y=float(coords[i, 1]), n_votes=int(n_votes[i])
+            )
+            for i, charge_id in enumerate(charge_ids.tolist())
+        ], batch_size=500)
+    return m
+
+
+def compute_maps(house, legislature, logger, force=False, only=None):
+    """
+    compute the maps of the windows of a legislature (or just the only one), when new votations entered them
+    """
+    for window, start, end in windows(house, legislature):
+        if only is not None and window != only:
+            continue
+        m = compute_map(house, legislature, window, start, end, force=force)
+        if m is None:
+            logger.info("map {0}{1} {2} unchanged".format(house, legislature, window))
+        else:
+            logger.info("map {0}{1} {2}: {3} charges, {4} votations, variance {5:.2f} {6:.2f}".format(
+                house, legislature, window, m.n_charges, m.n_votations, m.variance_x, m.variance_y
+            ))
+
+
+def map_points(house, legislature, window=LEGISLATURE_WINDOW):
+    """
+    return the map of a window, with the points of the charges and of the groups (the mean of their members),
+    or None
+    """
+    m = IdealPointMap.objects.filter(house=house, legislatura=legislature, window=window).first()
+    if m is None:
+        return None
+
+    points = list(m.points.values_list('charge_id', 'group_id', 'x', 'y', 'n_votes'))
+    members = {}
+    for _, group_id, x, y, _ in points:
+        if group_id is not None:
+            members.setdefault(group_id, []).append((x, y))
+    return {
+        'ramo': house,
+        'legislatura': legislature,
+        'finestra': window,
+        'dal': m.start_date.isoformat(),
+        'al': m.end_date.isoformat(),
+        'votazioni': m.n_votations,
+        'varianza': [m.variance_x, m.variance_y],
+        'cariche': [
+            {'id': charge_id, 'gruppo': group_id, 'x': x, 'y': y, 'voti': n_votes}
+            for charge_id, group_id, x, y, n_votes in points
+        ],
+        'gruppi': [
+            {
+                'id': group_id,
+                'x': sum(p[0] for p in xy) / len(xy),
+                'y': sum(p[1] for p in xy) / len(xy),
+                'membri': len(xy),
+            }
+            for group_id, xy in members.items()
+        ],
+    }
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+SQL queries instrumentation.
+
+Counts the queries issued within a block of code, their total DB time and the
+duplicated ones (same statement, modulo parameters), that usually reveal N+1 patterns.
+
+Used by:
+
+  - QueryCountMiddleware, logging the figures for each web request
+  - ImportCommand, with the --profile-queries option
+  - QueryBudgetTestMixin, to assert query budgets in tests
+  - the benchmark_queries command, explaining the queries (see opp.queryplans)
+
+a simple usage::
+
+    from opp.instrumentation import QueryRecorder
+    with QueryRecorder() as recorder:
+        writer.write_votations(sittings)
+    print(recorder.report())
+"""
+import ast
+from collections import defaultdict
+import logging
+import re
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.util import CursorDebugWrapper
+from django.test.utils import CaptureQueriesContext
+
+__author__ = 'guglielmo'
+
+
+logger = logging.getLogger('queries')
+
+literals_regexp = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+in_list_regexp = re.compile(r"\bIN \((?:(?:\?|%s), )*(?:\?|%s)\)", re.IGNORECASE)
+
+# queries logged by the backends not interpolating the parameters (SQLite, on Django 1.6)
+uninterpolated_regexp = re.compile(r"^QUERY = (u?'.*'|u?\".*\") - PARAMS = .*$", re.DOTALL)
+
+
+def logged_statement(sql):
+    """
+    Return the statement of a logged query, with the placeholders
+    of the parameters, when the backend did not interpolate them
+    """
+    m = uninterpolated_regexp.match(sql)
+    return ast.literal_eval(m.group(1)) if m else sql
+
+
+def normalize_sql(sql):
+    """
+    Replace literals in the SQL statement with placeholders,
+    so that the same query with different parameters is counted once
+    """
+    sql = literals_regexp.sub('?', logged_statement(sql))
+    return in_list_regexp.sub('IN (...)', sql)
+
+
+class ParamsCursorDebugWrapper(CursorDebugWrapper):
+    """
+    Debug cursor also recording the statement and the parameters of each query,
+    in the statement and params keys, as backends log them differently
+    (MySQL interpolates them, SQLite does not)
+    """
+
+    def execute(self, sql, params=None):
+        try:
+            return super(ParamsCursorDebugWrapper, self).execute(sql, params)
+        finally:
+            self.db.queries[-1].update(statement=sql, params=params)
+
+
+class QueryRecorder(CaptureQueriesContext):
+    """
+    Context manager recording the queries executed on a connection.
+
+    Queries are captured through the debug cursor,
+    so this works even when settings.DEBUG is False;
+    with params, the statements and their parameters are recorded too.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, params=False):
+        super(QueryRecorder, self).__init__(connections[using])
+        self.params = params
+
+    def __enter__(self):
+        if self.params:
+            connection = self.connection
+            connection.make_debug_cursor = lambda cursor: ParamsCursorDebugWrapper(cursor, connection)
+        return super(QueryRecorder, self).__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.params:
+            del self.connection.make_debug_cursor
+        super(QueryRecorder, self).__exit__(exc_type, exc_value, traceback)
+
+    @property
+    def count(self):
+        return len(self)
+
+    @property
+    def total_time(self):
+        """total DB time, in seconds"""
+        return sum(float(q['time']) for q in self.captured_queries)
+
+    def statements(self):
+        """
+        Return the list of (normalized sql, count, total time) tuples,
+        sorted by decreasing total time
+        """
+        stats = defaultdict(lambda: [0, 0.0])
+        for q in self.captured_queries:
+            s = stats[normalize_sql(q['sql'])]
+            s[0] += 1
+            s[1] += float(q['time'])
+        return sorted(
+            ((sql, n, t) for sql, (n, t) in stats.items()),
+            key=lambda x: (x[2], x[1]), reverse=True
+        )
+
+    @property
+    def duplicates(self):
+        """number of queries repeating an already executed statement"""
+        return sum(n - 1 for _, n, _ in self.statements())
+
+    def summary(self):
+        return {
+            'queries': self.count,
+            'db_time': round(self.total_time, 4),
+            'duplicates': self.duplicates,
+        }
+
+    def report(self, limit=10):
+        """
+        Return a textual report, with the worst offending statements
+        """
+        lines = ["{queries} queries, {db_time}s DB time, {duplicates} duplicates".format(**self.summary())]
+        for sql, n, t in self.statements()[:limit]:
+            lines.append("  {0:6d}x {1:8.3f}s  {2}".format(n, t, sql[:200]))
+        return "\n".join(lines)
+
+
+class ThreadQueryRecorder(QueryRecorder):
+    """
+    A QueryRecorder for the queries of a request: the connection of the thread
+    logs them, and they're read from an offset in its log; the request_started
+    signal, shared by all the threads, is left alone
+    """
+
+    def __enter__(self):
+        self.use_debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        self.initial_queries = len(self.connection.queries)
+        self.final_queries = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.use_debug_cursor = self.use_debug_cursor
+        if exc_type is None:
+            self.final_queries = len(self.connection.queries)
+
+
+class QueryCountMiddleware(object):
+    """
+    Record the number of queries, the DB time and the duplicated queries
+    of each request.
+
+    Figures are logged on the queries logger (as warnings when more than
+    settings.QUERY_COUNT_WARNING_THRESHOLD queries are issued) and returned
+    in the X-Query-Count, X-Query-Time and X-Query-Duplicates headers.
+    """
+
+    def process_request(self, request):
+        request._query_recorder = ThreadQueryRecorder()
+        request._query_recorder.__enter__()
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_query_recorder', None)
+        if recorder is None:
+            return response
+        recorder.__exit__(None, None, None)
+        del request._query_recorder
+
+        summary = recorder.summary()
+        response['X-Query-Count'] = str(summary['queries'])
+        response['X-Query-Time'] = str(summary['db_time'])
+        response['X-Query-Duplicates'] = str(summary['duplicates'])
+
+        threshold = getattr(settings, 'QUERY_COUNT_WARNING_THRESHOLD', 50)
+        if summary['queries'] > threshold:
+            logger.warning("{0} {1}: {2}".format(request.method, request.path, recorder.report(limit=5)))
+        else:
+            logger.debug("{0} {1}: {queries} queries, {db_time}s DB time, {duplicates} duplicates".format(
+                request.method, request.path, **summary
+            ))
+        return response
+
+
+class QueryBudgetTestMixin(object):
+    """
+    TestCase mixin to assert query budgets of views and import steps::
+
+        class VotationViewsTest(QueryBudgetTestMixin, TestCase):
+            def test_breakdown(self):
+                with self.assertMaxQueries(2):
+                    self.client.get('/api/votazioni/1/gruppi/')
+    """
+
+    def assertMaxQueries(self, max_queries, using=DEFAULT_DB_ALIAS, max_duplicates=None):
+        return _AssertMaxQueriesContext(self, max_queries, using, max_duplicates)
+
+
+class _AssertMaxQueriesContext(QueryRecorder):
+
+    def __init__(self, test_case, max_queries, using, max_duplicates):
+        self.test_case = test_case
+        self.max_queries = max_queries
+        self.max_duplicates = max_duplicates
+        super(_AssertMaxQueriesContext, self).__init__(using=using)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_AssertMaxQueriesContext, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        self.test_case.assertTrue(
+            self.count <= self.max_queries,
+            "{0} queries executed, budget was {1}\n{2}".format(self.count, self.max_queries, self.report())
+        )
+        if self.max_duplicates is not None:
+            self.test_case.assertTrue(
+                self.duplicates <= self.max_duplicates,
+                "{0} duplicated queries, budget was {1}\n{2}".format(
+                    self.duplicates, self.max_duplicates, self.report()
+                )
+            )
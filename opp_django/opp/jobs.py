@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+A DB-backed jobs queue, for the import tasks.
+
+Jobs are rows of the ``opp_job`` table, so the queue works on SQLite or MySQL,
+with no external broker. Workers lease jobs with an optimistic, conditional UPDATE,
+keep the lease alive with heartbeats while the task runs, and complete them.
+Failed jobs are retried with exponential backoff; jobs whose lease expired
+(a worker died) are leased again by other workers.
+
+The number of jobs running at once for each house can be limited,
+not to hammer the houses websites.
+
+The pages touched by the jobs are published (see opp.pagecache) once
+per burst of jobs, when the queue is drained, not after each job, so that
+the data version is bumped once per burst; a worker kept busy publishes
+at least every publish_seconds.
+
+Tasks are plain functions registered with the ``task`` decorator::
+
+    @jobs.task('import_sitting')
+    def import_sitting(args, logger):
+        ...
+
+    jobs.enqueue('import_sitting', {'date': '2014-03-05'}, house='C')
+"""
+from datetime import timedelta
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from opp import pagecache
+from opp.connections import check_connections, pool
+from opp.models import Job
+from opp.routers import mark_primary_written, primary_only, pin_to_primary
+
+__author__ = 'guglielmo'
+
+
+logger = logging.getLogger('management')
+
+# task name -> function
+registry = {}
+
+
+def task(name):
+    """
+    decorator registering a task function
+    """
+    def register(func):
+        registry[name] = func
+        return func
+    return register
+
+
+def job_key(task_name, args):
+    return "{0}:{1}".format(task_name, json.dumps(args, sort_keys=True))[:255]
+
+
+@primary_only
+def enqueue(task_name, args, house='C', priority=0, max_attempts=5, delay=0, debounce=False):
+    """
+    enqueue a job, unless the same job is already pending;
+    with debounce, a pending job is postponed to run delay seconds from now,
+    so that it runs once, after a burst of enqueues
+
+    returns the job and whether it was enqueued
+    """
+    key = job_key(task_name, args)
+    run_after = timezone.now() + timedelta(seconds=delay)
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(
+                task=task_name, args=json.dumps(args), key=key, house=house,
+                priority=priority, max_attempts=max_attempts, run_after=run_after
+            )
+        return job, True
+    except IntegrityError:
+        if debounce:
+            Job.objects.filter(key=key, status=Job.QUEUED).update(run_after=run_after)
+        # re-enqueue completed jobs, leave pending ones alone
+        n = Job.objects.filter(key=key, status__in=(Job.DONE, Job.FAILED)).update(
+            status=Job.QUEUED, attempts=0, run_after=run_after, priority=priority,
+            leased_by='', lease_expires=None, last_error=''
+        )
+        return Job.objects.get(key=key), bool(n)
+
+
+class Worker(object):
+    """
+    Leases and runs jobs, until the queue is empty (burst mode) or forever.
+
+    :house_limits: a dict mapping houses to the max number of jobs running at once
+    """
+
+    def __init__(self, house_limits=None, lease_seconds=300, heartbeat_seconds=60,
+                 poll_seconds=5, backoff_seconds=60, publish_seconds=600, name=None):
+        self.house_limits = house_limits or {}
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.backoff_seconds = backoff_seconds
+        self.publish_seconds = publish_seconds
+        self.published_at = time.time()
+        self.name = name or "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+    def running_per_house(self, now):
+        running = Job.objects.filter(status=Job.RUNNING, lease_expires__gt=now)
+        return dict(running.values_list('house').annotate(n=Count('id')))
+
+    def lease(self):
+        """
+        lease the next runnable job, respecting the per-house limits.
+
+        returns the job, or None
+        """
+        now = timezone.now()
+        running = self.running_per_house(now)
+        full_houses = [h for h, limit in self.house_limits.items() if running.get(h, 0) >= limit]
+
+        candidates = (
+            Job.objects.filter(status=Job.QUEUED, run_after__lte=now) |
+            Job.objects.filter(status=Job.RUNNING, lease_expires__lte=now)
+        ).exclude(house__in=full_houses).order_by('-priority', 'run_after')
+
+        for job in candidates[:10]:
+            leased = Job.objects.filter(id=job.id, version=job.version).update(
+                status=Job.RUNNING, leased_by=self.name, version=F('version') + 1,
+                lease_expires=now + timedelta(seconds=self.lease_seconds),
+                attempts=F('attempts') + 1
+            )
+            if not leased:
+                # another worker was faster
+                continue
+
+            # check the limit again, as other workers may have leased concurrently
+            limit = self.house_limits.get(job.house)
+            if limit is not None and self.running_per_house(now).get(job.house, 0) > limit:
+                Job.objects.filter(id=job.id, leased_by=self.name).update(
+                    status=Job.QUEUED, leased_by='', lease_expires=None, attempts=F('attempts') - 1
+                )
+                return None
+            return Job.objects.get(id=job.id)
+
+        return None
+
+    def heartbeat(self, job, stop):
+        while not stop.wait(self.heartbeat_seconds):
+            # a pooled connection, not to open one in each heartbeat thread
+            with pool.connection():
+                Job.objects.filter(id=job.id, leased_by=self.name, status=Job.RUNNING).update(
+                    lease_expires=timezone.now() + timedelta(seconds=self.lease_seconds)
+                )
+
+    def run_job(self, job):
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self.heartbeat, args=(job, stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            registry[job.task](json.loads(job.args), logger)
+        except Exception:
+            error = traceback.format_exc()
+            logger.error("job {0} {1} failed (attempt {2}/{3}):\n{4}".format(
+                job.id, job.key, job.attempts, job.max_attempts, error
+            ))
+            if job.attempts >= job.max_attempts:
+                Job.objects.filter(id=job.id, leased_by=self.name).update(
+                    status=Job.FAILED, lease_expires=None, last_error=error
+                )
+            else:
+                delay = self.backoff_seconds * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+                Job.objects.filter(id=job.id, leased_by=self.name).update(
+                    status=Job.QUEUED, lease_expires=None, last_error=error,
+                    run_after=timezone.now() + timedelta(seconds=delay)
+                )
+        else:
+            Job.objects.filter(id=job.id, leased_by=self.name).update(status=Job.DONE, lease_expires=None)
+            mark_primary_written()
+            logger.info("job {0} {1} done".format(job.id, job.key))
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def publish(self):
+        """
+        publish the pages touched by the jobs run since the last time
+        """
+        pagecache.publish(logger)
+        self.published_at = time.time()
+
+    def run(self, burst=False):
+        """
+        lease and run jobs; in burst mode, return when no job is runnable
+
+        the queue, as the import tasks, is only read from the primary DB
+        """
+        logger.info("worker {0} started".format(self.name))
+        with pin_to_primary():
+            while True:
+                check_connections()
+                job = self.lease()
+                if job is not None:
+                    self.run_job(job)
+                    if time.time() - self.published_at > self.publish_seconds:
+                        self.publish()
+                    continue
+
+                # no runnable job: the burst is over
+                self.publish()
+                if burst and not Job.objects.filter(status__in=(Job.QUEUED, Job.RUNNING)).exists():
+                    break
+                time.sleep(self.poll_seconds)
+        logger.info("worker {0} stopped".format(self.name))
+
@@ -3,9 +3,18 @@ Base classes for opp management commands.
 
 
 """
+import cProfile
+from datetime import datetime
+import json
 import logging
+import time
 from optparse import make_option
 from django.core.management.base import LabelCommand, BaseCommand
+from opp import metrics, pagecache, timing
+from opp.instrumentation import QueryRecorder
+import opp.connections  # health checks of the persistent DB connections
+from opp.routers import mark_primary_written, pin_to_primary
+from parser.diff import OppDBVotationsDiff
 
 __author__ = 'guglielmo'
 
@@ -23,7 +32,29 @@ class ImportCommand(BaseCommand):
                     action='store_true',
                     dest='dry_run',
                     default=False,
-                    help='Execute without actually writing into the DB'
+                    help='Execute without actually writing into the DB, '
+                         'reporting the differences between the records read and the DB'
+        ),
+        make_option('--profile-queries',
+                    action='store_true',
+                    dest='profile_queries',
+                    default=False,
+                    help='Record the SQL queries issued and report the worst offenders at the end'
+        ),
+        make_option('--profile',
+                    dest='profile_file',
+                    default=None,
+                    help='Run under cProfile and dump the stats into this file (read them with pstats)'
+        ),
+        make_option('--stats-file',
+                    dest='stats_file',
+                    default=None,
+                    help='Append the JSON summary of the run (stages timing, memory) to this file'
+        ),
+        make_option('--metrics-file',
+                    dest='metrics_file',
+                    default=None,
+                    help='Write the run metrics into this file, in the Prometheus text format'
         ),
     )
 
@@ -45,6 +76,87 @@ class ImportCommand(BaseCommand):
         elif verbosity == '3':
             self.logger.setLevel(logging.DEBUG)
 
+    def report_diff(self, sittings, house='C', legislature=17):
+        """
+        Report what would be written for the sittings, in dry runs
+        """
+        differ = OppDBVotationsDiff(self.logger)
+        diff = differ.diff(sittings, house=house, legislature=legislature)
+        differ.report(diff)
+        return diff
+
+
+    def execute(self, *args, **options):
+        """
+        Wrap the whole run with the stage timers and a peak memory tracker,
+        then emit the summary of the run as JSON.
+
+        The run is also profiled with cProfile, when --profile is given, and its
+        queries are recorded, when --profile-queries is given.
+
+        All queries go to the primary DB, and reads are routed to the primary
+        for a while after the run, until the replica catches up.
+
+        After a successful run, the pages touched are warmed in the cache,
+        then the data version is bumped (see opp.pagecache).
+        """
+        logger = logging.getLogger(options.get('logger_alias', 'management'))
+
+        timing.timers.reset()
+        memory = timing.MemoryTracker()
+        memory.start()
+        recorder = QueryRecorder() if options.get('profile_queries') else None
+        profiler = cProfile.Profile() if options.get('profile_file') else None
+
+        command = self.__module__.split('.')[-1]
+        outcome = 'failure'
+        start = time.time()
+
+        if recorder:
+            recorder.__enter__()
+        if profiler:
+            profiler.enable()
+        try:
+            with pin_to_primary():
+                ret = super(ImportCommand, self).execute(*args, **options)
+            outcome = 'success'
+            return ret
+        finally:
+            if not options.get('dry_run'):
+                mark_primary_written()
+                if outcome == 'success':
+                    with timing.stage('warm'):
+                        pagecache.publish(logger)
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(options['profile_file'])
+                logger.info("profile stats written to {0}".format(options['profile_file']))
+            if recorder:
+                recorder.__exit__(None, None, None)
+                logger.info("queries profile:\n{0}".format(recorder.report(limit=20)))
+
+            metrics.import_runs.inc(command=command, outcome=outcome)
+            metrics.import_duration.observe(time.time() - start, command=command)
+            if options.get('metrics_file'):
+                metrics.registry.write_textfile(options['metrics_file'])
+
+            summary = timing.timers.summary()
+            summary.update({
+                'command': command,
+                'outcome': outcome,
+                'finished_at': datetime.now().isoformat(),
+                'memory': memory.stop(),
+            })
+            if recorder:
+                summary['queries'] = recorder.summary()
+            self.write_summary(summary, options.get('stats_file'), logger)
+
+    def write_summary(self, summary, stats_file, logger):
+        summary_json = json.dumps(summary, sort_keys=True)
+        logger.info("run summary: {0}".format(summary_json))
+        if stats_file:
+            with open(stats_file, 'a') as f:
+                f.write(summary_json + "\n")
 
     def handle(self, *labels, **options):
         """
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Results of the benchmark commands.
+
+Each run of a benchmark appends its results to a JSON Lines file,
+with the commit they were measured at; with --compare, they're compared
+with the last results stored for a different commit::
+
+    previous = benchmarks.previous_result(result, results_file)
+    regressions = benchmarks.compare(result, previous, COMPARED, logger)
+    benchmarks.store(result, results_file)
+"""
+import json
+import os
+import subprocess
+from django.conf import settings
+
+__author__ = 'guglielmo'
+
+
+# changes within this percentage are not regressions
+REGRESSION_PERCENT = 10
+
+
+def git_commit():
+    """
+    the short hash of the current commit, or None, out of a git checkout
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.REPO_ROOT
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_result(result, results_file, same=()):
+    """
+    return the last results stored for a commit different from the result's,
+    with the same values of the keys in same, or None
+    """
+    previous = None
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            for line in f:
+                r = json.loads(line)
+                if r['commit'] != result['commit'] and all(r.get(key) == result.get(key) for key in same):
+                    previous = r
+    return previous
+
+
+def compare(result, previous, compared, logger, regression_percent=REGRESSION_PERCENT):
+    """
+    log the changes of the compared values since the previous results
+
+    :compared: (key, whether higher values are better) tuples
+
+    returns the keys regressed by more than regression_percent
+    """
+    if previous is None:
+        logger.warning("no previous results to compare with")
+        return []
+
+    logger.info("compared with commit {0}, of {1}".format(previous['commit'], previous['timestamp']))
+    regressions = []
+    for key, higher_is_better in compared:
+        old, new = previous.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        delta = 100.0 * (new - old) / old
+        regression = (delta < 0 if higher_is_better else delta > 0) and abs(delta) > regression_percent
+        if regression:
+            regressions.append(key)
+        logger.info("  {0:28s} {1:10.2f} -> {2:10.2f} ({3:+.1f}%){4}".format(
+            key, old, new, delta, '  REGRESSION' if regression else ''
+        ))
+    return regressions
+
+
+def store(result, results_file):
+    """
+    append the results to the file
+    """
+    dirname = os.path.dirname(os.path.abspath(results_file))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(results_file, 'a') as f:
+        f.write(json.dumps(result, sort_keys=True) + "\n")
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime, timedelta
+from optparse import make_option
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from opp import breakdown, profiles, queryplans, reconcile, votecounts
+from opp.instrumentation import QueryRecorder
+from opp.management import benchmarks
+from opp.models import CumulativeVoteCount, Votazione, VotazioneAtto, VotazioneGruppoBreakdown, \
+    VotazioneHasCarica
+
+__author__ = 'guglielmo'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Explain the queries of the key views and import steps, and benchmark them
+    """
+    help = "Record the queries issued by the key views and import steps on the local DB, " \
+           "explain them, flag full scans and filesorts, suggest indexes, and time them; " \
+           "with --compare, fail when a plan or a timing regressed since a different commit. " \
+           "Run it on a DB seeded with seed_benchmark_db, for comparable results"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat',
+                    dest='repeat',
+                    type='int',
+                    default=5,
+                    help='Times each query is timed (the median is kept). Defaults to 5.'),
+        make_option('--results',
+                    dest='results',
+                    default=settings.QUERY_PLANS_RESULTS_FILE,
+                    help='Append the results to this file. Defaults to settings.QUERY_PLANS_RESULTS_FILE.'),
+        make_option('--compare',
+                    action='store_true',
+                    dest='compare',
+                    default=False,
+                    help='Compare the results with the last ones stored for a different commit, '
+                         'failing on regressions'),
+        make_option('--house',
+                    dest='house',
+                    default='C',
+                    help='The house of the sampled records. Defaults to C.'),
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature of the sampled records. Defaults to 17.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    # timings regress when slower by this ratio, and this many milliseconds
+    TIME_REGRESSION_RATIO = 1.5
+    TIME_REGRESSION_MIN_MS = 2.0
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        house, legislature = options['house'], int(options['legislature'])
+        recorded, queries = [], {}
+        try:
+            with transaction.atomic():
+                for name, run in self.scenarios(house, legislature):
+                    with QueryRecorder(params=True) as recorder:
+                        run()
+                    self.logger.info("{0:32s} {1}".format(name, recorder.report(limit=0)))
+                    recorded.extend((name, q) for q in recorder.captured_queries)
+
+                plans = queryplans.explain_all([q for _, q in recorded])
+                scenario_of = dict(
+                    (queryplans.fingerprint(queryplans.statement(q)[0]), name) for name, q in reversed(recorded)
+                )
+                for plan in plans:
+                    queries[plan.fingerprint] = dict(
+                        plan.as_dict(), scenario=scenario_of[plan.fingerprint],
+                        time_ms=self.time_query(plan.sql, plan.params, options['repeat'])
+                    )
+                    if plan.flags:
+                        self.logger.warning(plan.report())
+                raise Rollback()
+        except Rollback:
+            pass
+
+        result = {
+            'commit': benchmarks.git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'vendor': connection.vendor,
+            'queries': queries,
+        }
+        self.logger.info("{0} distinct queries explained, {1} flagged, {2} indexes suggested".format(
+            len(queries),
+            sum(1 for q in queries.values() if q['flags']),
+            len(set(s for q in queries.values() for s in q['suggestions']))
+        ))
+
+        regressions = self.compare(result, options['results']) if options['compare'] else []
+        benchmarks.store(result, options['results'])
+        if regressions:
+            raise CommandError("{0} queries regressed:\n{1}".format(len(regressions), "\n".join(regressions)))
+
+    def scenarios(self, house, legislature):
+        """
+        the (name, function) of the views and import steps benchmarked,
+        on records sampled from the DB (see seed_benchmark_db)
+        """
+        votation_id = Votazione.objects.filter(
+            sitting__house=house, sitting__legislatura=legislature
+        ).order_by('-id').values_list('id', flat=True).first()
+        if votation_id is None:
+            raise CommandError("no votations in the DB, for {0}{1}; seed it with seed_benchmark_db".format(
+                house, legislature
+            ))
+        charge_id = VotazioneHasCarica.objects.filter(vote_id=votation_id).values_list('charge_id', flat=True).first()
+        group_id = VotazioneGruppoBreakdown.objects.filter(
+            vote_id=votation_id
+        ).values_list('group_id', flat=True).first()
+        act = VotazioneAtto.objects.filter(house=house, legislatura=legislature).first()
+        today = date.today()
+
+        paths = [
+            reverse('votation-group-breakdown', kwargs={'votation_id': votation_id}),
+            reverse('votations-search') + '?q=legge',
+            reverse('import-status', kwargs={'house': house, 'legislature': legislature}),
+        ]
+        if charge_id is not None:
+            paths += [
+                reverse('charge-profile', kwargs={'charge_id': charge_id}),
+                reverse('charge-vote-counts', kwargs={'charge_id': charge_id}),
+                reverse('politician-history', kwargs={'chi_id': charge_id, 'metric': 'presenze'}),
+            ]
+        if group_id is not None:
+            paths.append(reverse('group-vote-counts', kwargs={'group_id': group_id}))
+        if act is not None:
+            paths.append(reverse('act-votations', kwargs={
+                'house': house, 'legislature': legislature, 'act_type': act.act_type, 'number': act.act_number
+            }))
+
+        scenarios = [('GET ' + path, lambda path=path: self.get(path)) for path in paths]
+        scenarios += [
+            ('reconcile.sittings_status', lambda: reconcile.sittings_status(house, legislature)),
+            ('breakdown.compute_breakdowns', lambda: breakdown.compute_breakdowns([votation_id])),
+        ]
+        if charge_id is not None:
+            scenarios += [
+                ('votecounts.window', lambda: votecounts.window(
+                    CumulativeVoteCount.CHARGE, charge_id, today - timedelta(days=365), today
+                )),
+                ('votecounts.rebuild', lambda: votecounts.rebuild(
+                    CumulativeVoteCount.CHARGE, [charge_id], since=today - timedelta(days=30)
+                )),
+                ('profiles.build_documents', lambda: profiles.build_documents([charge_id])),
+            ]
+        return scenarios
+
+    @staticmethod
+    def get(path):
+        """
+        render the page with its view, bypassing the responses cache
+        """
+        match = resolve(path.split('?', 1)[0])
+        view = getattr(match.func, 'render', match.func)
+        return view(RequestFactory().get(path), *match.args, **match.kwargs)
+
+    @staticmethod
+    def time_query(sql, params, repeat):
+        cursor = connection.cursor()
+        timings = []
+        try:
+            for _ in range(repeat):
+                start = time.time()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                timings.append((time.time() - start) * 1000.0)
+        finally:
+            cursor.close()
+        timings.sort()
+        return round(timings[len(timings) // 2], 3)
+
+    def compare(self, result, results_file):
+        """
+        compare the plans and timings with the last results of a different commit, on the same vendor;
+        returns the descriptions of the regressions
+        """
+        previous = benchmarks.previous_result(result, results_file, same=('vendor', ))
+        if previous is None:
+            self.logger.warning("no previous results to compare with")
+            return []
+
+        self.logger.info("compared with commit {0}, of {1}".format(previous['commit'], previous['timestamp']))
+        regressions = []
+        for key, new in sorted(result['queries'].items()):
+            old = previous['queries'].get(key)
+            if old is None:
+                continue
+            added_flags = set(map(tuple, new['flags'])) - set(map(tuple, old['flags']))
+            if new['plan'] != old['plan'] and added_flags:
+                regressions.append("  {0} ({1}) plan: {2} -> {3}, now {4}".format(
+                    key, new['scenario'], old['plan'], new['plan'],
+                    ', '.join('{1} on {0}'.format(*flag) for flag in sorted(added_flags))
+                ))
+            if new['time_ms'] > old['time_ms'] * self.TIME_REGRESSION_RATIO and \
+                    new['time_ms'] - old['time_ms'] > self.TIME_REGRESSION_MIN_MS:
+                regressions.append("  {0} ({1}) time: {2:.1f} -> {3:.1f} ms".format(
+                    key, new['scenario'], old['time_ms'], new['time_ms']
+                ))
+        for regression in regressions:
+            self.logger.warning(regression)
+        return regressions
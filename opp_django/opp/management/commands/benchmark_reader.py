@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import json
+from optparse import make_option
+import logging
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from opp import metrics, timing
+from opp.management import benchmarks
+from parser import ratelimit
+from parser.replay import Corpus, ReplayServer, ReplayVotationsReader
+from parser.writers import OppDBVotationsWriter
+
+__author__ = 'guglielmo'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the reader (and optionally the DB writer) over the recorded corpus
+    """
+    help = "Measure Camera17VotationsReader.read() throughput, per-page parse time " \
+           "and DB write rate, replaying the recorded corpus through a local stand-in server"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--corpus',
+                    dest='corpus',
+                    default=settings.SCRAPER_CORPUS_ROOT,
+                    help='The corpus directory. Defaults to settings.SCRAPER_CORPUS_ROOT.'),
+        make_option('--latency',
+                    dest='latency',
+                    type='float',
+                    default=0.0,
+                    help='Average latency of the stand-in server, in milliseconds. Defaults to 0.'),
+        make_option('--error-rate',
+                    dest='error_rate',
+                    type='float',
+                    default=0.0,
+                    help='Rate of simulated 503 errors of the stand-in server, in [0, 1]. Defaults to 0.'),
+        make_option('--retries',
+                    dest='retries',
+                    type='int',
+                    default=5,
+                    help='Retries of a failed request; pages failing all of them are counted '
+                         'and left out. Defaults to 5.'),
+        make_option('--write-db',
+                    action='store_true',
+                    dest='write_db',
+                    default=False,
+                    help='Also write the records into the DB, within a transaction rolled back at the end'),
+        make_option('--results',
+                    dest='results',
+                    default=settings.BENCHMARK_RESULTS_FILE,
+                    help='Append the results to this file. Defaults to settings.BENCHMARK_RESULTS_FILE.'),
+        make_option('--compare',
+                    action='store_true',
+                    dest='compare',
+                    default=False,
+                    help='Compare the results with the last ones stored for a different commit'),
+    )
+
+    logger = logging.getLogger('management')
+
+    # results compared with --compare, and whether higher values are better
+    COMPARED = (
+        ('votations_per_s', True),
+        ('pages_per_s', True),
+        ('parse_mean_ms', False),
+        ('db_rows_per_s', True),
+    )
+
+    def handle(self, *args, **options):
+        corpus = Corpus(options['corpus'])
+        if not len(corpus):
+            raise CommandError("empty corpus in {0}, record it with record_camera_corpus".format(options['corpus']))
+
+        server = ReplayServer(corpus, latency=options['latency'] / 1000.0, error_rate=options['error_rate'])
+        server.start()
+        os.environ['HTTP_PROXY'] = os.environ['http_proxy'] = server.proxy_url
+
+        reader = ReplayVotationsReader(self.logger, retries=options['retries'])
+        # the stand-in server is not rate limited
+        ratelimit.limits = ratelimit.HostLimits()
+
+        timing.timers.reset()
+        metrics.registry.reset()
+        start = time.time()
+        sittings = reader.read(corpus.months)
+        read_s = time.time() - start
+        server.shutdown()
+
+        n_votations = sum(len(s.votations) for s in sittings)
+        n_pages = sum(v for _, _, v in metrics.pages_fetched.samples())
+        parse = timing.timers.histograms['parse'].as_dict()
+        result = {
+            'commit': benchmarks.git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'latency_ms': options['latency'],
+            'error_rate': options['error_rate'],
+            'months': corpus.months,
+            'pages': n_pages,
+            'failed_pages': len(reader.failed),
+            'votations': n_votations,
+            'read_s': round(read_s, 3),
+            'votations_per_s': round(n_votations / read_s, 2),
+            'pages_per_s': round(n_pages / read_s, 2),
+            'parse_mean_ms': parse['mean_ms'],
+            'parse_p95_ms': parse['p95_ms'],
+            'server': server.stats,
+        }
+
+        if options['write_db']:
+            result.update(self.benchmark_writer(sittings))
+
+        self.logger.info("benchmark results: {0}".format(json.dumps(result, sort_keys=True)))
+        if reader.failed:
+            self.logger.warning("{0} pages failed after {1} retries, their records were left out".format(
+                len(reader.failed), options['retries']
+            ))
+        if options['compare']:
+            self.compare(result, options['results'])
+        benchmarks.store(result, options['results'])
+
+    def benchmark_writer(self, sittings):
+        metrics.rows_written.reset()
+        writer = OppDBVotationsWriter(self.logger)
+        start = time.time()
+        try:
+            with transaction.atomic():
+                writer.write_sittings(sittings)
+                writer.write_votations(sittings)
+                write_s = time.time() - start
+                raise Rollback()
+        except Rollback:
+            pass
+
+        n_rows = sum(v for _, _, v in metrics.rows_written.samples())
+        return {
+            'db_rows': n_rows,
+            'write_s': round(write_s, 3),
+            'db_rows_per_s': round(n_rows / write_s, 2),
+        }
+
+    def compare(self, result, results_file):
+        """
+        compare the results with the last ones of a different commit;
+        returns the keys regressed by more than benchmarks.REGRESSION_PERCENT
+        """
+        previous = benchmarks.previous_result(result, results_file)
+        return benchmarks.compare(result, previous, self.COMPARED, self.logger)
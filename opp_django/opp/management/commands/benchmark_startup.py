@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from optparse import make_option
+import logging
+import os
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from opp.management import benchmarks
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the startup time of the management commands
+    """
+    help = "Measure the startup time of the management commands, and of the imports weighing on it, " \
+           "each in a fresh interpreter"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat',
+                    dest='repeat',
+                    type='int',
+                    default=5,
+                    help='Runs of each measure; the median is taken. Defaults to 5.'),
+        make_option('--results',
+                    dest='results',
+                    default=settings.STARTUP_BENCHMARK_RESULTS_FILE,
+                    help='Append the results to this file. Defaults to settings.STARTUP_BENCHMARK_RESULTS_FILE.'),
+        make_option('--compare',
+                    action='store_true',
+                    dest='compare',
+                    default=False,
+                    help='Compare the results with the last ones stored for a different commit'),
+    )
+
+    logger = logging.getLogger('management')
+
+    # name -> arguments of the python interpreter, run from the project root
+    MEASURES = (
+        ('python', ['-c', 'pass']),
+        ('watermark_precheck', ['-c', 'from parser.watermark import watched_urls; watched_urls("C")']),
+        ('django_setup', ['-c', 'from django.db.models.loading import get_models; get_models()']),
+        ('http_parsing_libs', ['-c', 'import requests, bs4']),
+        ('import_readers', ['-c', 'import parser.readers']),
+        ('manage_help', ['manage.py', 'help']),
+        ('import_votations_help', ['manage.py', 'import_votations', '--help']),
+        ('check_sedute_camera_help', ['manage.py', 'check_sedute_camera', '--help']),
+    )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'opp_django.settings.local'
+        ))
+        result = {
+            'commit': benchmarks.git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'repeat': options['repeat'],
+        }
+        for name, args in self.MEASURES:
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.time()
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.check_call([sys.executable] + args, cwd=settings.PROJECT_ROOT, env=env,
+                                          stdout=devnull, stderr=devnull)
+                timings.append((time.time() - start) * 1000.0)
+            timings.sort()
+            result[name + '_ms'] = round(timings[len(timings) // 2], 1)
+            self.logger.info("{0:28s} {1:8.1f} ms".format(name, result[name + '_ms']))
+
+        if options['compare']:
+            self.compare(result, options['results'])
+        benchmarks.store(result, options['results'])
+
+    def compare(self, result, results_file):
+        """
+        compare the timings with the last ones of a different commit;
+        returns the measures regressed by more than benchmarks.REGRESSION_PERCENT
+        """
+        previous = benchmarks.previous_result(result, results_file)
+        compared = [(name + '_ms', False) for name, _ in self.MEASURES]
+        return benchmarks.compare(result, previous, compared, self.logger)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand
+from opp import timeseries
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Build the compact time series of the politicians history cache
+    """
+    help = "Build the compact time series of the PoliticianHistoryCache metrics, " \
+           "for all politicians, a legislature or the given politicians (chi_id)"
+    args = "<chi_id chi_id ...>"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--legislature',
+                    dest='legislature',
+                    default=None,
+                    help='Only build the series of this legislature. Defaults to all.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    default=200,
+                    type='int',
+                    help='Number of politicians written at once. Defaults to 200.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *chi_ids, **options):
+        legislature = options['legislature']
+        n_series, n_chunks = timeseries.migrate(
+            legislatura=int(legislature) if legislature is not None else None,
+            chi_ids=[int(chi_id) for chi_id in chi_ids] or None,
+            batch_size=options['batch_size']
+        )
+        self.logger.info("{0} series chunks written, for {1} politicians and legislatures".format(
+            n_chunks, n_series
+        ))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand
+from opp import profiles
+from opp.models import Carica
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the profile documents of the charges
+    """
+    help = "Rebuild the precomputed profile documents of the charges of a legislature, " \
+           "or of the given charges. The import keeps them up to date."
+    args = "<charge_id charge_id ...>"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature of the charges. Defaults to 17.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    default=profiles.BATCH_SIZE,
+                    type='int',
+                    help='Number of profiles built at once. Defaults to {0}.'.format(profiles.BATCH_SIZE)),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *charge_ids, **options):
+        if charge_ids:
+            charge_ids = [int(charge_id) for charge_id in charge_ids]
+        else:
+            charge_ids = Carica.objects.filter(
+                legislatura=int(options['legislature'])
+            ).values_list('id', flat=True)
+        n = profiles.rebuild(charge_ids, batch_size=options['batch_size'])
+        self.logger.info("{0} charge profiles rebuilt".format(n))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand
+from opp import votecounts
+from opp.models import CumulativeVoteCount
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the cumulative vote counts of charges and groups
+    """
+    help = "Rebuild the cumulative vote counts (attendance and rebellions) of all charges and groups, " \
+           "or of the given charges or groups. The import keeps them up to date."
+    args = "<id id ...>"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--only',
+                    dest='only',
+                    type='choice',
+                    choices=['charges', 'groups'],
+                    default=None,
+                    help='Only rebuild the counts of charges, or of groups. Required with ids.'),
+        make_option('--since',
+                    dest='since',
+                    default=None,
+                    help='Only rebuild the counts from this date on (YYYY-MM-DD).'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    default=5000,
+                    type='int',
+                    help='Number of rows written at once. Defaults to 5000.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *ids, **options):
+        only = options['only']
+        if ids and only is None:
+            self.logger.error("--only is required, when passing ids")
+            return
+
+        owner_types = {
+            'charges': [CumulativeVoteCount.CHARGE],
+            'groups': [CumulativeVoteCount.GROUP],
+            None: [CumulativeVoteCount.CHARGE, CumulativeVoteCount.GROUP],
+        }[only]
+        for owner_type in owner_types:
+            n_rows = votecounts.rebuild(
+                owner_type,
+                owner_ids=[int(i) for i in ids] or None,
+                since=options['since'],
+                batch_size=options['batch_size']
+            )
+            self.logger.info("{0} cumulative vote counts written, for {1}".format(
+                n_rows, 'charges' if owner_type == CumulativeVoteCount.CHARGE else 'groups'
+            ))
@@ -5,9 +5,10 @@ import re
 from datetime import datetime, date, timedelta
 from django.core import management
 from django.core.management.base import BaseCommand
-import requests
-from bs4 import BeautifulSoup
 from opp.models import Seduta
+from parser.diff import OppDBVotationsDiff
+from parser import watermark
+from parser.registry import get_reader
 
 __author__ = 'guglielmo'
 class Command(BaseCommand):
@@ -26,6 +27,11 @@ class Command(BaseCommand):
                     dest='house',
                     default='C',
                     help='The house, may be (C)amera or (S)enato. Defaults to C.'),
+        make_option('--if-changed',
+                    dest='if_changed',
+                    action='store_true',
+                    default=False,
+                    help='Skip the check when the sittings index pages did not change since the last check'),
 
     )
 
@@ -52,13 +58,34 @@ class Command(BaseCommand):
 
         if house.lower() == 'c':
             self.handle_camera()
+            if self.dryrun:
+                pass
+            elif self.pending_sittings().exists():
+                # retried by the next run, even when the index pages did not change
+                watermark.discard('check_sedute_camera')
+            else:
+                watermark.commit()
         elif house.lower() == 's':
             self.handle_senato()
         else:
             raise Exception("Wrong house parameter, use C or S.")
 
 
+    def pending_sittings(self):
+        """
+        the sittings of the current and previous months, not imported yet
+        """
+        first = date.today().replace(day=1)
+        return Seduta.objects.filter(
+            house='C', legislatura=self.legislature, is_imported=0,
+            date__gte=(first - timedelta(days=1)).replace(day=1)
+        )
+
     def handle_camera(self, *args, **options):
+        # imported lazily, to keep the command startup fast
+        import requests
+        from bs4 import BeautifulSoup
+
         url_resoconti_assemblea = "http://www.camera.it/leg{}/207".format(self.legislature)
         url_seduta_reference = "http://www.camera.it/Leg{}/410".format(self.legislature)
 
@@ -70,6 +97,13 @@ class Command(BaseCommand):
         last_month_last_day = first - timedelta(days=1)
         last_ym = datetime.strftime(last_month_last_day, '%Y-%m')
 
+        if self.dryrun:
+            # read sittings, votations and votes, and report what would be written
+            reader = get_reader('C', self.legislature, logger=self.logger)
+            sittings = reader.read([last_ym, current_ym])
+            differ = OppDBVotationsDiff(self.logger)
+            differ.report(differ.diff(sittings, house='C', legislature=self.legislature))
+            return
 
         # loop over last and current year-month
         for ym in (last_ym, current_ym):
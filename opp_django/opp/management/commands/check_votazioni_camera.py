@@ -5,8 +5,7 @@ import re
 from django.core import management
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand, LabelCommand
-import requests
-from bs4 import BeautifulSoup
+from opp import acts, reconcile
 from opp.models import Seduta, Votazione
 
 
@@ -33,6 +32,9 @@ class Command(LabelCommand):
     logger = logging.getLogger('management')
 
     def handle_label(self, seduta_id, **options):
+        # imported lazily, to keep the command startup fast
+        import requests
+        from bs4 import BeautifulSoup
 
         dryrun = options['dryrun']
         legislature = options['legislature']
@@ -85,7 +87,7 @@ class Command(LabelCommand):
                 if c.select('a#Prossima'):
                     # fetch next page
                     pagina += 1
-                    s_uri = uri_template.format(pagina, s.date.day, s.date.month, s.date.year)
+                    s_uri = uri_template.format(pagina, legislature, s.date.day, s.date.month, s.date.year)
                     r = requests.get(s_uri)
                     c = BeautifulSoup(r.content)
                     self.logger.debug("url: {}".format(s_uri))
@@ -94,20 +96,15 @@ class Command(LabelCommand):
                     break
 
         votazioni_seduta = Votazione.objects.filter(sitting=s).order_by('numero_votazione')
-        # TODO: change title to sitting votations
-        for v in votazioni_seduta:
-            if 'ddl' in v.titolo.lower() and\
-               ' - ' in v.titolo:
-                numfase = re.match(r"", v.titolo).group(1)
+        if not dryrun:
+            # link votations to their acts, and flag final votes
+            n_linked, n_final = acts.link_votations(
+                'C', int(legislature), votation_ids=[v.id for v in votazioni_seduta]
+            )
+            self.logger.info("  {0} votazioni linked to their acts, {1} final".format(n_linked, n_final))
 
         # check if all votations were correctly imported and
         # set is_imported to the seduta, too
-        s_import_ok = True
-        for v in votazioni_seduta:
-            if not v.is_imported:
-                s_import_ok = False
-                break
-
-        if s_import_ok:
-            s.is_imported = 1
-            s.save()
+        status = reconcile.reconcile('C', int(legislature), sitting_ids=[s.id], dry_run=dryrun)
+        for _, numbers in status.refetch:
+            self.logger.info("  votazioni da reimportare: {0}".format(numbers))
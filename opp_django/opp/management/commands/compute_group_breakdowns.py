@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand
+from opp import breakdown
+from opp.models import Votazione
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Compute the per-group breakdowns of already imported votations
+    """
+    help = "Compute the per-group breakdowns of all votations of a legislature"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature. Defaults to 17.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    default=200,
+                    type='int',
+                    help='Number of votations processed at once. Defaults to 200.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+        votation_ids = list(Votazione.objects.filter(
+            sitting__legislatura=options['legislature']
+        ).order_by('id').values_list('id', flat=True))
+
+        batch_size = options['batch_size']
+        n_breakdowns = 0
+        for i in range(0, len(votation_ids), batch_size):
+            n_breakdowns += breakdown.compute_breakdowns(votation_ids[i:i + batch_size])
+            self.logger.info("{0}/{1} votations processed".format(
+                min(i + batch_size, len(votation_ids)), len(votation_ids)
+            ))
+
+        self.logger.info("{0} group breakdowns computed".format(n_breakdowns))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand
+from opp import idealpoints
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Compute the maps of the charges, from their votes
+    """
+    help = "Compute the 2D maps (ideal points) of the charges of a legislature, for the whole legislature " \
+           "and each year, where new votations entered them since the last run"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--house',
+                    dest='house',
+                    default='C',
+                    help='The house (C or S). Defaults to C.'),
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature. Defaults to 17.'),
+        make_option('--window',
+                    dest='window',
+                    default=None,
+                    help='Only compute this window: L (the legislature) or a year. Defaults to all.'),
+        make_option('--force',
+                    action='store_true',
+                    dest='force',
+                    default=False,
+                    help='Recompute the maps, even with no new votations.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+        idealpoints.compute_maps(
+            options['house'], int(options['legislature']), self.logger,
+            force=options['force'], only=options['window']
+        )
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from datetime import date, timedelta
+from optparse import make_option
+import re
+from django.conf import settings
+from django.core.management.base import CommandError
+from opp.management.base import ImportCommand
+from parser import writers
+from parser.archive import PageArchive
+from parser.crawler import Crawler
+from parser.digests import PageDigests
+from parser.registry import get_reader_class, registered
+
+__author__ = 'guglielmo'
+
+
+def parse_target(target):
+    """
+    parse a target like C17 into a (house, legislature) tuple
+    """
+    m = re.match(r'^([CS])(\d+)$', target.strip().upper())
+    if m is None:
+        raise CommandError("wrong target {0}, use the house initial and the legislature, as in C17".format(target))
+    return m.group(1), int(m.group(2))
+
+
+class Command(ImportCommand):
+    """
+    Crawl several houses and legislatures concurrently
+    """
+    help = "Crawl the votations of several houses and legislatures at once, for the given months, " \
+           "or for the current and previous months, and write them into the DB"
+    args = "<YYYY-MM YYYY-MM ...>"
+
+    option_list = ImportCommand.option_list + (
+        make_option('--targets',
+                    dest='targets',
+                    default=','.join(settings.CRAWL_TARGETS),
+                    help='Comma-separated houses and legislatures to crawl, as in C17,S17. '
+                         'Defaults to settings.CRAWL_TARGETS.'),
+        make_option('--threads',
+                    dest='threads',
+                    type='int',
+                    default=4,
+                    help='Number of crawling threads; requests are throttled per host anyway. Defaults to 4.'),
+    )
+
+    def handle(self, *months, **options):
+        super(Command, self).setup(*months, **options)
+
+        targets = [parse_target(t) for t in options['targets'].split(',') if t.strip()]
+        for house, legislature in targets:
+            try:
+                get_reader_class(house, legislature)
+            except LookupError as e:
+                raise CommandError("{0}; registered: {1}".format(
+                    e, ", ".join("{0}{1}".format(*r) for r in registered())
+                ))
+
+        if not months:
+            first = date.today().replace(day=1)
+            months = ((first - timedelta(days=1)).strftime('%Y-%m'), first.strftime('%Y-%m'))
+
+        archive_root = settings.PAGE_ARCHIVE_ROOT
+
+        def reader_factory(task):
+            return get_reader_class(task.house, task.legislature)(
+                logger=self.logger, legislature=task.legislature,
+                archive=PageArchive(archive_root) if archive_root else None,
+                digests=PageDigests()
+            )
+
+        crawler = Crawler(targets, months, threads=options['threads'], logger=self.logger,
+                          reader_factory=reader_factory)
+        self.logger.info("crawling {0} tasks with {1} threads".format(len(crawler.tasks), options['threads']))
+
+        writer = writers.OppDBVotationsWriter(self.logger)
+        failed = []
+        for task, sittings in crawler.crawl():
+            if task.error is not None:
+                self.logger.error("{0} failed: {1}".format(task, task.error))
+                failed.append(task)
+                continue
+
+            self.logger.info("{0}: {1} sittings read".format(task, len(sittings)))
+            if self.dry_run:
+                self.report_diff(sittings, house=task.house, legislature=task.legislature)
+                continue
+            writer.write_sittings(sittings, house=task.house, legislature=task.legislature)
+            writer.write_votations(sittings, house=task.house, legislature=task.legislature)
+            task.reader.digests.commit()
+
+        if failed:
+            raise CommandError("{0} of {1} tasks failed: {2}".format(
+                len(failed), len(crawler.tasks), ", ".join(str(t) for t in failed)
+            ))
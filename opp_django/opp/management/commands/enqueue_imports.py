@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from datetime import date, timedelta
+from optparse import make_option
+from opp import jobs
+from opp.management.base import ImportCommand
+import opp.tasks
+
+__author__ = 'guglielmo'
+
+
+class Command(ImportCommand):
+    """
+    Enqueue the import of the votations of some months
+    """
+    help = "Enqueue the import jobs of the given months, or of the current and previous months; " \
+           "jobs are processed by run_import_worker"
+    args = "<YYYY-MM YYYY-MM ...>"
+
+    option_list = ImportCommand.option_list + (
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature. Defaults to 17.'),
+    )
+
+    def handle(self, *months, **options):
+        super(Command, self).setup(*months, **options)
+
+        if not months:
+            first = date.today().replace(day=1)
+            months = (first.strftime('%Y-%m'), (first - timedelta(days=1)).strftime('%Y-%m'))
+
+        for month in months:
+            if self.dry_run:
+                self.logger.info("would enqueue the import of {0}".format(month))
+                continue
+            job, enqueued = jobs.enqueue('import_month', {
+                'month': month, 'house': self.house, 'legislature': int(options['legislature'])
+            }, house=self.house)
+            self.logger.info("import of {0} {1} (job {2})".format(
+                month, 'enqueued' if enqueued else 'already pending', job.id
+            ))
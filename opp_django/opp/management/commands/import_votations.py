@@ -1,5 +1,9 @@
+from optparse import make_option
+from django.conf import settings
 from opp.management.base import ImportCommand
 from parser import readers, writers
+from parser.archive import PageArchive
+from parser.digests import PageDigests
 __author__ = 'guglielmo'
 
 
@@ -9,14 +13,30 @@ class Command(ImportCommand):
     """
     help = "Check sedute at la Camera for the current and previous months"
 
+    option_list = ImportCommand.option_list + (
+        make_option('--dump',
+                    dest='dump_file',
+                    default=None,
+                    help='Also dump the sittings read into this JSON file (JSON Lines, if .jsonl), '
+                         'to be loaded with load_dump'),
+    )
+
     def handle(self, *labels, **options):
         super(Command, self).setup(*labels, **options)
 
-        reader = readers.Camera17VotationsReader(self.logger)
+        archive = PageArchive(settings.PAGE_ARCHIVE_ROOT) if settings.PAGE_ARCHIVE_ROOT else None
+        digests = PageDigests()
+        reader = readers.Camera17VotationsReader(self.logger, archive=archive, digests=digests)
         sittings = reader.read()
 
-        writer = writers.JSONVotationsWriter(sittings, json_filename='test.json')
-        writer.write()
+        if options['dump_file']:
+            writers.JSONVotationsWriter(sittings, json_filename=options['dump_file']).write()
+            self.logger.info("sittings dumped to {0}".format(options['dump_file']))
 
-        # writer = writers.OppDBVotationsWriter(self.logger)
-        # writer.write_sittings(sittings, house='C')
\ No newline at end of file
+        if self.dry_run:
+            self.report_diff(sittings, house='C')
+        else:
+            writer = writers.OppDBVotationsWriter(self.logger)
+            writer.write_sittings(sittings, house='C')
+            writer.write_votations(sittings, house='C')
+            self.logger.info("{0} page digests updated".format(digests.commit()))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand
+from opp import acts
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Link the votations of a legislature to their acts, and flag final votes
+    """
+    help = "Parse the titles of all the votations of a legislature, link them to their acts " \
+           "(bills, motions, ...) and set their finale and titolo_aggiuntivo fields"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--house',
+                    dest='house',
+                    default='C',
+                    help='The house (C or S). Defaults to C.'),
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature. Defaults to 17.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+        n_linked, n_final = acts.link_votations(options['house'], int(options['legislature']))
+        self.logger.info("{0} votations linked to their acts, {1} final votes".format(n_linked, n_final))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import time
+from opp.management.base import ImportCommand
+from parser import dumps, writers
+
+__author__ = 'guglielmo'
+
+
+class Command(ImportCommand):
+    """
+    Load a JSON dump of sittings into the DB
+    """
+    help = "Load the sittings of a JSON, or JSON Lines, dump (as written by import_votations --dump) " \
+           "into the DB, in batches; an interrupted load is resumed with --resume"
+    args = "<dump file>"
+
+    option_list = ImportCommand.option_list + (
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature. Defaults to 17.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=200,
+                    help='Number of votations written at once. Defaults to 200.'),
+        make_option('--offset',
+                    dest='offset',
+                    type='int',
+                    default=0,
+                    help='Start from this byte offset, as logged by a previous load.'),
+        make_option('--resume',
+                    action='store_true',
+                    dest='resume',
+                    default=False,
+                    help='Start from the offset where the previous load of the dump stopped.'),
+    )
+
+    def handle(self, *labels, **options):
+        super(Command, self).setup(*labels, **options)
+        if len(labels) != 1:
+            self.logger.error("a single dump file is required")
+            return
+
+        path = labels[0]
+        legislature = int(options['legislature'])
+        resume = dumps.ResumeFile(path)
+        offset = resume.load() if options['resume'] else options['offset']
+        if offset:
+            self.logger.info("resuming {0} from offset {1}".format(path, offset))
+
+        writer = writers.OppDBVotationsWriter(self.logger)
+        n_sittings = n_votations = 0
+        start = time.time()
+        for sittings, offset in dumps.batches(dumps.iter_dump(path, offset), options['batch_size']):
+            if self.dry_run:
+                self.report_diff(sittings, house=self.house, legislature=legislature)
+            else:
+                writer.write_sittings(sittings, house=self.house, legislature=legislature)
+                writer.write_votations(sittings, house=self.house, legislature=legislature)
+                resume.save(offset)
+            n_sittings += len(sittings)
+            n_votations += sum(len(s.votations) for s in sittings)
+            self.logger.info("{0} sittings, {1} votations loaded, at offset {2} ({3:.0f} votations/s)".format(
+                n_sittings, n_votations, offset, n_votations / max(time.time() - start, 0.001)
+            ))
+
+        if not self.dry_run:
+            resume.clear()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand
+from opp import search
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the votations full-text search index
+    """
+    help = "Rebuild the full-text search index of the votations, for all or a single legislature"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--legislature',
+                    dest='legislature',
+                    default=None,
+                    help='Only rebuild the index for this legislature. Defaults to all.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+        legislature = options['legislature']
+        if legislature is not None:
+            legislature = int(legislature)
+
+        n_postings = search.rebuild_index(legislatura=legislature)
+        self.logger.info("search index rebuilt: {0} postings written".format(n_postings))
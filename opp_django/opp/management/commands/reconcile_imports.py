@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+from opp import jobs, reconcile
+from opp.management.base import ImportCommand
+from parser.records import Sitting
+import opp.tasks
+
+__author__ = 'guglielmo'
+
+
+class Command(ImportCommand):
+    """
+    Reconcile the import status of the sittings of a legislature
+    """
+    help = "Compute the import completeness of all the sittings of a legislature, update their " \
+           "is_imported flag and list the sittings and votations to re-fetch"
+
+    option_list = ImportCommand.option_list + (
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature. Defaults to 17.'),
+        make_option('--min-votes',
+                    dest='min_votes',
+                    type='int',
+                    default=None,
+                    help='Votes a votation must have to be complete. Defaults to the seats of the house.'),
+        make_option('--enqueue',
+                    action='store_true',
+                    dest='enqueue',
+                    default=False,
+                    help='Enqueue the import jobs of the sittings to re-fetch (see run_import_worker)'),
+    )
+
+    def handle(self, *args, **options):
+        super(Command, self).setup(*args, **options)
+
+        legislature = int(options['legislature'])
+        status = reconcile.reconcile(
+            self.house, legislature, min_votes=options['min_votes'], dry_run=self.dry_run
+        )
+        for sitting, numbers in status.refetch:
+            self.logger.info("seduta {0} del {1}: {2}".format(
+                sitting.num, sitting.date,
+                "votazioni {0}".format(', '.join(str(n) for n in numbers)) if numbers else "da importare"
+            ))
+            if options['enqueue'] and not self.dry_run:
+                record = Sitting(sitting.num, sitting.date.isoformat(), sitting.reference_url)
+                jobs.enqueue('import_sitting', dict(
+                    record.as_dict(), house=self.house, legislature=legislature, refetch=numbers
+                ), house=self.house, priority=1)
+
+        self.logger.info("import status: {0}".format(status.summary()))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from parser.replay import Corpus, RecordingVotationsReader
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Record pages from la Camera into the benchmarks corpus
+    """
+    help = "Record month, votations listing and votation detail pages of la Camera, " \
+           "for the given months (YYYY-MM), into the benchmarks corpus"
+    args = "<YYYY-MM YYYY-MM ...>"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--corpus',
+                    dest='corpus',
+                    default=settings.SCRAPER_CORPUS_ROOT,
+                    help='The corpus directory. Defaults to settings.SCRAPER_CORPUS_ROOT.'),
+        make_option('--max-sittings',
+                    dest='max_sittings',
+                    type='int',
+                    default=None,
+                    help='Record at most this number of sittings per month.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *months, **options):
+        corpus = Corpus(options['corpus'])
+        reader = RecordingVotationsReader(corpus, logger=self.logger)
+
+        for year_month in months:
+            sittings = reader.get_sittings(year_month)[:options['max_sittings']]
+            for sitting in sittings:
+                for votation in reader.get_votations(sitting.date):
+                    reader.get_votation_details(votation.ref_numbers)
+            corpus.add_month(year_month)
+            corpus.save()
+            self.logger.info("{0} recorded, corpus has {1} pages".format(year_month, len(corpus)))
@@ -0,0 +1,87 @@
+from multiprocessing import Pool
+from optparse import make_option
+from django.conf import settings
+from django.db import connections
+from opp.management.base import ImportCommand
+from parser import writers
+from parser.archive import PageArchive
+from parser.readers import ArchivedVotationsReader
+
+__author__ = 'guglielmo'
+
+
+# reader of the worker processes, built by init_worker
+worker_reader = None
+
+
+def init_worker(archive_path):
+    global worker_reader
+    worker_reader = ArchivedVotationsReader(PageArchive(archive_path))
+
+
+def parse_sitting(sitting):
+    """
+    parse the archived votations of a sitting, in a worker process
+    """
+    votations = worker_reader.get_votations(sitting.date)
+    for votation in votations:
+        votation.details = worker_reader.get_votation_details(votation.ref_numbers)
+    sitting.votations = votations
+    return sitting
+
+
+class Command(ImportCommand):
+    """
+    Re-parse archived pages and write them into the DB
+    """
+    help = "Re-parse the pages in the archive, with no network access, " \
+           "across a pool of processes, and feed the results to the DB writer"
+    args = "<YYYY-MM YYYY-MM ...>"
+
+    option_list = ImportCommand.option_list + (
+        make_option('--archive',
+                    dest='archive',
+                    default=settings.PAGE_ARCHIVE_ROOT,
+                    help='The archive directory. Defaults to settings.PAGE_ARCHIVE_ROOT.'),
+        make_option('--processes',
+                    dest='processes',
+                    type='int',
+                    default=None,
+                    help='Number of parsing processes. Defaults to the number of CPUs.'),
+    )
+
+    def handle(self, *months, **options):
+        super(Command, self).setup(*months, **options)
+
+        archive = PageArchive(options['archive'])
+        reader = ArchivedVotationsReader(archive, logger=self.logger)
+        months = months or reader.archived_months()
+        self.logger.info("re-parsing months: {0}".format(", ".join(months)))
+
+        sittings = []
+        for ym in months:
+            sittings.extend(reader.get_sittings(ym))
+
+        # DB connections must not be shared with the forked workers
+        for connection in connections.all():
+            connection.close()
+
+        writer = writers.OppDBVotationsWriter(self.logger)
+        reparsed = []
+        pool = Pool(options['processes'], initializer=init_worker, initargs=(options['archive'], ))
+        try:
+            for sitting in pool.imap(parse_sitting, sittings):
+                self.logger.info("sitting {0} of {1}: {2} votations re-parsed".format(
+                    sitting.num, sitting.date, len(sitting.votations)
+                ))
+                if self.dry_run:
+                    reparsed.append(sitting)
+                else:
+                    writer.write_sittings([sitting], house=self.house)
+                    writer.write_votations([sitting], house=self.house)
+        finally:
+            pool.close()
+            pool.join()
+
+        if self.dry_run:
+            self.report_diff(reparsed, house=self.house)
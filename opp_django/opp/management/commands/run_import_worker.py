@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import Process
+from optparse import make_option
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from opp import jobs
+import opp.tasks
+
+__author__ = 'guglielmo'
+
+
+def run_worker(options, house_limits):
+    worker = jobs.Worker(
+        house_limits=house_limits,
+        lease_seconds=options['lease'],
+        heartbeat_seconds=options['heartbeat'],
+    )
+    worker.run(burst=options['burst'])
+
+
+class Command(BaseCommand):
+    """
+    Run import workers, processing the jobs queue
+    """
+    help = "Run workers leasing and processing the import jobs enqueued with enqueue_imports"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+                    dest='processes',
+                    type='int',
+                    default=1,
+                    help='Number of worker processes. Defaults to 1.'),
+        make_option('--house-limits',
+                    dest='house_limits',
+                    default='C=2,S=2',
+                    help='Max number of jobs running at once for each house, among all workers. '
+                         'Defaults to C=2,S=2.'),
+        make_option('--lease',
+                    dest='lease',
+                    type='int',
+                    default=300,
+                    help='Seconds a job is leased for, before another worker may take it over. Defaults to 300.'),
+        make_option('--heartbeat',
+                    dest='heartbeat',
+                    type='int',
+                    default=60,
+                    help='Seconds between the renewals of the lease of a running job. Defaults to 60.'),
+        make_option('--burst',
+                    action='store_true',
+                    dest='burst',
+                    default=False,
+                    help='Stop when the queue is empty, instead of waiting for new jobs'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+        try:
+            house_limits = dict(
+                (house.strip(), int(limit))
+                for house, limit in (item.split('=') for item in options['house_limits'].split(',') if item)
+            )
+        except ValueError:
+            raise CommandError("--house-limits must be like C=2,S=2")
+
+        if options['heartbeat'] >= options['lease']:
+            raise CommandError("--heartbeat must be shorter than --lease")
+
+        if options['processes'] <= 1:
+            run_worker(options, house_limits)
+            return
+
+        # DB connections must not be shared with the forked workers
+        for connection in connections.all():
+            connection.close()
+
+        processes = [
+            Process(target=run_worker, args=(options, house_limits))
+            for _ in range(options['processes'])
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
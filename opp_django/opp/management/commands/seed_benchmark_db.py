@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from datetime import date, timedelta
+from optparse import make_option
+import logging
+import random
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from opp.models import Carica, CaricaHasGruppo, Gruppo, Politico, TipoCarica, Votazione
+from parser.records import Sitting, SymbolTable, VotationDetail, VotationRef, VOTE_CODES
+from parser.writers import OppDBVotationsWriter
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Seed an empty DB with synthetic records, for the benchmark_queries command
+    """
+    help = "Fill an empty DB (with the Openparlamento schema) with synthetic charges, groups, " \
+           "sittings and votations of a house, written through the DB writer, so that the derived " \
+           "tables are built too. The same options and seed give the same records, so that " \
+           "benchmark_queries results of different commits are comparable."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--house',
+                    dest='house',
+                    default='C',
+                    help='The house (C or S). Defaults to C.'),
+        make_option('--legislature',
+                    dest='legislature',
+                    default='17',
+                    help='The legislature. Defaults to 17.'),
+        make_option('--charges',
+                    dest='charges',
+                    type='int',
+                    default=630,
+                    help='Number of members of the house. Defaults to 630.'),
+        make_option('--groups',
+                    dest='groups',
+                    type='int',
+                    default=10,
+                    help='Number of groups. Defaults to 10.'),
+        make_option('--sittings',
+                    dest='sittings',
+                    type='int',
+                    default=40,
+                    help='Number of sittings. Defaults to 40.'),
+        make_option('--votations',
+                    dest='votations',
+                    type='int',
+                    default=25,
+                    help='Number of votations of each sitting. Defaults to 25.'),
+        make_option('--seed',
+                    dest='seed',
+                    type='int',
+                    default=1,
+                    help='Seed of the random votes. Defaults to 1.'),
+    )
+
+    logger = logging.getLogger('management')
+
+    START_DATE = date(2013, 4, 2)
+
+    # sittings written by the DB writer at once
+    BATCH_SITTINGS = 10
+
+    # titles of the votations, with acts of all the types
+    TITLES = (
+        u'Ddl {act}-A - voto finale',
+        u'Ddl {act}-A - emendamento {n}.1',
+        u'Disegno di legge {act} - articolo {n}',
+        u'Moz. 1-{act:05d} - parte motiva',
+        u'Ris. 6-{act:05d}',
+        u'Ddl {act}-A - odg 9/{act}-A/{n}',
+        u'Doc. XXII, n. {n} - voto finale',
+    )
+
+    def handle(self, *args, **options):
+        house, legislature = options['house'].upper(), int(options['legislature'])
+        if house not in OppDBVotationsWriter.HOUSE_CHARGE_TYPES:
+            raise CommandError("unknown house {0}, use C or S".format(house))
+        if Votazione.objects.filter(sitting__house=house, sitting__legislatura=legislature).exists():
+            raise CommandError("the DB already has votations of {0}{1}, seed an empty one".format(house, legislature))
+
+        rnd = random.Random(options['seed'])
+        with transaction.atomic():
+            names = self.seed_charges(house, legislature, options['charges'], options['groups'])
+        self.logger.info("{0} charges of {1} groups created".format(options['charges'], options['groups']))
+
+        writer = OppDBVotationsWriter(self.logger)
+        sittings = self.sittings(rnd, names, options['groups'], options['sittings'], options['votations'])
+        for i in range(0, len(sittings), self.BATCH_SITTINGS):
+            batch = sittings[i:i + self.BATCH_SITTINGS]
+            with transaction.atomic():
+                writer.write_sittings(batch, house=house, legislature=legislature)
+                writer.write_votations(batch, house=house, legislature=legislature)
+        self.logger.info("{0} sittings and {1} votations written".format(
+            len(sittings), sum(len(s.votations) for s in sittings)
+        ))
+
+    def seed_charges(self, house, legislature, n_charges, n_groups):
+        """
+        create the charges, each a member of a group;
+        returns the names of the charges, as in the votation details, by group
+        """
+        charge_type, _ = TipoCarica.objects.get_or_create(name=OppDBVotationsWriter.HOUSE_CHARGE_TYPES[house][0])
+        start_date = self.START_DATE - timedelta(days=30)
+        groups = [
+            Gruppo.objects.create(name=u'Gruppo {0}'.format(g), acronym=u'G{0}'.format(g))
+            for g in range(n_groups)
+        ]
+        names = [[] for _ in groups]
+        for i in range(n_charges):
+            politician = Politico.objects.create(name=u'Nome{0}'.format(i), surname=u'Cognome{0}'.format(i),
+                                                 gender='MF'[i % 2], monitoring_users=0)
+            charge = Carica.objects.create(
+                politician=politician, charge_type=charge_type, charge=charge_type.name, legislatura=legislature,
+                start_date=start_date, maggioranza_sotto=0, maggioranza_sotto_assente=0,
+                maggioranza_salva=0, maggioranza_salva_assente=0
+            )
+            CaricaHasGruppo.objects.create(charge=charge, group=groups[i % n_groups], start_date=start_date)
+            names[i % n_groups].append(u'COGNOME{0} NOME{0}'.format(i))
+        return names
+
+    def sittings(self, rnd, names, n_groups, n_sittings, n_votations):
+        """
+        the records of the sittings, as read by the readers: in each votation,
+        the members of a group mostly follow its line, some are absent
+        """
+        deputies, vote_codes = SymbolTable(), SymbolTable(VOTE_CODES)
+        sittings = []
+        d = self.START_DATE
+        for num in range(1, n_sittings + 1):
+            votations = []
+            for n in range(1, n_votations + 1):
+                act = rnd.randint(1, 3000)
+                title = rnd.choice(self.TITLES).format(act=act, n=n)
+                details = VotationDetail(title, n, u'Nominale', {}, u'', deputies=deputies, vote_codes=vote_codes)
+                counts = dict((vote, 0) for vote in VOTE_CODES)
+                for g in range(n_groups):
+                    line = rnd.choice((u'Favorevole', u'Contrario', u'Astensione'))
+                    for name in names[g]:
+                        r = rnd.random()
+                        if r < 0.05:
+                            vote = u'Non ha votato'
+                        elif r < 0.07:
+                            vote = u'In missione'
+                        elif r < 0.10:
+                            vote = rnd.choice((u'Favorevole', u'Contrario', u'Astensione'))
+                        else:
+                            vote = line
+                        details.set_vote(name, vote)
+                        counts[vote] += 1
+                voting = counts[u'Favorevole'] + counts[u'Contrario']
+                details.summary = {
+                    u'Presenti': voting + counts[u'Astensione'],
+                    u'Votanti': voting,
+                    u'Astenuti': counts[u'Astensione'],
+                    u'Maggioranza': voting // 2 + 1,
+                    u'Hanno votato si': counts[u'Favorevole'],
+                    u'Hanno votato no': counts[u'Contrario'],
+                }
+                details.result = u'Approvato' if counts[u'Favorevole'] > counts[u'Contrario'] else u'Respinto'
+                uri = u'http://example.org/votazioni/{0}_{1}'.format(num, n)
+                votations.append(VotationRef(['{0}_{1}'.format(num, n)], uri, details=details))
+            sittings.append(Sitting(str(num), d, u'http://example.org/sedute/{0}'.format(num), votations=votations))
+            d += timedelta(days=1 if d.weekday() < 3 else 5)
+        return sittings
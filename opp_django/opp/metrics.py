@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of import runs and web traffic.
+
+A minimal, dependency-free, registry of counters and histograms,
+rendered in the Prometheus text exposition format:
+
+  - by the ``metrics`` view, for the web processes
+  - into a textfile, for the node_exporter textfile collector,
+    at the end of import runs (see ImportCommand --metrics-file)
+
+Metrics are kept per process.
+
+a simple usage::
+
+    from opp import metrics
+    metrics.pages_fetched.inc(host='www.camera.it')
+    metrics.view_latency.observe(0.12, method='GET', status='200')
+"""
+import os
+import tempfile
+import threading
+import time
+
+__author__ = 'guglielmo'
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in key
+    ) + '}'
+
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_labels_key(labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, key, value
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+
+class Histogram(object):
+
+    type = 'histogram'
+
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self.values.items()):
+            for bound, n in zip(self.buckets, counts):
+                yield self.name + '_bucket', key + (('le', repr(float(bound))), ), n
+            yield self.name + '_bucket', key + (('le', '+Inf'), ), count
+            yield self.name + '_sum', key, total
+            yield self.name + '_count', key, count
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def histogram(self, name, help, **kwargs):
+        return self.register(Histogram(name, help, **kwargs))
+
+    def render(self):
+        """
+        Return all the metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            for name, key, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(name, _format_labels(key), repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Atomically write the metrics into a file, for the node_exporter textfile collector
+        """
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.metrics')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.render())
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+
+registry = Registry()
+
+# scraping
+pages_fetched = registry.counter('opp_scraper_pages_fetched_total', 'Pages fetched from the houses sites')
+bytes_fetched = registry.counter('opp_scraper_bytes_fetched_total', 'Bytes fetched from the houses sites')
+http_retries = registry.counter('opp_scraper_http_retries_total', 'HTTP requests retried after an error')
+fetch_latency = registry.histogram('opp_scraper_fetch_seconds', 'Latency of pages fetching')
+coalesced_requests = registry.counter(
+    'opp_scraper_coalesced_requests_total', 'Requests served by an identical request in flight, per scope'
+)
+
+# import
+votations_imported = registry.counter('opp_import_votations_total', 'Votations written into the DB')
+rows_written = registry.counter('opp_import_rows_written_total', 'Rows written into the DB, per table')
+import_runs = registry.counter('opp_import_runs_total', 'Import commands runs, per command and outcome')
+import_duration = registry.histogram(
+    'opp_import_run_seconds', 'Duration of import command runs',
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+)
+
+# caches
+cache_requests = registry.counter('opp_cache_requests_total', 'Cache lookups, per cache and result')
+pages_warmed = registry.counter('opp_cache_pages_warmed_total', 'API responses cached after the imports')
+
+# DB
+db_connections_opened = registry.counter('opp_db_connections_opened_total', 'DB connections opened, per alias')
+
+# web
+view_latency = registry.histogram('opp_http_request_seconds', 'Latency of web requests')
+
+
+def record_cache(cache, hit):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+class MetricsWSGIMiddleware(object):
+    """
+    WSGI middleware measuring the latency of web requests, by method and status
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        start = time.time()
+        status_holder = []
+
+        def _start_response(status, headers, exc_info=None):
+            status_holder.append(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.application(environ, _start_response)
+        finally:
+            view_latency.observe(
+                time.time() - start,
+                method=environ.get('REQUEST_METHOD', ''),
+                status=status_holder[0] if status_holder else '500'
+            )
@@ -188,6 +188,15 @@ class Votazione(models.Model):
 
 
 class VotazioneHasCarica(models.Model):
+    # values of the voto column
+    FAVOREVOLE = 'Favorevole'
+    CONTRARIO = 'Contrario'
+    ASTENUTO = 'Astenuto'
+    ASSENTE = 'Assente'
+    IN_MISSIONE = 'In missione'
+    PRESIDENTE = 'Presidente'
+    VOTED = (FAVOREVOLE, CONTRARIO, ASTENUTO)
+
     vote = models.ForeignKey(Votazione, db_column='votazione_id')
     charge = models.ForeignKey(Carica, db_column='carica_id')
     voting = models.CharField(max_length=40L, blank=True, db_column='voto')
@@ -198,3 +207,216 @@ class VotazioneHasCarica(models.Model):
         db_table = 'opp_votazione_has_carica'
         managed = False
 
+
+class VotazioneSearchPosting(models.Model):
+    """
+    A posting of the votations full-text index: the term appears in the votation
+    with the given weighted frequency. See opp.search.
+    """
+    TERM_MAX_LENGTH = 40
+
+    term = models.CharField(max_length=TERM_MAX_LENGTH)
+    vote = models.ForeignKey(Votazione, db_column='votazione_id', related_name='search_postings',
+                             db_constraint=False)
+    legislatura = models.IntegerField()
+    weight = models.FloatField()
+
+    class Meta:
+        db_table = 'opp_votazione_search_posting'
+        index_together = (('term', 'legislatura'), )
+
+
+class VotazioneGruppoBreakdown(models.Model):
+    """
+    How the members of a group voted in a votation.
+
+    Materialized at import time (see opp.breakdown), so that the group summary
+    of a votation is a single indexed read.
+    """
+    vote = models.ForeignKey(Votazione, db_column='votazione_id', related_name='group_breakdowns',
+                             db_constraint=False)
+    group = models.ForeignKey(Gruppo, db_column='gruppo_id', related_name='+', db_constraint=False)
+    favorevoli = models.IntegerField(default=0)
+    contrari = models.IntegerField(default=0)
+    astenuti = models.IntegerField(default=0)
+    assenti = models.IntegerField(default=0)
+    missioni = models.IntegerField(default=0)
+    altri = models.IntegerField(default=0)
+    majority_voting = models.CharField(max_length=40, blank=True, db_column='voto_maggioranza')
+    rebels = models.IntegerField(default=0, db_column='ribelli')
+
+    class Meta:
+        db_table = 'opp_votazione_gruppo_breakdown'
+        unique_together = (('vote', 'group'), )
+
+
+class PageDigest(models.Model):
+    """
+    Digest of a scraped page at the last successful import,
+    with the data extracted from it, as JSON. See parser.digests.
+    """
+    uri = models.CharField(max_length=255, unique=True, db_column='url')
+    digest = models.CharField(max_length=40)
+    extracted = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'opp_page_digest'
+
+
+class Job(models.Model):
+    """
+    A task of the import jobs queue. See opp.jobs.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    task = models.CharField(max_length=50)
+    args = models.TextField(default='{}')
+    # jobs with the same key are not enqueued twice while pending
+    key = models.CharField(max_length=255, unique=True)
+    house = models.CharField(max_length=1, default='C', db_column='ramo')
+    priority = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField()
+    leased_by = models.CharField(max_length=100, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    # incremented at each lease, for optimistic locking
+    version = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'opp_job'
+        index_together = (('status', 'run_after'), ('status', 'house', 'lease_expires'))
+
+
+class PoliticianHistorySeries(models.Model):
+    """
+    A chunk of the time series of a metric of PoliticianHistoryCache,
+    for a politician (or group), encoded by opp.timeseries.
+
+    Each chunk starts with a keyframe, so that ranges are read
+    decoding only the chunks overlapping them.
+    """
+    chi_tipo = models.CharField(max_length=1)
+    chi_id = models.IntegerField()
+    metric = models.CharField(max_length=20)
+    house = models.CharField(max_length=1, db_column='ramo')
+    legislatura = models.IntegerField(null=True, blank=True)
+    start_date = models.DateField(db_column='data_inizio')
+    end_date = models.DateField(db_column='data_fine')
+    points = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        db_table = 'opp_politician_history_series'
+        unique_together = (('chi_tipo', 'chi_id', 'house', 'legislatura', 'metric', 'start_date'), )
+
+
+class CumulativeVoteCount(models.Model):
+    """
+    Cumulative vote counts of a charge, or a group, up to a votation,
+    over the ordered sequence of its votations. See opp.votecounts.
+    """
+    CHARGE = 'C'
+    GROUP = 'G'
+
+    owner_type = models.CharField(max_length=1, db_column='chi_tipo')
+    owner_id = models.IntegerField(db_column='chi_id')
+    vote = models.ForeignKey(Votazione, db_column='votazione_id', related_name='+', db_constraint=False)
+    date = models.DateField(db_column='data')
+    # order of the votations within a date
+    seq = models.BigIntegerField()
+    votazioni = models.IntegerField(default=0)
+    presenze = models.IntegerField(default=0)
+    assenze = models.IntegerField(default=0)
+    missioni = models.IntegerField(default=0)
+    ribelli = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'opp_cumulative_vote_count'
+        unique_together = (('owner_type', 'owner_id', 'vote'), )
+        index_together = (('owner_type', 'owner_id', 'date', 'seq'), )
+
+
+class VotazioneAtto(models.Model):
+    """
+    The act (bill, motion, ...) a votation refers to, as parsed from its title.
+    See opp.acts.
+    """
+    vote = models.OneToOneField(Votazione, db_column='votazione_id', related_name='act', db_constraint=False)
+    house = models.CharField(max_length=1L, db_column='ramo')
+    legislatura = models.IntegerField()
+    act_type = models.CharField(max_length=20L, db_column='tipo_atto')
+    # the identifier, as in the title (e.g. 1234-A), and its number (1234)
+    act_code = models.CharField(max_length=40L, db_column='codice_atto')
+    act_number = models.CharField(max_length=20L, db_column='numero_atto')
+    finale = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'opp_votazione_atto'
+        index_together = (('house', 'legislatura', 'act_type', 'act_number'), )
+
+
+class CaricaProfile(models.Model):
+    """
+    Precomputed profile document of a charge, as JSON. See opp.profiles.
+    """
+    charge = models.OneToOneField(Carica, db_column='carica_id', related_name='profile', db_constraint=False)
+    document = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'opp_carica_profile'
+
+
+class IdealPointMap(models.Model):
+    """
+    A 2D map of the charges of a house, from their votes in a time window
+    (the whole legislature, or a year). See opp.idealpoints.
+    """
+    house = models.CharField(max_length=1L, db_column='ramo')
+    legislatura = models.IntegerField()
+    window = models.CharField(max_length=10L, db_column='finestra')
+    start_date = models.DateField(db_column='data_inizio')
+    end_date = models.DateField(db_column='data_fine')
+    # the last votation written in the window, to recompute the map only when new votes arrive
+    last_vote = models.ForeignKey(Votazione, db_column='ultima_votazione_id', related_name='+', db_constraint=False)
+    n_charges = models.IntegerField()
+    n_votations = models.IntegerField()
+    # share of the variance explained by each axis
+    variance_x = models.FloatField()
+    variance_y = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'opp_ideal_point_map'
+        unique_together = (('house', 'legislatura', 'window'), )
+
+
+class IdealPoint(models.Model):
+    """
+    The coordinates of a charge in an IdealPointMap, with its group at the end of the window
+    """
+    map = models.ForeignKey(IdealPointMap, db_column='mappa_id', related_name='points')
+    charge = models.ForeignKey(Carica, db_column='carica_id', related_name='+', db_constraint=False)
+    group = models.ForeignKey(Gruppo, null=True, db_column='gruppo_id', related_name='+', db_constraint=False)
+    x = models.FloatField()
+    y = models.FloatField()
+    n_votes = models.IntegerField()
+
+    class Meta:
+        db_table = 'opp_ideal_point'
+        unique_together = (('map', 'charge'), )
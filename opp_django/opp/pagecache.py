@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned cache of the API responses, warmed after imports.
+
+Responses of the views decorated with ``cached_response`` are cached
+under the current data version; an import does not invalidate them
+one by one, it bumps the version instead. Views depending on the current
+date too (as the vote counts of the last days) are not cached.
+
+The DB writer records the ids of the sittings, votations, charges and
+groups it touched (``touched``); once the import succeeded (or a burst
+of import jobs, see opp.jobs), ``publish`` renders the pages of the
+touched objects into the cache, under the next version, with a bounded
+pool of threads, the newest votations first, and only then bumps the
+version, so that the first visitors of the new votations find them
+already cached.
+
+The version is shared by the web processes and the importers through
+the cache, so the cache must be shared among processes (see CACHES in
+the settings)::
+
+    from opp import pagecache
+    pagecache.touched.add(votations=[...], charges=[...])
+    pagecache.publish(logger)
+"""
+from functools import wraps
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import resolve, reverse
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from opp import metrics
+from opp.connections import pool
+from opp.routers import pin_to_primary
+
+__author__ = 'guglielmo'
+
+
+VERSION_CACHE_KEY = 'opp:pagecache:version'
+
+
+def current_version():
+    return cache.get(VERSION_CACHE_KEY) or 0
+
+
+def response_key(path, version):
+    return 'opp:pagecache:{0}:{1}'.format(version, path)
+
+
+def cached_response(view):
+    """
+    cache the GET responses of the view, with status 200, under the current data version;
+    the undecorated view is kept in the render attribute, for the warming
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+
+        key = response_key(request.get_full_path(), current_version())
+        cached = cache.get(key)
+        metrics.record_cache('api_responses', cached is not None)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type']), settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    wrapper.render = view
+    return wrapper
+
+
+class TouchedIds(object):
+    """
+    Ids of the objects written by the imports of this process, to be published
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.sittings = set()
+        # (date, number, id) of the votations, to warm the newest first
+        self.votations = set()
+        self.charges = set()
+        self.groups = set()
+
+    def add(self, sittings=(), votations=(), charges=(), groups=()):
+        with self.lock:
+            self.sittings.update(sittings)
+            self.votations.update(votations)
+            self.charges.update(charges)
+            self.groups.update(groups)
+
+    def take(self):
+        """
+        return the touched ids, as a new TouchedIds, and clear them
+        """
+        with self.lock:
+            taken = TouchedIds()
+            taken.sittings, taken.votations, taken.charges, taken.groups = \
+                self.sittings, self.votations, self.charges, self.groups
+            self.clear()
+        return taken
+
+    def __len__(self):
+        return len(self.sittings) + len(self.votations) + len(self.charges) + len(self.groups)
+
+
+touched = TouchedIds()
+
+
+def touched_paths(ids):
+    """
+    the paths of the cached pages of the touched objects, by priority: the newest votations first;
+    sittings and groups have no cached page of their own, yet
+    """
+    paths = []
+    for _, _, votation_id in sorted(ids.votations, reverse=True):
+        paths.append(reverse('votation-group-breakdown', kwargs={'votation_id': votation_id}))
+    for charge_id in sorted(ids.charges):
+        paths.append(reverse('charge-profile', kwargs={'charge_id': charge_id}))
+    return paths
+
+
+def render(path):
+    """
+    render the page at the path with its undecorated view, on the primary DB;
+    return its (content, content type), or None
+    """
+    match = resolve(path)
+    view = getattr(match.func, 'render', match.func)
+    request = RequestFactory().get(path)
+    with pin_to_primary(), pool.connection():
+        response = view(request, *match.args, **match.kwargs)
+    if response.status_code != 200:
+        return None
+    return response.content, response['Content-Type']
+
+
+def warm(paths, version, logger, threads=None):
+    """
+    render the pages into the cache, under the version, with a pool of threads;
+    pages are taken in order
+
+    returns the number of pages cached
+    """
+    def warm_path(path):
+        try:
+            rendered = render(path)
+        except Exception as e:
+            logger.warning("page {0} not warmed: {1}".format(path, e))
+            return False
+        if rendered is not None:
+            cache.set(response_key(path, version), rendered, settings.RESPONSE_CACHE_TIMEOUT)
+        return rendered is not None
+
+    if not paths:
+        return 0
+    workers = ThreadPool(min(threads or settings.CACHE_WARMING_THREADS, len(paths)))
+    try:
+        n = sum(workers.imap(warm_path, paths))
+    finally:
+        workers.close()
+        workers.join()
+    metrics.pages_warmed.inc(n)
+    return n
+
+
+def publish(logger):
+    """
+    warm the pages of the objects touched by the imports, then bump the data version
+    """
+    ids = touched.take()
+    if not len(ids):
+        return
+    version = current_version() + 1
+    start = time.time()
+    paths = touched_paths(ids)
+    n = warm(paths, version, logger)
+    cache.set(VERSION_CACHE_KEY, version, None)
+    logger.info("{0} of {1} pages warmed in {2:.1f}s, data version {3}".format(
+        n, len(paths), time.time() - start, version
+    ))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed profile documents of the charges (deputies, senators).
+
+The profile page of a charge needs the politician, the charge and its
+counters, the current group, the latest ranks in PoliticianHistoryCache,
+the cumulative vote counts and the recent votes: all of them are
+denormalized into a JSON document per charge (CaricaProfile), served
+with a single read by primary key, whatever the length of the voting
+record of the charge.
+
+Documents are built in bulk, with a fixed number of queries for a
+batch of charges, and rebuilt by the DB writer only for the charges
+that voted in the imported votations::
+
+    from opp import profiles
+    profiles.rebuild([charge_id, ...])
+    profiles.profile_json(charge_id)
+"""
+import json
+from django.db import transaction
+from django.db.models import Max
+from opp import votecounts
+from opp.models import Carica, CaricaHasGruppo, CaricaProfile, CumulativeVoteCount, \
+    PoliticianHistoryCache, Votazione, VotazioneHasCarica
+
+__author__ = 'guglielmo'
+
+
+# votes listed in the profiles
+RECENT_VOTES = 20
+
+BATCH_SIZE = 500
+
+COUNTERS = ('presenze', 'assenze', 'missioni', 'indice', 'scaglione', 'posizione', 'media', 'ribelle',
+            'maggioranza_sotto', 'maggioranza_sotto_assente', 'maggioranza_salva', 'maggioranza_salva_assente')
+
+# house of the votations of each charge type (see OppDBVotationsWriter.HOUSE_CHARGE_TYPES)
+CHARGE_TYPE_HOUSES = {
+    'Deputato': 'C',
+    'Senatore': 'S',
+    'Senatore a vita': 'S',
+}
+
+RANKS = ('presenze', 'presenze_pos', 'assenze', 'assenze_pos', 'missioni', 'missioni_pos',
+         'indice', 'indice_pos', 'ribellioni', 'ribellioni_pos')
+
+
+def isodate(d):
+    return d.isoformat() if d else None
+
+
+def current_groups(charge_ids):
+    """
+    the current (or last) group of each charge
+    """
+    groups = {}
+    memberships = CaricaHasGruppo.objects.filter(charge_id__in=charge_ids).select_related('group')
+    for m in memberships:
+        last = groups.get(m.charge_id)
+        # current memberships (with no end date) win, then the latest started
+        if last is None or (last.end_date is not None and (m.end_date is None or m.start_date > last.start_date)):
+            groups[m.charge_id] = m
+    return dict(
+        (charge_id, {
+            'id': m.group_id,
+            'nome': m.group.name,
+            'acronimo': m.group.acronym,
+            'dal': isodate(m.start_date),
+            'al': isodate(m.end_date),
+        })
+        for charge_id, m in groups.items()
+    )
+
+
+def latest_ranks(charge_ids):
+    """
+    the latest PoliticianHistoryCache ranks of each charge
+    """
+    rows = PoliticianHistoryCache.objects.filter(chi_tipo='P', chi_id__in=charge_ids).order_by()
+    last_dates = dict(rows.values_list('chi_id').annotate(last=Max('update_date')))
+    if not last_dates:
+        return {}
+
+    ranks = {}
+    for row in rows.filter(update_date__in=set(last_dates.values())).values('chi_id', 'update_date', *RANKS):
+        if row['update_date'] == last_dates[row['chi_id']]:
+            ranks[row['chi_id']] = dict((field, row[field]) for field in RANKS)
+            ranks[row['chi_id']]['data'] = isodate(row['update_date'])
+    return ranks
+
+
+def recent_votes(charge_ids, house, legislature, n=RECENT_VOTES):
+    """
+    the votes of each charge in the latest n votations of the house in the legislature;
+    charges in office vote (or are absent) in all of them
+    """
+    votation_ids = list(Votazione.objects.filter(sitting__house=house, sitting__legislatura=legislature).order_by(
+        '-sitting__date', '-numero_votazione'
+    ).values_list('id', flat=True)[:n])
+
+    votes = {}
+    rows = VotazioneHasCarica.objects.filter(charge_id__in=charge_ids, vote_id__in=votation_ids).order_by(
+        '-vote__sitting__date', '-vote__numero_votazione'
+    ).values_list(
+        'charge_id', 'vote_id', 'vote__sitting__date', 'vote__numero_votazione', 'vote__titolo',
+        'vote__esito', 'voting', 'rebel'
+    )
+    for charge_id, vote_id, d, number, title, result, voting, rebel in rows:
+        votes.setdefault(charge_id, []).append({
+            'votazione': vote_id,
+            'data': isodate(d),
+            'numero': number,
+            'titolo': title,
+            'esito': result,
+            'voto': voting,
+            'ribelle': bool(rebel),
+        })
+    return votes
+
+
+def build_documents(charge_ids):
+    """
+    return a dict mapping each charge to its profile document
+    """
+    charges = list(Carica.objects.filter(id__in=charge_ids).select_related('politician', 'charge_type'))
+    if not charges:
+        return {}
+    ids = [c.id for c in charges]
+    groups = current_groups(ids)
+    ranks = latest_ranks(ids)
+    counts = votecounts.baselines(CumulativeVoteCount.CHARGE, ids, before=None)
+    votes = {}
+    by_house = {}
+    for c in charges:
+        house = CHARGE_TYPE_HOUSES.get(c.charge_type.name)
+        if house and c.legislatura:
+            by_house.setdefault((house, c.legislatura), []).append(c.id)
+    for (house, legislature), house_charge_ids in by_house.items():
+        votes.update(recent_votes(house_charge_ids, house, legislature))
+
+    documents = {}
+    for c in charges:
+        documents[c.id] = {
+            'carica': {
+                'id': c.id,
+                'tipo': c.charge_type.name,
+                'carica': c.charge,
+                'legislatura': c.legislatura,
+                'circoscrizione': c.district,
+                'dal': isodate(c.start_date),
+                'al': isodate(c.end_date),
+            },
+            'politico': {
+                'id': c.politician_id,
+                'nome': c.politician.name,
+                'cognome': c.politician.surname,
+                'sesso': c.politician.gender,
+            },
+            'gruppo': groups.get(c.id),
+            'contatori': dict((field, getattr(c, field)) for field in COUNTERS),
+            'voti': dict(zip(votecounts.COUNTERS, counts[c.id])) if c.id in counts else None,
+            'classifiche': ranks.get(c.id),
+            'ultimi_voti': votes.get(c.id, []),
+        }
+    return documents
+
+
+def rebuild(charge_ids, batch_size=BATCH_SIZE):
+    """
+    rebuild the profiles of the charges, in batches
+
+    returns the number of profiles written
+    """
+    charge_ids = list(charge_ids)
+    n = 0
+    for i in range(0, len(charge_ids), batch_size):
+        documents = build_documents(charge_ids[i:i + batch_size])
+        with transaction.atomic():
+            CaricaProfile.objects.filter(charge_id__in=list(documents)).delete()
+            CaricaProfile.objects.bulk_create([
+                CaricaProfile(charge_id=charge_id, document=json.dumps(document))
+                for charge_id, document in documents.items()
+            ])
+        n += len(documents)
+    return n
+
+
+def profile_json(charge_id):
+    """
+    the profile document of a charge, as JSON, or None
+    """
+    documents = list(CaricaProfile.objects.filter(charge_id=charge_id).values_list('document', flat=True)[:1])
+    return documents[0] if documents else None
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Query plans of the SQL statements, and an index advisor.
+
+The opp tables are not managed by Django, so their indexes are not
+checked against the queries actually issued: statements recorded with
+a QueryRecorder are explained here, flagging
+
+  - full scans of the tables (beyond FULL_SCAN_MIN_ROWS rows),
+  - sorts not using an index (filesorts) and temporary tables,
+
+and suggesting, for the flagged tables, a composite index: the columns
+compared by equality in the WHERE clause, then the one compared by range,
+then the ORDER BY ones, unless an existing index already starts with them.
+
+Queries are explained with their own parameters, so they must be recorded
+with them, as the logged SQL is not interpolated by all the backends::
+
+    from opp.instrumentation import QueryRecorder
+    from opp import queryplans
+    with QueryRecorder(params=True) as recorder:
+        client.get('/api/cariche/1/')
+    for plan in queryplans.explain_all(recorder.captured_queries):
+        print(plan.report())
+
+MySQL (EXPLAIN) and SQLite (EXPLAIN QUERY PLAN) are supported.
+"""
+import hashlib
+import logging
+import re
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+from opp.instrumentation import normalize_sql
+
+__author__ = 'guglielmo'
+
+
+logger = logging.getLogger('queries')
+
+# full scans of smaller tables are not flagged
+FULL_SCAN_MIN_ROWS = 1000
+
+FULL_SCAN = 'full scan'
+FILESORT = 'filesort'
+TEMPORARY = 'temporary'
+
+# "table"."column" or `table`.`column`, followed by the comparison
+column_regexp = re.compile(
+    r'[`"](\w+)[`"]\.[`"](\w+)[`"]\s*(=|IN\b|>=|<=|>|<|BETWEEN\b|LIKE\b|IS\b)', re.IGNORECASE
+)
+order_regexp = re.compile(r'\bORDER BY\b(.*?)(?:\bLIMIT\b|$)', re.IGNORECASE | re.DOTALL)
+order_column_regexp = re.compile(r'[`"](\w+)[`"]\.[`"](\w+)[`"]')
+where_regexp = re.compile(r'\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|$)', re.IGNORECASE | re.DOTALL)
+sqlite_scan_regexp = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+
+RANGE_OPERATORS = ('>=', '<=', '>', '<', 'BETWEEN', 'LIKE')
+
+
+def fingerprint(sql):
+    """
+    a short id of the statement, modulo its parameters
+    """
+    return hashlib.sha1(normalize_sql(sql).encode('utf8')).hexdigest()[:12]
+
+
+def statement(query):
+    """
+    the (sql, params) of a query captured by a QueryRecorder; queries recorded
+    without their parameters are returned as logged, with no parameters
+    """
+    if 'statement' in query:
+        return query['statement'], query['params']
+    return query['sql'], None
+
+
+class QueryPlan(object):
+    """
+    The plan of a statement: its steps, as (table, access, key, rows) tuples, and the flags
+    """
+
+    def __init__(self, sql, steps, flags, suggestions=(), params=None):
+        self.sql = sql
+        self.params = params
+        self.steps = steps
+        self.flags = flags
+        self.suggestions = list(suggestions)
+
+    @property
+    def fingerprint(self):
+        return fingerprint(self.sql)
+
+    @property
+    def signature(self):
+        """
+        the plan, as a string, to detect plan changes among runs
+        """
+        return ' | '.join('{0}:{1}:{2}'.format(table, access, key or '-') for table, access, key, _ in self.steps)
+
+    def as_dict(self):
+        return {
+            'sql': normalize_sql(self.sql)[:1000],
+            'plan': self.signature,
+            'flags': sorted(self.flags),
+            'suggestions': self.suggestions,
+        }
+
+    def report(self):
+        lines = ["{0} {1}".format(self.fingerprint, normalize_sql(self.sql)[:200]), "    plan: " + self.signature]
+        for table, flag in sorted(self.flags):
+            lines.append("    {0} on {1}".format(flag, table))
+        for suggestion in self.suggestions:
+            lines.append("    suggested: " + suggestion)
+        return "\n".join(lines)
+
+
+def mysql_plan(cursor, sql, params=None):
+    cursor.execute('EXPLAIN ' + sql, params)
+    columns = [c[0].lower() for c in cursor.description]
+    steps, flags = [], set()
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        table, access, extra = row.get('table'), row.get('type'), row.get('extra') or ''
+        rows = row.get('rows') or 0
+        steps.append((table, access, row.get('key'), rows))
+        if access == 'ALL' and rows >= FULL_SCAN_MIN_ROWS:
+            flags.add((table, FULL_SCAN))
+        if 'Using filesort' in extra:
+            flags.add((table, FILESORT))
+        if 'Using temporary' in extra:
+            flags.add((table, TEMPORARY))
+    return steps, flags
+
+
+def sqlite_plan(cursor, sql, params=None):
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    steps, flags = [], set()
+    table = None
+    for row in cursor.fetchall():
+        detail = row[-1]
+        m = sqlite_scan_regexp.match(detail)
+        if m:
+            table = m.group(1)
+            key = m.group(2).split('INDEX', 1)[1].strip() if 'INDEX' in m.group(2) else None
+            steps.append((table, 'scan', key, None))
+            # no row estimates here: scans, even of a whole index, are flagged
+            flags.add((table, FULL_SCAN))
+        elif detail.startswith('SEARCH'):
+            parts = detail.split()
+            table = parts[2] if parts[1] == 'TABLE' else parts[1]
+            key = detail.split('INDEX', 1)[1].split()[0] if 'INDEX' in detail else None
+            steps.append((table, 'search', key, None))
+        elif 'TEMP B-TREE' in detail:
+            flags.add((table, FILESORT if 'ORDER BY' in detail else TEMPORARY))
+    return steps, flags
+
+
+def mysql_indexes(cursor, table):
+    cursor.execute('SHOW INDEX FROM `{0}`'.format(table))
+    columns = [c[0].lower() for c in cursor.description]
+    indexes = {}
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        indexes.setdefault(row['key_name'], []).append((row['seq_in_index'], row['column_name']))
+    return [[c for _, c in sorted(cols)] for cols in indexes.values()]
+
+
+def sqlite_indexes(cursor, table):
+    cursor.execute('PRAGMA index_list("{0}")'.format(table))
+    names = [row[1] for row in cursor.fetchall()]
+    indexes = []
+    for name in names:
+        cursor.execute('PRAGMA index_info("{0}")'.format(name))
+        indexes.append([row[2] for row in sorted(cursor.fetchall())])
+    return indexes
+
+
+VENDORS = {
+    'mysql': (mysql_plan, mysql_indexes),
+    'sqlite': (sqlite_plan, sqlite_indexes),
+}
+
+
+def index_columns(sql, table):
+    """
+    the columns of a composite index serving the statement on the table:
+    equality columns, then a range column, then the order by columns
+    """
+    equality, ranges, order = [], [], []
+    where = where_regexp.search(sql)
+    for t, column, operator in column_regexp.findall(where.group(1) if where else ''):
+        if t != table:
+            continue
+        target = ranges if operator.upper() in RANGE_OPERATORS else equality
+        if column not in equality and column not in target:
+            target.append(column)
+    m = order_regexp.search(sql)
+    for t, column in order_column_regexp.findall(m.group(1) if m else ''):
+        if t == table and column not in equality and column not in order:
+            order.append(column)
+    # past a range column, an index does not serve the sort
+    if ranges:
+        return equality + ranges[:1]
+    return equality + order
+
+
+def suggest(sql, flags, indexes):
+    """
+    return the CREATE INDEX statements suggested for the flagged tables of the statement;
+    indexes maps the tables to their existing indexes, as lists of columns
+    """
+    suggestions = []
+    for table in sorted(set(t for t, _ in flags if t)):
+        columns = index_columns(sql, table)
+        if not columns:
+            continue
+        if any(index[:len(columns)] == columns for index in indexes.get(table, ())):
+            continue
+        suggestions.append('CREATE INDEX {0}_{1}_idx ON {0} ({2})'.format(
+            table, '_'.join(columns), ', '.join(columns)
+        ))
+    return suggestions
+
+
+def explain_all(queries, using=DEFAULT_DB_ALIAS):
+    """
+    return the QueryPlan of each distinct SELECT statement among the queries
+    (as captured by a QueryRecorder, with params), with the suggested indexes
+    """
+    connection = connections[using]
+    plan, table_indexes = VENDORS[connection.vendor]
+    indexes = {}
+    plans, seen = [], set()
+    cursor = connection.cursor()
+    try:
+        for q in queries:
+            sql, params = statement(q)
+            key = fingerprint(sql)
+            if key in seen or not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            seen.add(key)
+            try:
+                steps, flags = plan(cursor, sql, params)
+            except DatabaseError as e:
+                logger.warning("statement {0} not explained: {1}".format(key, e))
+                continue
+            for table in set(t for t, _ in flags if t):
+                if table not in indexes:
+                    indexes[table] = table_indexes(cursor, table)
+            plans.append(QueryPlan(sql, steps, flags, suggest(sql, flags, indexes), params=params))
+    finally:
+        cursor.close()
+    return plans
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Reconciliation of the import status of the sittings of a legislature.
+
+The completeness of all the sittings is computed from one grouped
+query over their votations, counting the single votes of each:
+
+  - votations are numbered from 1 in each sitting, so the missing
+    ones are the gaps in the numbers, up to the last one imported;
+  - a votation is complete when it's flagged as imported and has the
+    votes of all the seats of the house (e.g. 630 at la Camera).
+
+Seduta.is_imported is then bulk-updated, and the sittings and
+votations to re-fetch are listed, for the incremental importer::
+
+    from opp import reconcile
+    status = reconcile.reconcile('C', 17)
+    for sitting, numbers in status.refetch:
+        ...
+"""
+from django.db.models import Count
+from opp.models import Seduta, Votazione
+
+__author__ = 'guglielmo'
+
+
+# votes expected in each votation
+HOUSE_SEATS = {
+    'C': 630,
+    'S': 315,
+}
+
+
+class SittingStatus(object):
+    __slots__ = ('sitting_id', 'num', 'date', 'reference_url', 'is_imported',
+                 'votations', 'imported', 'last_number', 'missing', 'incomplete')
+
+    def __init__(self, sitting_id, num, date, reference_url, is_imported):
+        self.sitting_id = sitting_id
+        self.num = num
+        self.date = date
+        self.reference_url = reference_url
+        self.is_imported = is_imported
+        self.votations = 0
+        self.imported = 0
+        self.last_number = 0
+        # numbers of the votations missing, or not completely imported
+        self.missing = []
+        self.incomplete = []
+
+    @property
+    def complete(self):
+        return self.votations > 0 and not self.missing and not self.incomplete
+
+    def as_dict(self):
+        return {
+            'id': self.sitting_id,
+            'numero': self.num,
+            'data': self.date.isoformat() if self.date else None,
+            'votazioni': self.votations,
+            'importate': self.imported,
+            'mancanti': self.missing,
+            'incomplete': self.incomplete,
+        }
+
+
+class Reconciliation(object):
+
+    def __init__(self, house, legislature, sittings):
+        self.house = house
+        self.legislature = legislature
+        self.sittings = sittings
+        self.updated = 0
+
+    @property
+    def refetch(self):
+        """
+        (sitting status, votation numbers) of the sittings to re-fetch;
+        numbers are empty for the sittings with no votations in the DB,
+        not known to have none, to be fetched whole
+        """
+        return [
+            (s, sorted(s.missing + s.incomplete))
+            for s in self.sittings if not s.complete and (s.votations or not s.is_imported)
+        ]
+
+    def summary(self):
+        return {
+            'ramo': self.house,
+            'legislatura': self.legislature,
+            'sedute': len(self.sittings),
+            'complete': sum(1 for s in self.sittings if s.complete),
+            'senza_votazioni': sum(1 for s in self.sittings if not s.votations),
+            'votazioni_mancanti': sum(len(s.missing) for s in self.sittings),
+            'votazioni_incomplete': sum(len(s.incomplete) for s in self.sittings),
+            'sedute_aggiornate': self.updated,
+        }
+
+
+def sittings_status(house='C', legislature=17, sitting_ids=None, min_votes=None):
+    """
+    return the SittingStatus of the sittings of a legislature, or just the given ones
+    """
+    min_votes = min_votes if min_votes is not None else HOUSE_SEATS[house]
+
+    sittings = Seduta.objects.filter(house=house, legislatura=legislature)
+    votations = Votazione.objects.filter(sitting__house=house, sitting__legislatura=legislature)
+    if sitting_ids is not None:
+        sittings = sittings.filter(id__in=sitting_ids)
+        votations = votations.filter(sitting_id__in=sitting_ids)
+
+    status = dict(
+        (row[0], SittingStatus(*row))
+        for row in sittings.values_list('id', 'number', 'date', 'reference_url', 'is_imported')
+    )
+    numbers = {}
+
+    # one grouped query: the votes of each votation
+    rows = votations.values('sitting_id', 'numero_votazione', 'is_imported').annotate(
+        n_votes=Count('votazionehascarica')
+    ).values_list('sitting_id', 'numero_votazione', 'is_imported', 'n_votes')
+    for sitting_id, number, is_imported, n_votes in rows:
+        s = status[sitting_id]
+        s.votations += 1
+        s.last_number = max(s.last_number, number)
+        numbers.setdefault(sitting_id, set()).add(number)
+        if is_imported and n_votes >= min_votes:
+            s.imported += 1
+        else:
+            s.incomplete.append(number)
+
+    for sitting_id, s in status.items():
+        present = numbers.get(sitting_id, ())
+        s.missing = [n for n in range(1, s.last_number + 1) if n not in present]
+        s.incomplete.sort()
+
+    return sorted(status.values(), key=lambda s: (s.date, s.num))
+
+
+def reconcile(house='C', legislature=17, sitting_ids=None, min_votes=None, dry_run=False):
+    """
+    compute the import status of the sittings, and bulk-update their is_imported flag;
+    sittings with no votations in the DB are left untouched
+
+    returns a Reconciliation
+    """
+    sittings = sittings_status(house, legislature, sitting_ids, min_votes)
+    result = Reconciliation(house, legislature, sittings)
+    if dry_run:
+        return result
+
+    complete = [s.sitting_id for s in sittings if s.complete and not s.is_imported]
+    incomplete = [s.sitting_id for s in sittings if s.votations and not s.complete and s.is_imported]
+    if complete:
+        result.updated += Seduta.objects.filter(id__in=complete).update(is_imported=1)
+    if incomplete:
+        result.updated += Seduta.objects.filter(id__in=incomplete).update(is_imported=0)
+    return result
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Database routing between the primary and a read replica.
+
+Writes always go to the primary (``default``); reads go to the replica
+alias (settings.DATABASE_REPLICA_ALIAS), when it's configured, except:
+
+- within a transaction on the primary,
+- when the current thread is pinned to the primary (see ``pin_to_primary``;
+  threads started by a pinned thread are pinned with ``carry_pin``),
+- for REPLICA_LAG_SECONDS after an import wrote into the primary,
+  not to read data the replica has not received yet,
+- for the entries of the DB cache, the time of the last import among them.
+
+Import commands pin themselves and mark the primary as written when they end;
+web requests are pinned with the ``PrimaryPinningMiddleware``.
+
+To try it locally, with two SQLite databases::
+
+    DB_DEFAULT_URL=sqlite:////tmp/opp_primary.db
+    DB_REPLICA_URL=sqlite:////tmp/opp_replica.db
+
+a simple usage::
+
+    from opp.routers import pin_to_primary
+    with pin_to_primary():
+        Votazione.objects.get(pk=votation_id)
+"""
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+__author__ = 'guglielmo'
+
+
+PRIMARY_WRITTEN_CACHE_KEY = 'opp:routers:primary_written_at'
+
+# app label of the entries of the DB cache backend
+CACHE_APP_LABEL = 'django_cache'
+
+_local = threading.local()
+
+
+def is_pinned():
+    return getattr(_local, 'pinned', 0) > 0
+
+
+@contextmanager
+def pin_to_primary():
+    """
+    route all the queries of the enclosed block, in the current thread, to the primary
+    """
+    _local.pinned = getattr(_local, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _local.pinned -= 1
+
+
+def primary_only(func):
+    """
+    decorator pinning the function (a view, a command's handle) to the primary
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with pin_to_primary():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def carry_pin(func):
+    """
+    wrap a function to run in other threads (of a pool), so that it's pinned
+    to the primary there too, when the current thread is pinned
+    """
+    if not is_pinned():
+        return func
+    return primary_only(func)
+
+
+def mark_primary_written():
+    """
+    record that the primary was just written, so that reads are routed
+    to the primary until the replica has caught up
+    """
+    _lag.written_at = time.time()
+    cache.set(PRIMARY_WRITTEN_CACHE_KEY, _lag.written_at, settings.REPLICA_LAG_SECONDS)
+
+
+class ReplicaLag(object):
+    """
+    Whether the replica may still lag behind the last write to the primary.
+
+    The time of the last write is shared through the cache, among processes
+    (see CACHES in the settings); it's read at most once every CHECK_INTERVAL seconds.
+    """
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self.written_at = 0
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def lagging(self):
+        now = time.time()
+        if now - self.checked_at > self.CHECK_INTERVAL:
+            with self.lock:
+                self.checked_at = now
+                self.written_at = max(self.written_at, cache.get(PRIMARY_WRITTEN_CACHE_KEY) or 0)
+        return now - self.written_at < settings.REPLICA_LAG_SECONDS
+
+
+_lag = ReplicaLag()
+
+
+class PrimaryReplicaRouter(object):
+    """
+    Routes reads to the replica and writes to the primary
+    """
+
+    def replica(self):
+        alias = getattr(settings, 'DATABASE_REPLICA_ALIAS', None)
+        if alias and alias in settings.DATABASES:
+            return alias
+        return None
+
+    def db_for_read(self, model, **hints):
+        replica = self.replica()
+        if replica is None or model._meta.app_label == CACHE_APP_LABEL or is_pinned() or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block or _lag.lagging():
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same data
+        return True
+
+    def allow_syncdb(self, db, model):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinningMiddleware(object):
+    """
+    Pins to the primary the requests that may write (POST, PUT, ...),
+    and those asking for it with the X-Opp-Primary header,
+    so that they read their own writes
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def process_request(self, request):
+        if request.method not in self.SAFE_METHODS or request.META.get('HTTP_X_OPP_PRIMARY'):
+            request._pinned_to_primary = pin_to_primary()
+            request._pinned_to_primary.__enter__()
+
+    def process_response(self, request, response):
+        pinned = getattr(request, '_pinned_to_primary', None)
+        if pinned is not None:
+            pinned.__exit__(None, None, None)
+            request._pinned_to_primary = None
+        return response
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from django.core.management.color import no_style
+from django.db import connections
+from django.db.models import get_models
+from django.test.runner import DiscoverRunner
+
+__author__ = 'guglielmo'
+
+
+class ManagedModelTestRunner(DiscoverRunner):
+    """
+    Test runner creating, in the test DB, the tables of the models not managed
+    by Django (the Openparlamento tables), restoring them as unmanaged afterwards.
+
+    Fields mapped on the column of another field (as PoliticianHistoryCache.charge,
+    on chi_id) are left out of the created tables.
+    """
+
+    def setup_test_environment(self, *args, **kwargs):
+        self.unmanaged_models = [m for m in get_models() if not m._meta.managed]
+        for m in self.unmanaged_models:
+            m._meta.managed = True
+        super(ManagedModelTestRunner, self).setup_test_environment(*args, **kwargs)
+
+    def teardown_test_environment(self, *args, **kwargs):
+        super(ManagedModelTestRunner, self).teardown_test_environment(*args, **kwargs)
+        for m in self.unmanaged_models:
+            m._meta.managed = False
+
+    def setup_databases(self, **kwargs):
+        # models with shared columns can not be created by syncdb
+        shared = [m for m in self.unmanaged_models if self.shared_columns(m)]
+        for m in shared:
+            m._meta.managed = False
+        old_config = super(ManagedModelTestRunner, self).setup_databases(**kwargs)
+        for m in shared:
+            m._meta.managed = True
+            self.create_table(m)
+        return old_config
+
+    @staticmethod
+    def shared_columns(model):
+        columns = [f.column for f in model._meta.local_fields]
+        return len(columns) != len(set(columns))
+
+    @staticmethod
+    def create_table(model):
+        opts = model._meta
+        fields, columns = [], set()
+        for f in opts.local_fields:
+            if f.column not in columns:
+                fields.append(f)
+                columns.add(f.column)
+        local_fields = opts.local_fields
+        opts.local_fields = fields
+        try:
+            for alias in connections:
+                connection = connections[alias]
+                statements, _ = connection.creation.sql_create_model(model, no_style())
+                cursor = connection.cursor()
+                for statement in statements:
+                    cursor.execute(statement)
+        finally:
+            opts.local_fields = local_fields
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Full-text search over votations.
+
+A small inverted index, stored in the ``opp_votazione_search_posting`` table,
+maps normalized italian terms to the votations containing them.
+
+The index is updated incrementally by the DB writer, each time votations
+are imported, and can be rebuilt from scratch with the
+``rebuild_search_index`` management command.
+
+a simple usage::
+
+    from opp import search
+    search.search_votations('decreto sblocca italia', legislatura=17)
+"""
+import math
+import re
+import unicodedata
+from django.db import transaction
+from django.db.models import Count
+from opp.models import Votazione, VotazioneSearchPosting
+
+__author__ = 'guglielmo'
+
+
+# fields indexed for each votation, with their weights
+FIELD_WEIGHTS = (
+    ('titolo', 3.0),
+    ('titolo_aggiuntivo', 2.0),
+    ('descrizione', 1.0),
+)
+
+STOPWORDS = frozenset("""
+a ad al alla alle allo agli ai all anche che chi con cui da dal dalla dalle dallo
+dagli dai dall de del della delle dello degli dei dell di e ed gli i il in l la le
+lo ma ne negli nei nel nella nelle nello nell non o od per piu pi se si sia sono
+su sul sulla sulle sullo sugli sui sull tra fra un una uno n nn art artt comma
+""".split())
+
+# suffixes stripped by the light stemmer, longest first
+SUFFIXES = (
+    'azioni', 'azione', 'amenti', 'amento', 'imenti', 'imento',
+    'zioni', 'zione', 'mente', 'ibili', 'abili', 'ibile', 'abile',
+    'ista', 'iste', 'isti', 'ismo', 'ismi',
+)
+
+token_regexp = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(text):
+    """
+    Lowercase the text and strip accents (è -> e, à -> a, ...)
+    """
+    if isinstance(text, str):
+        text = text.decode('utf8')
+    text = unicodedata.normalize('NFKD', text.lower())
+    return u''.join(c for c in text if not unicodedata.combining(c))
+
+
+def stem(token):
+    """
+    Light italian stemmer.
+
+    Strips the most common derivational suffixes and the final
+    inflectional vowel, so that *decreto*, *decreti* and *decreta*
+    end up in the same term. Numbers are left untouched.
+    """
+    if token.isdigit() or len(token) <= 4:
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    if token[-1] in u'aeiou':
+        token = token[:-1]
+        # plurals in -chi, -ghi
+        if token[-1] == u'h' and token[-2] in u'cg':
+            token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    """
+    Return the list of index terms for the text, in order of appearance.
+    """
+    if not text:
+        return []
+    return [
+        stem(t) for t in token_regexp.findall(normalize(text))
+        if t not in STOPWORDS and (len(t) > 1 or t.isdigit())
+    ]
+
+
+def votation_terms(votation):
+    """
+    Return a dict mapping each term of the votation to its weighted frequency
+    """
+    terms = {}
+    for field, weight in FIELD_WEIGHTS:
+        for term in tokenize(getattr(votation, field)):
+            terms[term] = terms.get(term, 0.0) + weight
+    return terms
+
+
+def index_votations(votations):
+    """
+    (Re)index the given votations.
+
+    Old postings are removed and new ones are written in bulk,
+    so it is safe to call this for already indexed votations.
+
+    :votations: an iterable of Votazione instances, with their sitting
+    """
+    postings = []
+    ids = []
+    for v in votations:
+        ids.append(v.id)
+        postings.extend([
+            VotazioneSearchPosting(
+                vote_id=v.id, legislatura=v.sitting.legislatura,
+                term=term[:VotazioneSearchPosting.TERM_MAX_LENGTH], weight=weight
+            )
+            for term, weight in votation_terms(v).items()
+        ])
+
+    with transaction.atomic():
+        VotazioneSearchPosting.objects.filter(vote_id__in=ids).delete()
+        VotazioneSearchPosting.objects.bulk_create(postings, batch_size=1000)
+
+    return len(postings)
+
+
+def search_votations(query, legislatura=None, limit=20):
+    """
+    Return the list of (votation_id, score) tuples best matching query,
+    sorted by decreasing score.
+
+    Votations containing more of the query terms always rank first,
+    then the TF-IDF score is used.
+    """
+    terms = list(set(tokenize(query)))
+    if not terms:
+        return []
+
+    postings = VotazioneSearchPosting.objects.filter(term__in=terms)
+    votations = Votazione.objects.all()
+    if legislatura is not None:
+        postings = postings.filter(legislatura=legislatura)
+        votations = votations.filter(sitting__legislatura=legislatura)
+
+    # document frequencies and number of votations searched, for the idf
+    n_docs = votations.count() or 1
+    df = dict(postings.values_list('term').annotate(df=Count('id')))
+
+    scores = {}
+    for vote_id, term, weight in postings.values_list('vote_id', 'term', 'weight'):
+        idf = math.log(1.0 + float(n_docs) / df[term])
+        matched, score = scores.get(vote_id, (0, 0.0))
+        scores[vote_id] = (matched + 1, score + weight * idf)
+
+    ranking = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+    return [(vote_id, round(score, 4)) for vote_id, (matched, score) in ranking]
+
+
+def rebuild_index(legislatura=None, batch_size=500):
+    """
+    Rebuild the whole index, or the part of the index for a legislature
+    """
+    votations = Votazione.objects.select_related('sitting').order_by('id')
+    if legislatura is not None:
+        votations = votations.filter(sitting__legislatura=legislatura)
+
+    n_postings = 0
+    batch = []
+    for v in votations.iterator():
+        batch.append(v)
+        if len(batch) >= batch_size:
+            n_postings += index_votations(batch)
+            batch = []
+    if batch:
+        n_postings += index_votations(batch)
+
+    return n_postings
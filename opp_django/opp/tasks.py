@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Import tasks, run by the jobs workers (see opp.jobs).
+
+Imports are split in month, sitting and votation tasks,
+each enqueuing the finer-grained ones, so that the votations
+of a month are imported in parallel by all the workers::
+
+    jobs.enqueue('import_month', {'month': '2014-03', 'house': 'C', 'legislature': 17}, house='C')
+"""
+from django.conf import settings
+from opp import jobs
+from opp.models import Votazione
+from parser.archive import PageArchive
+from parser.records import Sitting, VotationRef
+from parser.registry import get_reader as get_registered_reader
+from parser.writers import OppDBVotationsWriter
+
+__author__ = 'guglielmo'
+
+
+# legislature of the jobs enqueued with no legislature in their args
+DEFAULT_LEGISLATURE = 17
+
+
+def house_legislature(args):
+    return args.get('house', 'C'), int(args.get('legislature', DEFAULT_LEGISLATURE))
+
+
+def get_reader(logger, house, legislature):
+    # no page digests here: votations already imported are not enqueued at all
+    archive = PageArchive(settings.PAGE_ARCHIVE_ROOT) if settings.PAGE_ARCHIVE_ROOT else None
+    return get_registered_reader(house, legislature, logger=logger, archive=archive)
+
+
+@jobs.task('import_month')
+def import_month(args, logger):
+    """
+    enqueue the import of the sittings of a month
+    """
+    house, legislature = house_legislature(args)
+    reader = get_reader(logger, house, legislature)
+    for sitting in reader.get_sittings(args['month']):
+        jobs.enqueue('import_sitting', dict(
+            sitting.as_dict(), house=house, legislature=legislature
+        ), house=house, priority=1)
+
+
+@jobs.task('import_sitting')
+def import_sitting(args, logger):
+    """
+    write the sitting and enqueue the import of its votations not yet imported,
+    or listed in refetch (see opp.reconcile)
+    """
+    house, legislature = house_legislature(args)
+    sitting = Sitting.from_dict(args)
+    writer = OppDBVotationsWriter(logger)
+    writer.write_sittings([sitting], house=house, legislature=legislature)
+
+    reader = get_reader(logger, house, legislature)
+    votations = reader.get_votations(sitting.date)
+    # sittings are numbered from 1 in each legislature
+    imported = set(Votazione.objects.filter(
+        sitting__house=house, sitting__legislatura=legislature, sitting__number=sitting.num, is_imported=1
+    ).values_list('numero_votazione', flat=True))
+    refetch = set(args.get('refetch', ()))
+
+    for votation in votations:
+        _, number = votation.ref_numbers.split('_')
+        if int(number) in imported and int(number) not in refetch:
+            continue
+        jobs.enqueue('import_votation', {
+            'house': house, 'legislature': legislature, 'sitting': sitting.as_dict(),
+            'ref_numbers': votation.ref_numbers, 'uri': votation.uri,
+        }, house=house, priority=2)
+
+
+@jobs.task('import_votation')
+def import_votation(args, logger):
+    """
+    fetch the details of a votation and write them, with the single votes
+    """
+    house, legislature = house_legislature(args)
+    reader = get_reader(logger, house, legislature)
+    votation = VotationRef(args['ref_numbers'], args['uri'])
+    votation.details = reader.get_votation_details(votation.ref_numbers)
+
+    sitting = Sitting.from_dict(args['sitting'])
+    sitting.votations = [votation]
+    writer = OppDBVotationsWriter(logger)
+    writer.write_votations([sitting], house=house, legislature=legislature, counts=False)
+
+    # the counts and the profiles of the voters are updated once per sitting,
+    # a minute after its last votation imported, instead of once per votation
+    jobs.enqueue('update_sitting_counts', {
+        'house': house, 'legislature': legislature, 'sitting': sitting.num
+    }, house=house, delay=60, debounce=True)
+
+    # recompute the maps of the charges, 5 minutes after the last votation imported
+    jobs.enqueue('compute_ideal_points', {'house': house, 'legislature': legislature}, house=house,
+                 delay=300, debounce=True)
+
+
+@jobs.task('update_sitting_counts')
+def update_sitting_counts(args, logger):
+    """
+    update the cumulative vote counts and the profiles of the voters of a sitting
+    """
+    house, legislature = house_legislature(args)
+    votations = list(Votazione.objects.filter(
+        sitting__house=house, sitting__legislatura=legislature, sitting__number=args['sitting'], is_imported=1
+    ).select_related('sitting'))
+    OppDBVotationsWriter(logger).update_counts(votations)
+
+
+@jobs.task('compute_ideal_points')
+def compute_ideal_points(args, logger):
+    """
+    recompute the maps of the charges of a legislature, where new votations entered them
+    """
+    # imported lazily, numpy is only needed here
+    from opp import idealpoints
+    idealpoints.compute_maps(args['house'], args['legislature'], logger)
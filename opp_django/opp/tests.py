@@ -1,3 +1,1253 @@
-from django.test import TestCase
+from datetime import date, timedelta
+import json
+import logging
+import math
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import threading
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from opp import breakdown, pagecache, profiles, search, votecounts
+from opp.instrumentation import QueryBudgetTestMixin
+from opp.models import Carica, CaricaHasGruppo, CumulativeVoteCount, Gruppo, Job, Politico, Seduta, TipoCarica, \
+    Votazione, VotazioneHasCarica
+from parser.records import Sitting, VotationDetail, VotationRef
+from parser.writers import OppDBVotationsWriter
 
-# Create your tests here.
+
+VH = VotazioneHasCarica
+
+
+class OppFixturesMixin(object):
+    """
+    Deputies of two groups, and votations of a sitting, in the Openparlamento tables
+    """
+    N_DEPUTIES = 6
+
+    def create_deputies(self, legislature=17):
+        deputato = TipoCarica.objects.create(name='Deputato')
+        self.groups = [Gruppo.objects.create(name='Gruppo {0}'.format(i), acronym='G{0}'.format(i)) for i in range(2)]
+        self.charges = []
+        for i in range(self.N_DEPUTIES):
+            politician = Politico.objects.create(name='Nome{0}'.format(i), surname='Cognome{0}'.format(i),
+                                                 gender='M', monitoring_users=0)
+            charge = Carica.objects.create(
+                politician=politician, charge_type=deputato, charge='Deputato', legislatura=legislature,
+                start_date=date(2013, 3, 15), maggioranza_sotto=0, maggioranza_sotto_assente=0,
+                maggioranza_salva=0, maggioranza_salva_assente=0
+            )
+            CaricaHasGruppo.objects.create(charge=charge, group=self.groups[i % 2], start_date=date(2013, 3, 15))
+            self.charges.append(charge)
+
+    def create_sitting(self, number=1, d=date(2014, 1, 15), house='C', legislature=17):
+        return Seduta.objects.create(number=number, date=d, house=house, legislatura=legislature,
+                                     reference_url='', is_imported=1)
+
+    def create_votation(self, sitting, number, votes, title='Ddl 1234 - voto finale'):
+        v = Votazione.objects.create(
+            sitting=sitting, numero_votazione=number, titolo=title, titolo_aggiuntivo='', esito='Approvato',
+            finale=0, nb_commenti=0, is_imported=1, ut_fav=0, ut_contr=0, is_maggioranza_sotto_salva=0
+        )
+        VH.objects.bulk_create([
+            VH(vote=v, charge=charge, voting=voting, rebel=0, maggioranza_sotto_salva=0)
+            for charge, voting in zip(self.charges, votes)
+        ])
+        return v
+
+
+class QueryBudgetsTest(OppFixturesMixin, QueryBudgetTestMixin, TestCase):
+    """
+    Query budgets of the key views and import steps, independent of the size of the data
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.create_deputies()
+        sitting = self.create_sitting()
+        self.votations = [
+            self.create_votation(sitting, n, [VH.FAVOREVOLE, VH.CONTRARIO, VH.FAVOREVOLE,
+                                              VH.FAVOREVOLE, VH.ASSENTE, VH.IN_MISSIONE])
+            for n in range(1, 4)
+        ]
+        breakdown.compute_breakdowns([v.id for v in self.votations])
+        votecounts.update_for_votations(self.votations)
+        profiles.rebuild([c.id for c in self.charges])
+
+    def test_votation_group_breakdown(self):
+        with self.assertMaxQueries(1):
+            response = self.client.get('/api/votazioni/{0}/gruppi/'.format(self.votations[0].id))
+        self.assertEqual(response.status_code, 200)
+
+    def test_charge_profile(self):
+        with self.assertMaxQueries(1):
+            response = self.client.get('/api/cariche/{0}/'.format(self.charges[0].id))
+        self.assertEqual(response.status_code, 200)
+
+    def test_charge_vote_counts(self):
+        # a total and three rolling windows, two lookups each
+        with self.assertMaxQueries(8, max_duplicates=6):
+            response = self.client.get('/api/cariche/{0}/presenze/'.format(self.charges[0].id))
+        self.assertEqual(response.status_code, 200)
+        # not cached, the windows of the last days depend on the date
+        path = '/api/cariche/{0}/presenze/'.format(self.charges[0].id)
+        self.assertIsNone(cache.get(pagecache.response_key(path, pagecache.current_version())))
+
+    def sittings(self, n_votations):
+        names = ['COGNOME{0} NOME{0}'.format(i) for i in range(self.N_DEPUTIES)]
+        votations = []
+        for n in range(1, n_votations + 1):
+            details = VotationDetail(u'Ddl 1234 - voto finale', n, u'Nominale', {u'Presenti': u'5'}, u'Approvato')
+            for name, vote in zip(names, [u'Favorevole', u'Contrario', u'Favorevole', u'Astensione',
+                                          u'Non ha votato', u'In missione']):
+                details.set_vote(name, vote)
+            votations.append(VotationRef([n], u'http://www.camera.it/votazione/{0}'.format(n), details=details))
+        return [Sitting(2, date(2014, 1, 16), u'http://www.camera.it/seduta/2', votations=votations)]
+
+    def test_write_votations(self):
+        self.create_sitting(number=2, d=date(2014, 1, 16))
+        writer = OppDBVotationsWriter()
+        # warm the names of the charges
+        writer.charges_by_name()
+
+        # a fixed number of queries for the bulk steps, and a few for each votation written
+        for n in (2, 10):
+            with self.assertMaxQueries(50 + 9 * n):
+                writer.write_votations(self.sittings(n))
+        self.assertEqual(Votazione.objects.filter(sitting__number=2).count(), 10)
+
+
+class DiffTest(OppFixturesMixin, TestCase):
+
+    VOTES = [u'Favorevole', u'Contrario', u'Favorevole', u'Astensione', u'Non ha votato', u'In missione']
+
+    def sitting(self, num, d, votations):
+        """
+        the record of a sitting, with votations given as (number, title, votes) tuples
+        """
+        refs = []
+        for n, title, votes in votations:
+            details = VotationDetail(title, n, u'Nominale', {u'Presenti': u'5'}, u'Approvato')
+            for i, vote in enumerate(votes):
+                details.set_vote(u'COGNOME{0} NOME{0}'.format(i), vote)
+            refs.append(VotationRef([n], u'http://www.camera.it/votazione/{0}'.format(n), details=details))
+        return Sitting(num, d, u'http://www.camera.it/seduta/{0}'.format(num), votations=refs)
+
+    def test_diff(self):
+        from parser.diff import OppDBVotationsDiff
+
+        self.create_deputies()
+        writer = OppDBVotationsWriter()
+        sittings = [self.sitting(2, date(2014, 1, 16), [(1, u'Ddl 1234', self.VOTES), (2, u'Ddl 1234', self.VOTES)])]
+        writer.write_sittings(sittings)
+        writer.write_votations(sittings)
+        # in the same month, but not read again
+        self.create_sitting(number=3, d=date(2014, 1, 20))
+
+        # a title and a vote changed, a votation left out, another added, a new sitting
+        votes = [u'Favorevole', u'Favorevole'] + self.VOTES[2:]
+        sittings = [
+            self.sitting(2, date(2014, 1, 16), [(1, u'Ddl 1234-A', votes), (3, u'Ddl 1235', self.VOTES[:2])]),
+            self.sitting(4, date(2014, 1, 21), []),
+        ]
+        with self.assertNumQueries(3):
+            diff = OppDBVotationsDiff(writer=writer).diff(sittings)
+
+        self.assertEqual(diff['sittings'].as_dict(), {'new': 1, 'changed': 0, 'missing': 1})
+        self.assertEqual((diff['sittings'].new, diff['sittings'].missing), ([4], [3]))
+        self.assertEqual((diff['votations'].new, diff['votations'].changed, diff['votations'].missing),
+                         ([(2, 3)], [(2, 1)], [(2, 2)]))
+        self.assertEqual(diff['votes'].changed, [(2, 1, u'COGNOME1 NOME1')])
+        self.assertEqual(diff['votes'].new, [(2, 3, u'COGNOME0 NOME0'), (2, 3, u'COGNOME1 NOME1')])
+        self.assertEqual(diff['votes'].missing, [])
+
+    def test_unchanged_sittings_are_not_compared(self):
+        from parser.diff import OppDBVotationsDiff
+
+        sitting = self.sitting(2, date(2014, 1, 16), [(1, u'Ddl 1234', self.VOTES)])
+        sitting.unchanged = True
+        with self.assertNumQueries(0):
+            diff = OppDBVotationsDiff().diff([sitting])
+        self.assertEqual([len(diff[level]) for level in ('sittings', 'votations', 'votes')], [0, 0, 0])
+
+
+class ReplayCorpusMixin(object):
+    """
+    A corpus of a month with a sitting and a votation, replayed by a stand-in server
+    """
+    MONTH_URI = 'http://www.camera.it/leg17/207?annomese=2014,01'
+    LIST_URI = 'http://documenti.camera.it/votazioni/votazionitutte/risultatidb.asp?' \
+               'action=Votazioni&PagCorr=1&Legislatura=17&CDDGIORNO=15&CDDMESE=1&CDDANNO=2014'
+    DETAIL_URI = 'http://documenti.camera.it/votazioni/votazionitutte/schedaVotazione.asp?' \
+                 'Legislatura=17&RifVotazione=152_1'
+
+    MONTH_PAGE = '<html><body><a class="eleres_seduta" href="#">Seduta n. 152 del 15</a></body></html>'
+    LIST_PAGE = '<html><body><div class="itemV">' \
+                '<a href="/schedaVotazione.asp?Legislatura=17&RifVotazione=152_1&tipo=dettaglio">1</a>' \
+                '</div></body></html>'
+    DETAIL_PAGE = '<html><body><div id="titolo">Ddl 1234 - voto finale</div>' \
+                  '<div class="verde12">Votazione nominale n. 1</div>' \
+                  '<table class="esito"><tr><td>Esito</td></tr>' \
+                  '<tr><td>Presenti</td><td>2</td></tr><tr><td>Votanti</td><td>2</td></tr>' \
+                  '<tr><td>Approvato</td></tr></table>' \
+                  '<table class="deputati"><tr><td>Nome</td></tr>' \
+                  '<tr><td>ROSSI MARIO</td><td>Favorevole</td><td></td><td>BIANCHI ANNA</td><td>Contrario</td></tr>' \
+                  '</table></body></html>'
+
+    def replay(self, error_rate=0.0):
+        from parser import ratelimit
+        from parser.replay import Corpus, ReplayServer
+
+        self.tmp = tempfile.mkdtemp()
+        corpus = Corpus(self.tmp)
+        corpus.add(self.MONTH_URI, self.MONTH_PAGE)
+        corpus.add(self.LIST_URI, self.LIST_PAGE)
+        corpus.add(self.DETAIL_URI, self.DETAIL_PAGE)
+        corpus.add_month('2014-01')
+        corpus.save()
+
+        server = ReplayServer(corpus, error_rate=error_rate)
+        server.start()
+        environ = dict(os.environ)
+        limits = ratelimit.limits
+        os.environ['HTTP_PROXY'] = os.environ['http_proxy'] = server.proxy_url
+        ratelimit.limits = ratelimit.HostLimits()
+
+        def restore():
+            server.shutdown()
+            os.environ.clear()
+            os.environ.update(environ)
+            ratelimit.limits = limits
+            shutil.rmtree(self.tmp)
+        self.addCleanup(restore)
+        return corpus
+
+
+class BenchmarkReaderTest(ReplayCorpusMixin, TestCase):
+
+    def test_replay(self):
+        from parser.replay import ReplayVotationsReader
+
+        corpus = self.replay()
+        reader = ReplayVotationsReader()
+        sittings = reader.read(corpus.months)
+        self.assertEqual([s.num for s in sittings], ['152'])
+        self.assertEqual(sittings[0].votations[0].details.detail,
+                         {'ROSSI MARIO': 'Favorevole', 'BIANCHI ANNA': 'Contrario'})
+        self.assertEqual(reader.failed, [])
+
+    def test_failed_pages_are_counted(self):
+        from parser.replay import ReplayVotationsReader
+
+        corpus = self.replay(error_rate=1.0)
+        reader = ReplayVotationsReader(retries=1)
+        self.assertEqual(reader.read(corpus.months), [])
+        self.assertEqual(reader.failed, [self.MONTH_URI])
+
+    def test_compare(self):
+        from opp.management import benchmarks
+        from opp.management.commands.benchmark_reader import Command
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        results_file = os.path.join(tmp, 'results.jsonl')
+        previous = {'commit': 'a', 'timestamp': '2014-01-01T00:00:00',
+                    'votations_per_s': 100.0, 'pages_per_s': 50.0, 'parse_mean_ms': 10.0}
+        benchmarks.store(previous, results_file)
+
+        command = Command()
+        result = dict(previous, commit='b', votations_per_s=95.0, pages_per_s=40.0, parse_mean_ms=12.0)
+        self.assertEqual(command.compare(result, results_file), ['pages_per_s', 'parse_mean_ms'])
+        # results of the same commit are not compared
+        self.assertEqual(command.compare(dict(result, commit='a'), results_file), [])
+        # results of other vendors are not compared, for the query plans
+        self.assertEqual(benchmarks.previous_result(dict(result, vendor='mysql'), results_file, same=('vendor', )),
+                         None)
+
+
+class ImportTasksTest(ReplayCorpusMixin, OppFixturesMixin, TestCase):
+
+    @override_settings(PAGE_ARCHIVE_ROOT='')
+    def test_import_sitting_of_a_legislature(self):
+        from opp import tasks
+
+        self.replay()
+        self.create_deputies()
+        # a sitting with the same number, imported in another legislature
+        self.create_votation(self.create_sitting(number=152, legislature=16), 1, [VH.FAVOREVOLE])
+
+        sitting = Sitting('152', '2014-01-15', 'http://www.camera.it/Leg17/410?idSeduta=152')
+        tasks.import_sitting(dict(sitting.as_dict(), house='C', legislature=17), logging.getLogger('console'))
+        jobs = [json.loads(args) for args in Job.objects.filter(task='import_votation').values_list('args', flat=True)]
+        self.assertEqual([(j['legislature'], j['ref_numbers']) for j in jobs], [(17, '152_1')])
+
+    @override_settings(PAGE_ARCHIVE_ROOT='')
+    def test_counts_are_updated_once_per_sitting(self):
+        from opp import tasks
+
+        corpus = self.replay()
+        corpus.add(self.DETAIL_URI, self.DETAIL_PAGE.replace('ROSSI MARIO', 'COGNOME0 NOME0')
+                                                    .replace('BIANCHI ANNA', 'COGNOME1 NOME1'))
+        self.create_deputies()
+        self.create_sitting(number=152, d=date(2014, 1, 15))
+        sitting = Sitting('152', '2014-01-15', 'http://www.camera.it/Leg17/410?idSeduta=152')
+        logger = logging.getLogger('console')
+
+        tasks.import_votation({
+            'house': 'C', 'legislature': 17, 'sitting': sitting.as_dict(),
+            'ref_numbers': '152_1', 'uri': self.DETAIL_URI
+        }, logger)
+        self.assertEqual(Votazione.objects.get().is_imported, 1)
+        self.assertEqual(VH.objects.count(), 2)
+        self.assertFalse(CumulativeVoteCount.objects.exists())
+
+        job = Job.objects.get(task='update_sitting_counts')
+        tasks.update_sitting_counts(json.loads(job.args), logger)
+        self.assertEqual(set(CumulativeVoteCount.objects.filter(owner_type=CumulativeVoteCount.CHARGE)
+                             .values_list('owner_id', flat=True)), set(VH.objects.values_list('charge_id', flat=True)))
+
+
+class CrawlerTest(TestCase):
+
+    def test_targets_are_crawled_concurrently(self):
+        from parser.crawler import Crawler
+
+        started = []
+        lock = threading.Lock()
+        all_started = threading.Event()
+
+        class Reader(object):
+            def __init__(self, task):
+                self.task = task
+
+            def read(self, months):
+                # each task waits for the other to start
+                with lock:
+                    started.append(str(self.task))
+                    if len(started) == 2:
+                        all_started.set()
+                all_started.wait(5)
+                return [Sitting(str(self.task.legislature), months[0], '')]
+
+        crawler = Crawler([('C', 16), ('C', 17)], ['2014-01'], threads=2, reader_factory=Reader)
+        results = dict((str(task), sittings) for task, sittings in crawler.crawl())
+        self.assertTrue(all_started.is_set())
+        self.assertEqual(sorted(results), ['C16 2014-01', 'C17 2014-01'])
+        self.assertEqual(results['C16 2014-01'][0].num, '16')
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_followers_share_the_result_of_the_leader(self):
+        from parser.singleflight import SingleFlight
+
+        # two processes, sharing the lock files
+        leader, follower = SingleFlight(self.path), SingleFlight(self.path)
+        fetching, waiting, release = threading.Event(), threading.Event(), threading.Event()
+        results = {}
+        elect = follower.elect
+
+        def follower_elect(name):
+            elected = elect(name)
+            waiting.set()
+            return elected
+        follower.elect = follower_elect
+
+        def fetch():
+            fetching.set()
+            release.wait()
+            return 'content'
+
+        def run(name, flights, func):
+            results[name] = flights.do('http://camera.it/a', func)
+
+        threads = [threading.Thread(target=run, args=('leader', leader, fetch))]
+        threads[0].start()
+        fetching.wait()
+        threads.append(threading.Thread(target=run, args=('follower', follower, lambda: 'fetched again')))
+        threads[1].start()
+        waiting.wait()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {'leader': 'content', 'follower': 'content'})
+
+    def test_results_completed_before_the_election_are_shared(self):
+        from parser.singleflight import SingleFlight
+
+        leader, follower = SingleFlight(self.path), SingleFlight(self.path)
+        slot = follower.slot
+
+        def late_slot(lock_name):
+            # the leader completes after the call began, before the first election
+            if not leader.pruned_at:
+                leader.do('http://camera.it/a', lambda: 'content')
+            return slot(lock_name)
+        follower.slot = late_slot
+        self.assertEqual(follower.do('http://camera.it/a', lambda: 'fetched again'), 'content')
+
+
+class WatermarkTest(TestCase):
+
+    def setUp(self):
+        from parser import watermark
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.watermark = watermark
+        self.file, self.urlopen = watermark.WATERMARK_FILE, watermark.urllib2.urlopen
+        watermark.WATERMARK_FILE = os.path.join(tmp, 'watermark.json')
+        watermark.urllib2.urlopen = lambda url, timeout=None: StringIO('<html>{0}</html>'.format(url))
+
+        def restore():
+            watermark.WATERMARK_FILE, watermark.urllib2.urlopen = self.file, self.urlopen
+            watermark.pending.clear()
+        self.addCleanup(restore)
+
+    def test_commands_watching_the_same_pages(self):
+        precheck = self.watermark.precheck
+        self.assertTrue(precheck(['manage.py', 'check_sedute_camera', '--if-changed']))
+        self.watermark.commit()
+        self.assertFalse(precheck(['manage.py', 'check_sedute_camera', '--if-changed']))
+        # the index pages don't list the votations, import_votations is always run
+        self.assertTrue(precheck(['manage.py', 'import_votations', '--if-changed']))
+
+    def test_runs_leaving_sittings_to_import_are_not_skipped(self):
+        precheck = self.watermark.precheck
+        self.assertTrue(precheck(['manage.py', 'check_sedute_camera', '--if-changed']))
+        self.watermark.discard('check_sedute_camera')
+        self.assertTrue(precheck(['manage.py', 'check_sedute_camera', '--if-changed']))
+        self.watermark.commit()
+        self.watermark.discard('check_sedute_camera')
+        self.assertTrue(precheck(['manage.py', 'check_sedute_camera', '--if-changed']))
+
+    def test_watched_urls(self):
+        # the pages read by the reader of the latest legislature
+        self.assertEqual(self.watermark.watched_urls('C', today=date(2014, 1, 15)), [
+            'http://www.camera.it/leg17/207?annomese=2013,12', 'http://www.camera.it/leg17/207?annomese=2014,01'
+        ])
+
+
+class TimeSeriesTest(TestCase):
+
+    def test_round_trip(self):
+        from opp import timeseries
+        from opp.models import PoliticianHistorySeries
+
+        # weekly snapshots, spanning two chunks, with a stable stretch, a gap and a null value
+        start = date(2013, 3, 18)
+        rows = []
+        for i in range(timeseries.CHUNK_POINTS + 44):
+            d = start + timedelta(days=7 * i + (3 if i > 100 else 0))
+            values = dict((metric, None) for metric in timeseries.METRICS)
+            values['presenze'] = 95.1234 if 50 <= i < 150 else 90.0 + i * 0.0101
+            values['presenze_pos'] = 630 - i % 7
+            values['assenze'] = None if i == 10 else -1.5 * i
+            rows.append((d, values))
+
+        series = timeseries.build_series('P', 1, 'C', 17, rows)
+        self.assertEqual(sorted(set(s.metric for s in series)), ['assenze', 'presenze', 'presenze_pos'])
+        self.assertEqual(len([s for s in series if s.metric == 'presenze']), 2)
+        PoliticianHistorySeries.objects.bulk_create(series)
+
+        for metric in ('presenze', 'presenze_pos', 'assenze'):
+            expected = [(d, values[metric]) for d, values in rows if values[metric] is not None]
+            dates, values = timeseries.read_series(1, metric)
+            self.assertEqual(dates, [d for d, _ in expected])
+            for value, (_, expected_value) in zip(values, expected):
+                self.assertAlmostEqual(value, expected_value, places=4)
+
+        # a range across the chunks
+        dates, values = timeseries.read_series(1, 'presenze', start=rows[250][0], end=rows[260][0])
+        self.assertEqual(dates, [d for d, _ in rows[250:261]])
+        self.assertAlmostEqual(values[0], rows[250][1]['presenze'], places=4)
+        self.assertRaises(ValueError, timeseries.read_series, 1, 'unknown')
+
+    @staticmethod
+    def create_history(chi_id, house, legislatura, snapshots):
+        """
+        PoliticianHistoryCache rows, of (date, presenze) snapshots;
+        inserted with SQL, the charge and chi_id fields share their column
+        """
+        from django.db import connection
+
+        cursor = connection.cursor()
+        for d, presenze in snapshots:
+            cursor.execute(
+                "INSERT INTO opp_politician_history_cache (chi_tipo, chi_id, ramo, legislatura, data, presenze) "
+                "VALUES (%s, %s, %s, %s, %s, %s)", ['P', chi_id, house, legislatura, d, presenze]
+            )
+
+    def test_migrate_by_legislature(self):
+        from opp import timeseries
+        from opp.models import PoliticianHistorySeries
+
+        leg16 = [(date(2012, 1, 1) + timedelta(days=7 * i), 80.0 + i) for i in range(3)]
+        leg17 = [(date(2013, 4, 1) + timedelta(days=7 * i), 90.0 + i) for i in range(2)]
+        self.create_history(1, 'C', 16, leg16)
+        self.create_history(1, 'C', 17, leg17)
+        self.create_history(2, 'C', 17, leg17)
+
+        self.assertEqual(timeseries.migrate(), (3, 3))
+        for legislatura, snapshots in ((16, leg16), (17, leg17)):
+            dates, values = timeseries.read_series(1, 'presenze', legislatura=legislatura)
+            self.assertEqual((dates, list(values)), ([d for d, _ in snapshots], [v for _, v in snapshots]))
+        self.assertEqual(len(timeseries.read_series(1, 'presenze')[0]), 5)
+
+        # rebuilding a legislature leaves the series of the others alone
+        self.create_history(1, 'C', 17, [(date(2013, 4, 15), 95.0)])
+        self.assertEqual(timeseries.migrate(legislatura=17, chi_ids=[1]), (1, 1))
+        self.assertEqual(len(timeseries.read_series(1, 'presenze', legislatura=17)[0]), 3)
+        self.assertEqual(len(timeseries.read_series(1, 'presenze', legislatura=16)[0]), 3)
+        self.assertEqual(PoliticianHistorySeries.objects.filter(chi_id=2).count(), 1)
+
+
+class ActsTest(TestCase):
+
+    # title -> (act type, act code, phase, final)
+    TITLES = (
+        (u'Ddl 1234-A - voto finale', ('ddl', u'1234-A', u'voto finale', True)),
+        (u'Ddl 1234-B - Articolo 1', ('ddl', u'1234-B', u'Articolo 1', False)),
+        (u'Pdl 567 - emendamento 2.1', ('ddl', u'567', u'emendamento 2.1', False)),
+        (u'Moz. 1-00123 - parte motiva', ('mozione', u'1-00123', u'parte motiva', False)),
+        (u'Mozione n. 1-00123 - Votazione finale', ('mozione', u'1-00123', u'Votazione finale', True)),
+        (u'Ris. 6-00045', ('risoluzione', u'6-00045', u'', False)),
+        (u'Odg 9/1234-A/12', ('odg', u'9/1234-A/12', u'', False)),
+        (u'Ddl 1234-A - odg 9/1234-A/12', ('ddl', u'1234-A', u'odg 9/1234-A/12', False)),
+        (u'Doc. XXII, n. 12 - voto finale', ('doc', u'XXII-12', u'voto finale', True)),
+        (u'Doc. XXII', ('doc', u'XXII', u'', False)),
+        (u'Votazione finale', (None, None, u'', True)),
+        (u"Inversione dell'ordine del giorno", (None, None, u'', False)),
+    )
+
+    def test_classify(self):
+        from opp.acts import classify
+
+        for title, expected in self.TITLES:
+            self.assertEqual(classify(title), expected, title)
+
+    def test_act_number(self):
+        from opp.acts import act_number
+
+        self.assertEqual(act_number('ddl', '1234-A'), act_number('ddl', '1234-B'))
+        self.assertEqual(act_number('mozione', '1-00123'), '1-00123')
+
+
+class DumpsTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sittings = []
+        for num in range(1, 6):
+            votations = []
+            for n in range(1, num + 1):
+                details = VotationDetail(u'Ddl 1234 - voto finale', n, u'Nominale', {u'Presenti': u'2'}, u'Approvato')
+                details.set_vote(u'ROSSI MARIO', u'Favorevole')
+                details.set_vote(u'BIANCHI ANNA', u'Contrario')
+                votations.append(VotationRef(['{0}_{1}'.format(num, n)], u'http://camera.it/{0}'.format(n),
+                                             details=details))
+            self.sittings.append(Sitting(str(num), '2014-01-{0:02d}'.format(num), u'', votations=votations))
+
+    def write(self, filename, content):
+        path = os.path.join(self.tmp, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def dumps(self):
+        """
+        the same sittings in a JSON array, and in JSON Lines
+        """
+        items = [s.as_dict() for s in self.sittings]
+        return (
+            self.write('dump.json', json.dumps(items, indent=2)),
+            self.write('dump.jsonl', ''.join(json.dumps(d) + '\n' for d in items)),
+        )
+
+    def test_resume(self):
+        from parser.dumps import dump_format, iter_json_array, iter_jsonl
+
+        expected = [s.as_dict() for s in self.sittings]
+        for path in self.dumps():
+            with open(path, 'rb') as f:
+                if dump_format(f) == 'json':
+                    # a tiny buffer, so that items span several reads
+                    iterate = lambda offset: iter_json_array(f, offset, chunk_size=16)
+                else:
+                    iterate = lambda offset: iter_jsonl(f, offset)
+                items = list(iterate(0))
+                self.assertEqual([d for d, _ in items], expected, path)
+                # resuming from the offset yielded with each item reads the following ones
+                for i, (_, offset) in enumerate(items):
+                    self.assertEqual([d for d, _ in iterate(offset)], expected[i + 1:], path)
+
+    def test_iter_dump(self):
+        from parser.dumps import iter_dump
+
+        for path in self.dumps():
+            sittings = [s for s, _ in iter_dump(path)]
+            self.assertEqual([s.as_dict() for s in sittings], [s.as_dict() for s in self.sittings])
+            # all the votations share the tables
+            details = [v.details for s in sittings for v in s.votations]
+            self.assertEqual(len(set(id(d.deputies) for d in details)), 1)
+            self.assertEqual(len(set(id(d.vote_codes) for d in details)), 1)
+
+    def test_batches(self):
+        from parser.dumps import batches
+
+        sittings = [(s, i * 100) for i, s in enumerate(self.sittings, 1)]
+        # sittings with 1 to 5 votations, in batches of at least 4 votations
+        self.assertEqual(
+            [([s.num for s in batch], offset) for batch, offset in batches(sittings, 4)],
+            [(['1', '2', '3'], 300), (['4'], 400), (['5'], 500)]
+        )
+        self.assertEqual(list(batches([], 4)), [])
+
+    def test_resume_file(self):
+        from parser.dumps import ResumeFile
+
+        resume = ResumeFile(os.path.join(self.tmp, 'dump.json'))
+        self.assertEqual(resume.load(), 0)
+        resume.save(1234)
+        self.assertEqual(ResumeFile(os.path.join(self.tmp, 'dump.json')).load(), 1234)
+        resume.clear()
+        self.assertEqual(resume.load(), 0)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+class ProfilesTest(OppFixturesMixin, TestCase):
+
+    def test_recent_votes_of_the_house(self):
+        self.create_deputies()
+        votation = self.create_votation(self.create_sitting(), 1, [VH.FAVOREVOLE] * self.N_DEPUTIES)
+        # a later votation of the Senate, in the same legislature
+        self.create_votation(self.create_sitting(d=date(2014, 1, 16), house='S'), 1, [])
+
+        votes = profiles.recent_votes([self.charges[0].id], 'C', 17, n=1)
+        self.assertEqual([v['votazione'] for v in votes[self.charges[0].id]], [votation.id])
+
+        profiles.rebuild([self.charges[0].id])
+        document = json.loads(profiles.profile_json(self.charges[0].id))
+        self.assertEqual([v['votazione'] for v in document['ultimi_voti']], [votation.id])
+
+
+class WorkerTest(TestCase):
+
+    def test_pages_are_published_once_per_burst(self):
+        from opp import jobs, pagecache
+
+        # pages touched by other tests
+        pagecache.touched.take()
+        published = []
+        publish = pagecache.publish
+        pagecache.publish = lambda logger: published.append(len(pagecache.touched.take()))
+        self.addCleanup(setattr, pagecache, 'publish', publish)
+
+        @jobs.task('touch_votation')
+        def touch_votation(args, logger):
+            pagecache.touched.add(votations=[(args['date'], 1, args['id'])])
+        self.addCleanup(jobs.registry.pop, 'touch_votation')
+
+        for i in range(3):
+            jobs.enqueue('touch_votation', {'date': '2014-01-15', 'id': i})
+        jobs.Worker(poll_seconds=0).run(burst=True)
+        self.assertEqual(published, [3])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+
+    def test_debounced_jobs_are_postponed(self):
+        from django.utils import timezone
+        from opp import jobs
+
+        args = {'house': 'C', 'legislature': 16}
+        job, enqueued = jobs.enqueue('compute_ideal_points', args, delay=300, debounce=True)
+        self.assertTrue(enqueued)
+        earlier = timezone.now() - timedelta(seconds=60)
+        Job.objects.filter(id=job.id).update(run_after=earlier)
+
+        # without debounce, the pending job is left alone
+        jobs.enqueue('compute_ideal_points', args, delay=300)
+        self.assertEqual(Job.objects.get(id=job.id).run_after, earlier)
+
+        job, enqueued = jobs.enqueue('compute_ideal_points', args, delay=300, debounce=True)
+        self.assertFalse(enqueued)
+        self.assertTrue(Job.objects.get(id=job.id).run_after > timezone.now() + timedelta(seconds=200))
+        self.assertEqual(Job.objects.count(), 1)
+
+
+class BenchmarkQueriesTest(TestCase):
+
+    def test_seeded_db_is_explained(self):
+        from django.core.management import call_command
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        results_file = os.path.join(tmp, 'plans.jsonl')
+        call_command('seed_benchmark_db', charges=12, groups=3, sittings=2, votations=3)
+        self.assertEqual(Votazione.objects.filter(sitting__house='C', sitting__legislatura=17).count(), 6)
+
+        call_command('benchmark_queries', repeat=1, results=results_file)
+        with open(results_file) as f:
+            result = json.loads(f.readline())
+        self.assertEqual(result['vendor'], 'sqlite')
+        self.assertTrue(result['queries'])
+        self.assertTrue(all(q['plan'] for q in result['queries'].values()))
+
+
+class SearchTest(OppFixturesMixin, TestCase):
+
+    def setUp(self):
+        self.create_deputies()
+        sitting = self.create_sitting()
+        self.votations = [
+            self.create_votation(sitting, n, [], title=title) for n, title in enumerate((
+                u'Decreto sblocca Italia - voto finale',
+                u'Decreti legge: sblocca cantieri',
+                u'Mozione sul decreto',
+            ), 1)
+        ]
+        # a votation with all the terms, in another legislature
+        self.votations.append(self.create_votation(self.create_sitting(number=2, legislature=16), 1, [],
+                                                   title=u'Decreto sblocca Italia'))
+        search.index_votations(self.votations)
+
+    def test_ranking(self):
+        ranking = search.search_votations(u'decreto sblocca italia', legislatura=17)
+        # votations matching more terms first
+        self.assertEqual([vote_id for vote_id, _ in ranking], [v.id for v in self.votations[:3]])
+        # the idf counts the votations of the legislature: decret is in all three of them
+        self.assertAlmostEqual(ranking[2][1], 3.0 * math.log(2.0), places=4)
+
+    def test_all_legislatures(self):
+        ranking = search.search_votations(u'sblocca italia')
+        self.assertEqual(set(vote_id for vote_id, _ in ranking[:2]),
+                         set([self.votations[0].id, self.votations[3].id]))
+        self.assertEqual(search.search_votations(u'della'), [])
+
+
+class BreakdownTest(OppFixturesMixin, TestCase):
+
+    def test_majority_and_rebels(self):
+        self.create_deputies()
+        sitting = self.create_sitting()
+        # G0: charges 0, 2, 4; G1: charges 1, 3, 5
+        split = self.create_votation(sitting, 1, [VH.FAVOREVOLE, VH.CONTRARIO, VH.FAVOREVOLE,
+                                                  VH.FAVOREVOLE, VH.CONTRARIO, VH.IN_MISSIONE])
+        unanimous = self.create_votation(sitting, 2, [VH.FAVOREVOLE] * 5 + [VH.ASSENTE])
+        self.assertEqual(breakdown.compute_breakdowns([split.id, unanimous.id]), 4)
+
+        rows = dict((r['group_id'], r) for r in breakdown.votation_breakdown(split.id))
+        g0, g1 = self.groups[0].id, self.groups[1].id
+        self.assertEqual((rows[g0]['favorevoli'], rows[g0]['contrari'],
+                          rows[g0]['majority_voting'], rows[g0]['rebels']),
+                         (2, 1, VH.FAVOREVOLE, 1))
+        # a tie has no majority, and no rebels
+        self.assertEqual((rows[g1]['favorevoli'], rows[g1]['contrari'], rows[g1]['missioni'],
+                          rows[g1]['majority_voting'], rows[g1]['rebels']),
+                         (1, 1, 1, '', 0))
+
+        self.assertEqual(list(VH.objects.filter(rebel=1).values_list('vote_id', 'charge_id')),
+                         [(split.id, self.charges[4].id)])
+        self.assertEqual(dict(Votazione.objects.values_list('id', 'ribelli')), {split.id: 1, unanimous.id: 0})
+
+
+class VoteCountsTest(OppFixturesMixin, TestCase):
+
+    DATES = (date(2014, 1, 2), date(2014, 1, 15), date(2014, 2, 10), date(2014, 3, 20), date(2014, 3, 21))
+    VOTES = (VH.FAVOREVOLE, VH.CONTRARIO, VH.ASTENUTO, VH.ASSENTE, VH.IN_MISSIONE)
+
+    def setUp(self):
+        import random
+
+        rnd = random.Random(1)
+        self.create_deputies()
+        votations = []
+        for number, d in enumerate(self.DATES, 1):
+            sitting = self.create_sitting(number=number, d=d)
+            for n in range(1, 4):
+                votation = self.create_votation(sitting, n, [rnd.choice(self.VOTES) for _ in self.charges])
+                VH.objects.filter(vote=votation, charge__in=rnd.sample(self.charges, 2)).update(rebel=1)
+                votations.append(votation)
+        breakdown.compute_breakdowns([v.id for v in votations])
+        # the index is built in two steps, as by two imports
+        votecounts.update_for_votations(votations[:7])
+        votecounts.update_for_votations(votations[7:])
+
+    @staticmethod
+    def raw_counts(votes, start, end):
+        """
+        the counts of the single votes between the dates
+        """
+        votes = votes.filter(vote__sitting__date__lte=end)
+        if start is not None:
+            votes = votes.filter(vote__sitting__date__gte=start)
+        return {
+            'votazioni': votes.count(),
+            'presenze': votes.filter(voting__in=VH.VOTED).count(),
+            'assenze': votes.filter(voting=VH.ASSENTE).count(),
+            'missioni': votes.filter(voting=VH.IN_MISSIONE).count(),
+            'ribelli': votes.filter(rebel=1).count(),
+        }
+
+    def test_windows(self):
+        # open, at the boundaries, within a date, and empty ranges
+        ranges = [(None, date(2014, 12, 31)), (date(2014, 1, 2), date(2014, 1, 15)),
+                  (date(2014, 1, 3), date(2014, 3, 20)), (date(2014, 2, 10), date(2014, 2, 10)),
+                  (date(2014, 1, 16), date(2014, 2, 9))]
+        for start, end in ranges:
+            for charge in self.charges:
+                counts = votecounts.window(CumulativeVoteCount.CHARGE, charge.id, start, end)
+                expected = self.raw_counts(VH.objects.filter(charge=charge), start, end)
+                self.assertEqual(dict((k, counts[k]) for k in expected), expected, (start, end, charge.id))
+                if expected['votazioni']:
+                    self.assertEqual(counts['presenze_rate'],
+                                     round(float(expected['presenze']) / expected['votazioni'], 4))
+                else:
+                    self.assertIsNone(counts['presenze_rate'])
+
+            # groups count the votes of their members
+            for i, group in enumerate(self.groups):
+                counts = votecounts.window(CumulativeVoteCount.GROUP, group.id, start, end)
+                expected = self.raw_counts(VH.objects.filter(charge__in=self.charges[i::2]), start, end)
+                del expected['ribelli']
+                self.assertEqual(dict((k, counts[k]) for k in expected), expected, (start, end, group.id))
+
+    def test_rolling(self):
+        charge = self.charges[0]
+        today = date(2014, 3, 21)
+        windows = votecounts.rolling(CumulativeVoteCount.CHARGE, charge.id, days=(1, 30, 90), today=today)
+        for n, counts in windows.items():
+            expected = self.raw_counts(VH.objects.filter(charge=charge), today - timedelta(days=n - 1), today)
+            self.assertEqual(dict((k, counts[k]) for k in expected), expected, n)
+        self.assertEqual(windows[1]['votazioni'], 3)
+        self.assertEqual(windows[90]['votazioni'], 15)
+
+
+class ReconcileTest(OppFixturesMixin, TestCase):
+
+    ALL = [VH.FAVOREVOLE] * OppFixturesMixin.N_DEPUTIES
+
+    def setUp(self):
+        self.create_deputies()
+        self.sittings = [self.create_sitting(number=n, d=date(2014, 1, n)) for n in range(1, 7)]
+        s1, s2, s3, s4, s5, s6 = self.sittings
+        for n in (1, 2, 3):
+            self.create_votation(s1, n, self.ALL)
+        # votation 2 missing, 3 with a vote missing
+        self.create_votation(s2, 1, self.ALL)
+        self.create_votation(s2, 3, self.ALL[1:])
+        # flagged as not imported
+        Votazione.objects.filter(id=self.create_votation(s3, 1, self.ALL).id).update(is_imported=0)
+        # no votations, not imported yet (s4), known to have none (s5)
+        Seduta.objects.filter(id=s4.id).update(is_imported=0)
+        # complete, but not flagged yet
+        self.create_votation(s6, 1, self.ALL)
+        Seduta.objects.filter(id=s6.id).update(is_imported=0)
+
+    def test_refetch(self):
+        from opp import reconcile
+
+        status = reconcile.reconcile('C', 17, min_votes=self.N_DEPUTIES)
+        self.assertEqual([(s.num, numbers) for s, numbers in status.refetch], [(2, [2, 3]), (3, [1]), (4, [])])
+        self.assertEqual(status.updated, 3)
+        self.assertEqual(dict(Seduta.objects.values_list('number', 'is_imported')),
+                         {1: 1, 2: 0, 3: 0, 4: 0, 5: 1, 6: 1})
+        summary = status.summary()
+        self.assertEqual((summary['complete'], summary['votazioni_mancanti'], summary['votazioni_incomplete']),
+                         (2, 1, 2))
+
+    def test_refetch_jobs(self):
+        from django.core import management
+
+        management.call_command('reconcile_imports', min_votes=self.N_DEPUTIES, enqueue=True)
+        jobs = [json.loads(args) for args in Job.objects.filter(task='import_sitting').values_list('args', flat=True)]
+        self.assertEqual(sorted((j['num'], j['refetch']) for j in jobs), [(2, [2, 3]), (3, [1]), (4, [])])
+
+
+class IdealPointsTest(OppFixturesMixin, TestCase):
+
+    @staticmethod
+    def two_blocs(n_charges=60, n_votations=40, missing=0.2, seed=1):
+        """
+        a charges x votations matrix of two blocs, voting against each other,
+        with some rebels, abstentions and missing votes
+        """
+        import numpy as np
+
+        rnd = np.random.RandomState(seed)
+        blocs = np.where(np.arange(n_charges) < n_charges // 2, 1.0, -1.0)
+        lines = rnd.choice([1.0, -1.0], n_votations)
+        matrix = np.outer(blocs, lines)
+        noise = rnd.rand(n_charges, n_votations)
+        matrix[noise < 0.05] *= -1.0
+        matrix[(noise >= 0.05) & (noise < 0.08)] = 0.0
+        matrix[rnd.rand(n_charges, n_votations) < missing] = np.nan
+        return np.arange(1, n_charges + 1), blocs, matrix
+
+    def test_filter_matrix(self):
+        import numpy as np
+        from opp import idealpoints
+
+        charge_ids, _, matrix = self.two_blocs(missing=0.0)
+        matrix[:, 0] = 1.0
+        matrix[idealpoints.MIN_VOTERS - 1:, 1] = np.nan
+        matrix[0, idealpoints.MIN_VOTES - 1:] = np.nan
+        filtered_ids, filtered = idealpoints.filter_matrix(charge_ids, matrix)
+        # the unanimous votation, the one with few voters, then the charge with few votes are left out
+        self.assertEqual(filtered.shape, (matrix.shape[0] - 1, matrix.shape[1] - 2))
+        self.assertEqual(filtered_ids.tolist(), charge_ids[1:].tolist())
+
+    def test_blocs_separate_on_x(self):
+        import numpy as np
+        from opp import idealpoints
+
+        charge_ids, blocs, matrix = self.two_blocs()
+        coords, variance = idealpoints.reduce(matrix)
+        coords = idealpoints.orient(coords, charge_ids)
+        self.assertTrue(variance[0] > 0.5 > variance[1])
+        x = coords[:, 0]
+        self.assertTrue(x[blocs > 0].max() < x[blocs < 0].min() or x[blocs < 0].max() < x[blocs > 0].min())
+        self.assertAlmostEqual(np.abs(coords).max(), 1.0)
+
+        # the previous map fixes the signs of the axes
+        previous = dict((charge_id, (-x, -y)) for charge_id, (x, y) in zip(charge_ids.tolist(), coords.tolist()))
+        flipped = idealpoints.orient(idealpoints.reduce(matrix)[0], charge_ids, previous)
+        self.assertTrue(np.allclose(flipped, -coords))
+
+    def test_imputation_converges(self):
+        import numpy as np
+        from opp import idealpoints
+
+        charge_ids, _, matrix = self.two_blocs()
+        # the same votes, none missing
+        complete = self.two_blocs(missing=0.0)[2]
+
+        def x(m, iterations=idealpoints.IMPUTE_ITERATIONS):
+            return idealpoints.orient(idealpoints.reduce(m, iterations=iterations)[0], charge_ids)[:, 0]
+
+        # the changes of the coordinates shrink at each iteration
+        steps = [np.abs(x(matrix, n) - x(matrix, n + 1)).max() for n in (1, 5, 10)]
+        self.assertTrue(steps[0] > steps[1] > steps[2])
+        self.assertTrue(steps[2] < 0.01)
+        # and the coordinates get closer to those of the complete votes
+        correlations = [np.corrcoef(x(matrix, n), x(complete))[0, 1] for n in (1, idealpoints.IMPUTE_ITERATIONS)]
+        self.assertTrue(correlations[0] < correlations[1])
+        self.assertTrue(correlations[1] > 0.998)
+
+    def test_backfilled_votations_recompute_the_map(self):
+        from opp import idealpoints
+
+        self.create_deputies()
+        self.addCleanup(setattr, idealpoints, 'MIN_VOTERS', idealpoints.MIN_VOTERS)
+        self.addCleanup(setattr, idealpoints, 'MIN_VOTES', idealpoints.MIN_VOTES)
+        idealpoints.MIN_VOTERS, idealpoints.MIN_VOTES = self.N_DEPUTIES, 2
+
+        lines = ([VH.FAVOREVOLE, VH.CONTRARIO] * 3, [VH.CONTRARIO, VH.FAVOREVOLE] * 3)
+        first, last = self.create_sitting(1, date(2014, 1, 15)), self.create_sitting(2, date(2014, 1, 16))
+        for n, votes in enumerate(lines, 1):
+            self.create_votation(first, n, votes)
+            self.create_votation(last, n, votes)
+        args = ('C', 17, idealpoints.LEGISLATURE_WINDOW, date(2014, 1, 1), date(2014, 1, 31))
+        self.assertEqual(idealpoints.compute_map(*args).n_votations, 4)
+        self.assertIsNone(idealpoints.compute_map(*args))
+
+        # a votation backfilled in the earlier sitting
+        self.create_votation(first, 3, lines[0])
+        self.assertEqual(idealpoints.compute_map(*args).n_votations, 5)
+
+
+class QueryCountMiddlewareTest(OppFixturesMixin, TestCase):
+
+    def test_queries_of_the_request(self):
+        from django.core.signals import request_started
+        from django.db import reset_queries
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        from opp.instrumentation import QueryCountMiddleware
+
+        middleware = QueryCountMiddleware()
+        request = RequestFactory().get('/api/cariche/1/')
+        middleware.process_request(request)
+        # the signal is shared by all the threads, it must stay connected
+        self.assertIn(reset_queries, [receiver() for _, receiver in request_started.receivers])
+        self.create_sitting()
+        self.create_sitting(number=2)
+        response = middleware.process_response(request, HttpResponse())
+        self.assertEqual(response['X-Query-Count'], '2')
+        self.assertEqual(response['X-Query-Duplicates'], '1')
+
+
+TWO_DATABASES = {
+    'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+    'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+}
+
+
+# not a TestCase: its transaction would route all the reads to the primary
+@override_settings(DATABASES=TWO_DATABASES, DATABASE_REPLICA_ALIAS='replica', REPLICA_LAG_SECONDS=30)
+class RouterTest(SimpleTestCase):
+
+    def setUp(self):
+        from opp import routers
+
+        cache.clear()
+        lag = routers._lag
+        routers._lag = routers.ReplicaLag()
+        self.addCleanup(setattr, routers, '_lag', lag)
+
+    @staticmethod
+    def read_db():
+        return Votazione.objects.all().db
+
+    def test_reads_go_to_the_replica(self):
+        from django.db import transaction
+
+        self.assertEqual(self.read_db(), 'replica')
+        with transaction.atomic():
+            self.assertEqual(self.read_db(), 'default')
+        with override_settings(DATABASE_REPLICA_ALIAS=None):
+            self.assertEqual(self.read_db(), 'default')
+
+    def test_cache_entries_are_read_from_the_primary(self):
+        from opp.routers import CACHE_APP_LABEL, PrimaryReplicaRouter
+
+        class CacheEntry(object):
+            class _meta(object):
+                app_label = CACHE_APP_LABEL
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(CacheEntry), 'default')
+
+    def test_pinned_threads(self):
+        from opp.routers import carry_pin, pin_to_primary
+
+        results = {}
+
+        def read(name):
+            results[name] = self.read_db()
+
+        def run_in_thread(func, name):
+            thread = threading.Thread(target=func, args=(name, ))
+            thread.start()
+            thread.join()
+
+        with pin_to_primary():
+            read('pinned')
+            run_in_thread(read, 'thread')
+            run_in_thread(carry_pin(read), 'carried')
+        read('unpinned')
+        self.assertEqual(results, {'pinned': 'default', 'thread': 'replica', 'carried': 'default',
+                                   'unpinned': 'replica'})
+
+    def test_lagging_replica(self):
+        from opp import routers
+
+        routers.mark_primary_written()
+        self.assertEqual(self.read_db(), 'default')
+        # other processes learn of the write through the cache
+        routers._lag = routers.ReplicaLag()
+        self.assertEqual(self.read_db(), 'default')
+        with override_settings(REPLICA_LAG_SECONDS=0):
+            self.assertEqual(self.read_db(), 'replica')
+
+    def test_middleware(self):
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        from opp.routers import PrimaryPinningMiddleware
+
+        middleware = PrimaryPinningMiddleware()
+        for request, db in ((RequestFactory().get('/api/cariche/1/'), 'replica'),
+                            (RequestFactory().post('/api/cariche/1/'), 'default'),
+                            (RequestFactory().get('/api/cariche/1/', HTTP_X_OPP_PRIMARY='1'), 'default')):
+            middleware.process_request(request)
+            self.assertEqual(self.read_db(), db)
+            middleware.process_response(request, HttpResponse())
+            self.assertEqual(self.read_db(), 'replica')
+
+
+class ConnectionsTest(SimpleTestCase):
+
+    def test_pool_is_bounded(self):
+        from django.db import connections
+        from opp.connections import ConnectionPool
+
+        pool = ConnectionPool(size=2)
+        self.addCleanup(pool.close_all)
+        first, second = pool.get(), pool.get()
+        self.assertIsNot(first, second)
+
+        # a third thread waits for a connection to be given back
+        borrowed = []
+        thread = threading.Thread(target=lambda: borrowed.append(pool.get()))
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(borrowed, [])
+        pool.put(first)
+        thread.join()
+        self.assertEqual((borrowed, pool.created), ([first], 2))
+
+        pool.put(first)
+        with pool.connection() as conn:
+            self.assertIs(conn, first)
+            self.assertIs(connections['default'], first)
+        self.assertIsNot(connections['default'], first)
+        self.assertIs(pool.get(), first)
+
+    def test_connections_left_in_a_transaction_are_discarded(self):
+        from opp.connections import ConnectionPool
+
+        pool = ConnectionPool(size=1)
+        conn = pool.get()
+        conn.in_atomic_block = True
+        pool.put(conn)
+        self.assertEqual(pool.created, 0)
+        self.assertIsNot(pool.get(), conn)
+
+    @override_settings(DB_HEALTH_CHECK_INTERVAL=60)
+    def test_check_connection(self):
+        from opp.connections import check_connection
+
+        class Connection(object):
+            connection = 'open'
+            usable = True
+            checks = 0
+
+            def close_if_unusable_or_obsolete(self):
+                pass
+
+            def is_usable(self):
+                self.checks += 1
+                return self.usable
+
+            def close(self):
+                self.connection = None
+
+        conn = Connection()
+        check_connection(conn)
+        # checked at most once per interval
+        conn.usable = False
+        check_connection(conn)
+        self.assertEqual((conn.checks, conn.connection), (1, 'open'))
+
+        conn.opp_checked_at -= 60
+        check_connection(conn)
+        self.assertEqual((conn.checks, conn.connection), (2, None))
+        # closed connections are reopened by the next query, not checked
+        check_connection(conn)
+        self.assertEqual(conn.checks, 2)
+
+
+class ArchiveTest(ReplayCorpusMixin, TestCase):
+
+    def setUp(self):
+        from parser.archive import PageArchive
+
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.archive = PageArchive(os.path.join(self.tmp, 'archive'))
+
+    def test_round_trip(self):
+        import gzip
+        from parser.archive import PageArchive
+
+        self.archive.append(self.MONTH_URI, 'old', fetched_at='2014-01-15T10:00:00')
+        self.archive.append(self.LIST_URI, self.LIST_PAGE)
+        self.assertEqual(self.archive.get(self.MONTH_URI), 'old')
+        # the index is read incrementally, the last page of a uri wins
+        self.archive.append(self.MONTH_URI, self.MONTH_PAGE)
+        self.assertEqual(self.archive.get(self.MONTH_URI), self.MONTH_PAGE)
+        self.assertEqual(self.archive.get(self.DETAIL_URI), None)
+
+        # another process reading the same archive
+        archive = PageArchive(self.archive.path)
+        self.assertEqual(sorted(archive.uris()), sorted([self.MONTH_URI, self.LIST_URI]))
+        self.assertEqual(archive.uris(contains='risultatidb'), [self.LIST_URI])
+
+        # segments are plain gzip files, of a header line and a page per record
+        segment = [f for f in os.listdir(self.archive.path) if f.startswith('segment-')]
+        with gzip.open(os.path.join(self.archive.path, segment[0])) as f:
+            content = f.read()
+        self.assertEqual(content.count(self.MONTH_URI), 2)
+        self.assertTrue(content.endswith(self.MONTH_PAGE))
+
+    def test_reparse(self):
+        from opp.management.commands import reparse
+        from parser.readers import ArchivedVotationsReader
+
+        for uri, page in ((self.MONTH_URI, self.MONTH_PAGE), (self.LIST_URI, self.LIST_PAGE),
+                          (self.DETAIL_URI, self.DETAIL_PAGE)):
+            self.archive.append(uri, page)
+
+        reader = ArchivedVotationsReader(self.archive)
+        self.assertEqual(reader.archived_months(), ['2014-01'])
+        sittings = reader.get_sittings('2014-01')
+        self.assertEqual([s.num for s in sittings], ['152'])
+
+        # as in a worker process of the reparse command
+        reparse.init_worker(self.archive.path)
+        sitting = reparse.parse_sitting(sittings[0])
+        self.assertEqual([v.details.detail for v in sitting.votations],
+                         [{'ROSSI MARIO': 'Favorevole', 'BIANCHI ANNA': 'Contrario'}])
+
+
+class PageDigestsTest(ReplayCorpusMixin, OppFixturesMixin, TestCase):
+
+    def setUp(self):
+        from django.db import connections
+        from opp.connections import pool
+
+        # the in-memory test DB is only reachable through the default connection
+        pool.new_connection = lambda: connections['default']
+        self.addCleanup(delattr, pool, 'new_connection')
+
+    def import_month(self):
+        from parser.digests import PageDigests
+        from parser.readers import Camera17VotationsReader
+
+        digests = PageDigests()
+        reader = Camera17VotationsReader(digests=digests)
+        sittings = reader.read(['2014-01'])
+        writer = OppDBVotationsWriter()
+        writer.write_sittings(sittings)
+        writer.write_votations(sittings)
+        digests.commit()
+        return sittings
+
+    def test_unchanged_pages_are_skipped(self):
+        corpus = self.replay()
+        self.create_deputies()
+        sittings = self.import_month()
+        self.assertFalse(sittings[0].unchanged)
+        # marks the votation, to tell whether the writer wrote it again
+        Votazione.objects.update(titolo='imported')
+
+        sittings = self.import_month()
+        self.assertTrue(sittings[0].unchanged)
+        self.assertEqual(Votazione.objects.get().titolo, 'imported')
+
+        # a changed listing, with an unchanged votation
+        corpus.add(self.LIST_URI, self.LIST_PAGE.replace('</body>', '<p>aggiornato</p></body>'))
+        sittings = self.import_month()
+        self.assertFalse(sittings[0].unchanged)
+        self.assertEqual([v.unchanged for v in sittings[0].votations], [True])
+        self.assertEqual(Votazione.objects.get().titolo, 'imported')
+
+    def test_lookups(self):
+        from parser.digests import PageDigests
+
+        digests = PageDigests()
+        digests.stage('http://camera.it/a', 'digest-a', {'num': 1})
+        digests.commit()
+
+        digests = PageDigests()
+        digests.prefetch(['http://camera.it/a', 'http://camera.it/b'])
+        self.assertEqual(digests.committed, {'http://camera.it/a': 'digest-a', 'http://camera.it/b': None})
+        with self.assertNumQueries(1):
+            self.assertEqual(digests.lookup('http://camera.it/a', 'digest-a'), {'num': 1})
+        with self.assertNumQueries(0):
+            self.assertEqual(digests.lookup('http://camera.it/a', 'changed'), None)
+            self.assertEqual(digests.lookup('http://camera.it/b', 'digest-b'), None)
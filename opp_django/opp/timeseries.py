@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Compact time series of the PoliticianHistoryCache metrics.
+
+PoliticianHistoryCache stores a wide row per politician per snapshot;
+here each metric of each politician is a series of (date, value) points,
+stored in chunks of at most CHUNK_POINTS points (PoliticianHistorySeries).
+
+A chunk starts with a keyframe (the absolute date and value of its
+first point), followed by the deltas of the next points, run-length
+encoded: runs of points with the same date and value deltas, as
+regular snapshots of a stable metric, take a few bytes each::
+
+    keyframe: varint(days since 1970-01-01), zigzag(value)
+    then:     varint(run length), zigzag(days delta), zigzag(value delta)
+
+Values are stored as integers, scaled by the metric SCALES
+(floats keep 4 decimals); null values are not stored.
+
+a simple usage::
+
+    from opp import timeseries
+    dates, values = timeseries.read_series(chi_id, 'presenze', start=date(2014, 1, 1))
+"""
+from array import array
+from datetime import date, timedelta
+from itertools import groupby
+from django.db import transaction
+from opp.models import PoliticianHistoryCache, PoliticianHistorySeries
+
+__author__ = 'guglielmo'
+
+
+EPOCH = date(1970, 1, 1)
+
+# metrics, with the scale of their values
+SCALES = {
+    'assenze': 10000, 'assenze_pos': 1, 'assenze_delta': 10000,
+    'presenze': 10000, 'presenze_pos': 1, 'presenze_delta': 10000,
+    'missioni': 10000, 'missioni_pos': 1, 'missioni_delta': 10000,
+    'indice': 10000, 'indice_pos': 1, 'indice_delta': 10000,
+    'ribellioni': 10000, 'ribellioni_pos': 1, 'ribellioni_delta': 10000,
+}
+METRICS = sorted(SCALES)
+
+CHUNK_POINTS = 256
+
+
+def write_varint(buf, n):
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def read_varint(data, i):
+    n = shift = 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+
+def zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def unzigzag(n):
+    return n >> 1 if not n & 1 else -(n >> 1) - 1
+
+
+def encode(points, scale=1):
+    """
+    encode a chunk of (date, value) points, sorted by date
+    """
+    buf = bytearray()
+    days = [(d - EPOCH).days for d, _ in points]
+    values = [int(round(v * scale)) for _, v in points]
+
+    write_varint(buf, days[0])
+    write_varint(buf, zigzag(values[0]))
+
+    run, last = 0, None
+    for i in range(1, len(points)):
+        delta = (days[i] - days[i - 1], values[i] - values[i - 1])
+        if delta == last:
+            run += 1
+            continue
+        if run:
+            write_varint(buf, run)
+            write_varint(buf, zigzag(last[0]))
+            write_varint(buf, zigzag(last[1]))
+        run, last = 1, delta
+    if run:
+        write_varint(buf, run)
+        write_varint(buf, zigzag(last[0]))
+        write_varint(buf, zigzag(last[1]))
+    return bytes(buf)
+
+
+def decode(data, scale=1):
+    """
+    decode a chunk into lists of days (since EPOCH) and values
+    """
+    data = bytearray(data)
+    day, i = read_varint(data, 0)
+    value, i = read_varint(data, i)
+    value = unzigzag(value)
+    days, values = [day], [value]
+    while i < len(data):
+        run, i = read_varint(data, i)
+        ddays, i = read_varint(data, i)
+        dvalue, i = read_varint(data, i)
+        ddays, dvalue = unzigzag(ddays), unzigzag(dvalue)
+        for _ in range(run):
+            day += ddays
+            value += dvalue
+            days.append(day)
+            values.append(value)
+    if scale != 1:
+        values = [float(v) / scale for v in values]
+    return days, values
+
+
+def chunks(points, size=CHUNK_POINTS):
+    for i in range(0, len(points), size):
+        yield points[i:i + size]
+
+
+def build_series(chi_tipo, chi_id, house, legislatura, rows):
+    """
+    return the PoliticianHistorySeries chunks of a politician,
+    from its (date, {metric: value}) rows, sorted by date
+    """
+    series = []
+    for metric in METRICS:
+        points = [(d, values[metric]) for d, values in rows if values[metric] is not None]
+        for chunk in chunks(points):
+            series.append(PoliticianHistorySeries(
+                chi_tipo=chi_tipo, chi_id=chi_id, metric=metric, house=house, legislatura=legislatura,
+                start_date=chunk[0][0], end_date=chunk[-1][0], points=len(chunk),
+                data=encode(chunk, SCALES[metric])
+            ))
+    return series
+
+
+def migrate(legislatura=None, chi_ids=None, batch_size=200):
+    """
+    (re)build the series from the PoliticianHistoryCache rows,
+    for a legislature or some politicians, or all of them;
+    rows are streamed ordered by politician, house and legislature,
+    with a series for each, and written in batches
+
+    returns the number of series (politician, house, legislature) and of chunks written
+    """
+    rows = PoliticianHistoryCache.objects.order_by('chi_tipo', 'chi_id', 'house', 'legislatura', 'update_date')
+    if legislatura is not None:
+        rows = rows.filter(legislatura=legislatura)
+    if chi_ids is not None:
+        rows = rows.filter(chi_id__in=chi_ids)
+    rows = rows.values_list('chi_tipo', 'chi_id', 'house', 'legislatura', 'update_date', *METRICS).iterator()
+
+    n_series = n_chunks = 0
+    batch = {}
+    for (chi_tipo, chi_id, house, leg), group in groupby(rows, key=lambda row: row[:4]):
+        batch[(chi_tipo, chi_id, house, leg)] = build_series(
+            chi_tipo, chi_id, house, leg, [(row[4], dict(zip(METRICS, row[5:]))) for row in group]
+        )
+        n_series += 1
+        if len(batch) >= batch_size:
+            n_chunks += write_batch(batch)
+            batch = {}
+    if batch:
+        n_chunks += write_batch(batch)
+    return n_series, n_chunks
+
+
+def write_batch(batch):
+    """
+    replace the series of the politicians in the batch, a dict mapping
+    (chi_tipo, chi_id, house, legislatura) keys to their chunks;
+    the series of the other houses and legislatures are left alone
+
+    returns the number of chunks written
+    """
+    chi_ids_by_series = {}
+    for chi_tipo, chi_id, house, legislatura in batch:
+        chi_ids_by_series.setdefault((chi_tipo, house, legislatura), []).append(chi_id)
+
+    series = [chunk for politician_chunks in batch.values() for chunk in politician_chunks]
+    with transaction.atomic():
+        for (chi_tipo, house, legislatura), chi_ids in chi_ids_by_series.items():
+            PoliticianHistorySeries.objects.filter(
+                chi_tipo=chi_tipo, house=house, legislatura=legislatura, chi_id__in=chi_ids
+            ).delete()
+        PoliticianHistorySeries.objects.bulk_create(series, batch_size=500)
+    return len(series)
+
+
+def read_series(chi_id, metric, start=None, end=None, chi_tipo='P', legislatura=None):
+    """
+    return the dates and the values (as an array of doubles) of a metric
+    of a politician, within the optional [start, end] range,
+    in a legislature, or in all of them
+    """
+    if metric not in SCALES:
+        raise ValueError("unknown metric {0}".format(metric))
+
+    series = PoliticianHistorySeries.objects.filter(chi_tipo=chi_tipo, chi_id=chi_id, metric=metric)
+    if legislatura is not None:
+        series = series.filter(legislatura=legislatura)
+    if start is not None:
+        series = series.filter(end_date__gte=start)
+    if end is not None:
+        series = series.filter(start_date__lte=end)
+
+    start_day = (start - EPOCH).days if start is not None else None
+    end_day = (end - EPOCH).days if end is not None else None
+    dates, values = [], array('d')
+    for data in series.order_by('start_date').values_list('data', flat=True):
+        days, chunk_values = decode(data, SCALES[metric])
+        for day, value in zip(days, chunk_values):
+            if (start_day is None or day >= start_day) and (end_day is None or day <= end_day):
+                dates.append(EPOCH + timedelta(days=day))
+                values.append(value)
+    return dates, values
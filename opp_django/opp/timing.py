@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timers for the import pipeline.
+
+Readers and writers wrap their work in named stages (fetch, parse,
+resolve, write); durations are accumulated in a histogram per stage,
+in the module-level ``timers`` registry, that ImportCommand resets at the
+beginning of a run and summarizes at the end.
+
+a simple usage::
+
+    from opp import timing
+    with timing.stage('fetch'):
+        r = requests.get(uri)
+    print(timing.timers.summary())
+"""
+from contextlib import contextmanager
+import resource
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2 needs the pytracemalloc backport and a patched interpreter
+    tracemalloc = None
+
+__author__ = 'guglielmo'
+
+
+class Histogram(object):
+    """
+    Histogram of durations, in milliseconds, over fixed buckets
+    """
+
+    BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, ms):
+        i = 0
+        while i < len(self.BUCKETS) and ms > self.BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, p):
+        """
+        Return the upper bound of the bucket containing the p-th percentile
+        (the max, for the overflow bucket)
+        """
+        if not self.count:
+            return None
+        threshold = p / 100.0 * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= threshold:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 1),
+            'mean_ms': round(self.total / self.count, 1) if self.count else None,
+            'min_ms': round(self.min, 1) if self.min is not None else None,
+            'max_ms': round(self.max, 1) if self.max is not None else None,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'buckets': dict(
+                ('le_{0}'.format(b), n) for b, n in zip(self.BUCKETS + ('inf', ), self.counts)
+            ),
+        }
+
+
+class StageTimers(object):
+    """
+    Registry of the per-stage histograms, shared by all threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.started_at = time.time()
+
+    def observe(self, name, ms):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(ms)
+
+    def summary(self):
+        return {
+            'elapsed_s': round(time.time() - self.started_at, 3),
+            'stages': dict((name, h.as_dict()) for name, h in self.histograms.items()),
+        }
+
+
+timers = StageTimers()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the enclosed block and record it under the named stage
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        timers.observe(name, (time.time() - start) * 1000.0)
+
+
+class MemoryTracker(object):
+    """
+    Track the peak memory of a run.
+
+    Uses tracemalloc when available (python allocations only),
+    otherwise the max resident set size of the process.
+    """
+
+    def start(self):
+        if tracemalloc is not None:
+            tracemalloc.start()
+
+    def stop(self):
+        if tracemalloc is not None:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return {'source': 'tracemalloc', 'peak_kb': peak // 1024}
+        return {'source': 'maxrss', 'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
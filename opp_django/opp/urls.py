@@ -0,0 +1,21 @@
+from django.conf.urls import patterns, url
+
+__author__ = 'guglielmo'
+
+urlpatterns = patterns('opp.views',
+    url(r'^api/votazioni/search/$', 'votations_search', name='votations-search'),
+    url(r'^api/votazioni/(?P<votation_id>\d+)/gruppi/$', 'votation_group_breakdown',
+        name='votation-group-breakdown'),
+    url(r'^api/politici/(?P<chi_id>\d+)/storico/(?P<metric>\w+)/$', 'politician_history',
+        name='politician-history'),
+    url(r'^api/cariche/(?P<charge_id>\d+)/$', 'charge_profile', name='charge-profile'),
+    url(r'^api/cariche/(?P<charge_id>\d+)/presenze/$', 'charge_vote_counts', name='charge-vote-counts'),
+    url(r'^api/gruppi/(?P<group_id>\d+)/presenze/$', 'group_vote_counts', name='group-vote-counts'),
+    url(r'^api/atti/(?P<house>[CS])/(?P<legislature>\d+)/(?P<act_type>\w+)/(?P<number>[\w-]+)/votazioni/$',
+        'act_votations', name='act-votations'),
+    url(r'^api/sedute/(?P<house>[CS])/(?P<legislature>\d+)/stato-import/$', 'import_status',
+        name='import-status'),
+    url(r'^api/mappa/(?P<house>[CS])/(?P<legislature>\d+)/(?P<window>L|\d{4})/$', 'ideal_points_map',
+        name='ideal-points-map'),
+    url(r'^internal/metrics/$', 'metrics_export', name='metrics'),
+)
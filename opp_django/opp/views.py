@@ -1,3 +1,224 @@
-from django.shortcuts import render
+from datetime import datetime
+import json
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from opp import acts, breakdown, metrics, profiles, reconcile, search, timeseries, votecounts
+from opp.models import CumulativeVoteCount, Votazione
+from opp.pagecache import cached_response
 
-# Create your views here.
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data), content_type='application/json', status=status)
+
+
+def date_range(request):
+    """
+    the optional da and a GET parameters, as dates; raises ValueError
+    """
+    return [
+        datetime.strptime(request.GET[p], '%Y-%m-%d').date() if request.GET.get(p) else None
+        for p in ('da', 'a')
+    ]
+
+
+def votations_search(request):
+    """
+    Full-text search over votations titles and descriptions.
+
+    GET parameters:
+
+      - q           - the query string
+      - legislatura - restrict search to a legislature (optional)
+      - limit       - max number of results, defaults to 20
+    """
+    query = request.GET.get('q', '')
+    legislatura = request.GET.get('legislatura')
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 100)
+        if legislatura is not None:
+            legislatura = int(legislatura)
+    except ValueError:
+        return json_response({'error': 'legislatura and limit must be integers'}, status=400)
+
+    ranking = search.search_votations(query, legislatura=legislatura, limit=limit)
+    votations = Votazione.objects.select_related('sitting').in_bulk([vote_id for vote_id, _ in ranking])
+
+    results = []
+    for vote_id, score in ranking:
+        v = votations.get(vote_id)
+        if v is None:
+            continue
+        results.append({
+            'id': v.id,
+            'score': score,
+            'numero_votazione': v.numero_votazione,
+            'titolo': v.titolo,
+            'titolo_aggiuntivo': v.titolo_aggiuntivo,
+            'esito': v.esito,
+            'seduta': {
+                'id': v.sitting.id,
+                'numero': v.sitting.number,
+                'data': v.sitting.date.isoformat() if v.sitting.date else None,
+                'legislatura': v.sitting.legislatura,
+            },
+        })
+
+    return json_response({'query': query, 'count': len(results), 'results': results})
+
+
+@cached_response
+def votation_group_breakdown(request, votation_id):
+    """
+    How each group voted in the votation, as materialized at import time.
+    """
+    return json_response({
+        'votazione': int(votation_id),
+        'gruppi': breakdown.votation_breakdown(votation_id),
+    })
+
+
+@cached_response
+def politician_history(request, chi_id, metric):
+    """
+    Trend of a metric of a politician, from the compact time series.
+
+    GET parameters:
+
+      - da - first date, as YYYY-MM-DD (optional)
+      - a  - last date, as YYYY-MM-DD (optional)
+      - legislatura - the legislature (optional, all of them by default)
+    """
+    try:
+        start, end = date_range(request)
+    except ValueError:
+        return json_response({'error': 'da and a must be dates, as YYYY-MM-DD'}, status=400)
+    legislatura = request.GET.get('legislatura')
+    if legislatura is not None and not legislatura.isdigit():
+        return json_response({'error': 'legislatura must be a number'}, status=400)
+
+    if metric not in timeseries.SCALES:
+        return json_response({'error': 'unknown metric {0}'.format(metric)}, status=404)
+
+    dates, values = timeseries.read_series(int(chi_id), metric, start=start, end=end,
+                                           legislatura=int(legislatura) if legislatura else None)
+    return json_response({
+        'chi_id': int(chi_id),
+        'metric': metric,
+        'dates': [d.isoformat() for d in dates],
+        'values': values.tolist(),
+    })
+
+
+def vote_counts(request, owner_type, owner_id):
+    """
+    Votations, presences, absences, missions and rebellions of a charge or a group,
+    with their rates, from the cumulative vote counts.
+
+    GET parameters:
+
+      - da - first date, as YYYY-MM-DD (optional)
+      - a  - last date, as YYYY-MM-DD (optional)
+
+    Counts over the last 30, 90 and 365 days are also returned.
+    """
+    try:
+        start, end = date_range(request)
+    except ValueError:
+        return json_response({'error': 'da and a must be dates, as YYYY-MM-DD'}, status=400)
+
+    owner_id = int(owner_id)
+    return json_response({
+        'chi_tipo': owner_type,
+        'chi_id': owner_id,
+        'da': start.isoformat() if start else None,
+        'a': end.isoformat() if end else None,
+        'totali': votecounts.window(owner_type, owner_id, start, end),
+        'ultimi_giorni': votecounts.rolling(owner_type, owner_id),
+    })
+
+
+# not cached: the windows of the last days move with the date, not with the data version
+def charge_vote_counts(request, charge_id):
+    return vote_counts(request, CumulativeVoteCount.CHARGE, charge_id)
+
+
+def group_vote_counts(request, group_id):
+    return vote_counts(request, CumulativeVoteCount.GROUP, group_id)
+
+
+@cached_response
+def act_votations(request, house, legislature, act_type, number):
+    """
+    The votations of an act (e.g. ddl 1234, in all its readings), from the acts index.
+    """
+    votations = acts.act_votations(house, int(legislature), act_type, number)
+    return json_response({
+        'ramo': house,
+        'legislatura': int(legislature),
+        'tipo_atto': act_type,
+        'numero_atto': number,
+        'votazioni': [
+            {
+                'id': v.id,
+                'data': v.sitting.date.isoformat(),
+                'numero': v.numero_votazione,
+                'codice_atto': v.act.act_code,
+                'titolo': v.titolo,
+                'titolo_aggiuntivo': v.titolo_aggiuntivo,
+                'esito': v.esito,
+                'finale': bool(v.finale),
+            }
+            for v in votations
+        ],
+    })
+
+
+def import_status(request, house, legislature):
+    """
+    Import completeness of the sittings of a legislature, with the sittings
+    and votations to re-fetch; read only, see the reconcile_imports command.
+    """
+    status = reconcile.reconcile(house, int(legislature), dry_run=True)
+    return json_response({
+        'riepilogo': status.summary(),
+        'da_reimportare': [
+            dict(sitting.as_dict(), votazioni_da_reimportare=numbers)
+            for sitting, numbers in status.refetch
+        ],
+    })
+
+
+@cached_response
+def charge_profile(request, charge_id):
+    """
+    Profile of a charge, as precomputed at import time (see opp.profiles).
+    """
+    document = profiles.profile_json(int(charge_id))
+    if document is None:
+        return json_response({'error': 'no profile for the charge {0}'.format(charge_id)}, status=404)
+    return HttpResponse(document, content_type='application/json')
+
+
+@cached_response
+def ideal_points_map(request, house, legislature, window):
+    """
+    The map of the charges of a house, from their votes in a window:
+    the whole legislature (L), or a year.
+    """
+    # imported lazily, to keep numpy out of the startup
+    from opp import idealpoints
+    data = idealpoints.map_points(house, int(legislature), window)
+    if data is None:
+        return json_response({'error': 'no map for {0}{1} {2}'.format(house, legislature, window)}, status=404)
+    return json_response(data)
+
+
+def metrics_export(request):
+    """
+    Metrics of this web process, in the Prometheus text format.
+
+    Only served to the addresses in settings.METRICS_ALLOWED_IPS.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Prefix-sum index of the votes of charges and groups.
+
+For each charge (and group), the ``opp_cumulative_vote_count`` table
+holds a row per votation, in date order, with the cumulative counts of
+votations, presences, absences, missions and rebellions up to it.
+
+The counts within any date range are then the difference of two rows,
+read with two indexed lookups, whatever the length of the range::
+
+    from opp import votecounts
+    votecounts.window(CumulativeVoteCount.CHARGE, charge_id, start, end)
+    votecounts.rolling(CumulativeVoteCount.GROUP, group_id, days=(30, 90, 365))
+
+The index is updated by the DB writer at import time, recomputing only
+the rows from the first date of the imported votations on: usually,
+just appending the new ones.
+"""
+from datetime import date, timedelta
+from django.db import transaction
+from django.db.models import Max
+from opp.models import CumulativeVoteCount, VotazioneGruppoBreakdown, VotazioneHasCarica
+
+__author__ = 'guglielmo'
+
+
+CVC = CumulativeVoteCount
+VH = VotazioneHasCarica
+
+COUNTERS = ('votazioni', 'presenze', 'assenze', 'missioni', 'ribelli')
+
+PRESENT = VH.VOTED + (VH.PRESIDENTE, )
+
+
+def sequence_key(sitting_number, votation_number):
+    """
+    order of a votation within a date
+    """
+    return sitting_number * 10000 + votation_number
+
+
+def charge_events(charge_ids=None, since=None):
+    """
+    yield the (charge id, votation id, date, seq, increments) of the votes of the charges,
+    ordered by charge and votation
+    """
+    votes = VH.objects.all()
+    if charge_ids is not None:
+        votes = votes.filter(charge_id__in=charge_ids)
+    if since is not None:
+        votes = votes.filter(vote__sitting__date__gte=since)
+    rows = votes.order_by(
+        'charge', 'vote__sitting__date', 'vote__sitting__number', 'vote__numero_votazione'
+    ).values_list(
+        'charge_id', 'vote_id', 'vote__sitting__date', 'vote__sitting__number', 'vote__numero_votazione',
+        'voting', 'rebel'
+    ).iterator()
+
+    for charge_id, vote_id, d, sitting_number, number, voting, rebel in rows:
+        yield charge_id, vote_id, d, sequence_key(sitting_number, number), (
+            1, int(voting in PRESENT), int(voting == VH.ASSENTE), int(voting == VH.IN_MISSIONE), int(bool(rebel))
+        )
+
+
+def group_events(group_ids=None, since=None):
+    """
+    yield the (group id, votation id, date, seq, increments) of the groups breakdowns,
+    ordered by group and votation; groups count the votes of their members
+    """
+    breakdowns = VotazioneGruppoBreakdown.objects.all()
+    if group_ids is not None:
+        breakdowns = breakdowns.filter(group_id__in=group_ids)
+    if since is not None:
+        breakdowns = breakdowns.filter(vote__sitting__date__gte=since)
+    rows = breakdowns.order_by(
+        'group', 'vote__sitting__date', 'vote__sitting__number', 'vote__numero_votazione'
+    ).values_list(
+        'group_id', 'vote_id', 'vote__sitting__date', 'vote__sitting__number', 'vote__numero_votazione',
+        'favorevoli', 'contrari', 'astenuti', 'assenti', 'missioni', 'altri', 'rebels'
+    ).iterator()
+
+    for group_id, vote_id, d, sitting_number, number, fav, contr, ast, assenti, missioni, altri, rebels in rows:
+        yield group_id, vote_id, d, sequence_key(sitting_number, number), (
+            fav + contr + ast + assenti + missioni + altri, fav + contr + ast, assenti, missioni, rebels
+        )
+
+
+EVENTS = {
+    CVC.CHARGE: charge_events,
+    CVC.GROUP: group_events,
+}
+
+
+def baselines(owner_type, owner_ids, before):
+    """
+    return a dict mapping the owners to their cumulative counts before the date
+    (or their latest counts, when None)
+    """
+    rows = CVC.objects.filter(owner_type=owner_type)
+    if before is not None:
+        rows = rows.filter(date__lt=before)
+    if owner_ids is not None:
+        rows = rows.filter(owner_id__in=owner_ids)
+    last_dates = dict(rows.values_list('owner_id').annotate(last=Max('date')))
+    if not last_dates:
+        return {}
+
+    last = {}
+    candidates = rows.filter(
+        owner_id__in=list(last_dates), date__in=set(last_dates.values())
+    ).values_list('owner_id', 'date', 'seq', *COUNTERS)
+    for row in candidates:
+        owner_id, d, seq, counts = row[0], row[1], row[2], row[3:]
+        if d == last_dates[owner_id] and (owner_id not in last or seq > last[owner_id][0]):
+            last[owner_id] = (seq, counts)
+    return dict((owner_id, counts) for owner_id, (_, counts) in last.items())
+
+
+def rebuild(owner_type, owner_ids=None, since=None, batch_size=5000):
+    """
+    recompute the index rows of the owners (all, when None), from the date on (or all)
+
+    returns the number of rows written
+    """
+    start = baselines(owner_type, owner_ids, since) if since is not None else {}
+    n_rows = 0
+    with transaction.atomic():
+        stale = CVC.objects.filter(owner_type=owner_type)
+        if owner_ids is not None:
+            stale = stale.filter(owner_id__in=owner_ids)
+        if since is not None:
+            stale = stale.filter(date__gte=since)
+        stale.delete()
+
+        batch = []
+        current, counts = None, None
+        for owner_id, vote_id, d, seq, increments in EVENTS[owner_type](owner_ids, since):
+            if owner_id != current:
+                current, counts = owner_id, list(start.get(owner_id, (0, ) * len(COUNTERS)))
+            counts = [c + i for c, i in zip(counts, increments)]
+            batch.append(CVC(
+                owner_type=owner_type, owner_id=owner_id, vote_id=vote_id, date=d, seq=seq,
+                **dict(zip(COUNTERS, counts))
+            ))
+            if len(batch) >= batch_size:
+                CVC.objects.bulk_create(batch)
+                n_rows += len(batch)
+                batch = []
+        CVC.objects.bulk_create(batch)
+        n_rows += len(batch)
+    return n_rows
+
+
+def voters(votation_ids):
+    """
+    return the ids of the charges, and of the groups, that voted in the votations
+    """
+    charge_ids = list(VH.objects.filter(vote_id__in=votation_ids).values_list('charge_id', flat=True).distinct())
+    group_ids = list(VotazioneGruppoBreakdown.objects.filter(
+        vote_id__in=votation_ids
+    ).values_list('group_id', flat=True).distinct())
+    return charge_ids, group_ids
+
+
+def update_for_votations(votations, charge_ids=None, group_ids=None):
+    """
+    update the index after the votations were written, with their votes and breakdowns
+
+    :votations: a list of Votazione, with their sitting
+    :charge_ids, group_ids: their voters, when already known
+
+    returns the number of rows written
+    """
+    if not votations:
+        return 0
+    since = min(v.sitting.date for v in votations)
+    if charge_ids is None or group_ids is None:
+        charge_ids, group_ids = voters([v.id for v in votations])
+    return rebuild(CVC.CHARGE, charge_ids, since) + rebuild(CVC.GROUP, group_ids, since)
+
+
+def counts_at(owner_type, owner_id, d, inclusive=True):
+    """
+    return the cumulative counts of the owner up to the date (included, or excluded)
+    """
+    rows = CVC.objects.filter(owner_type=owner_type, owner_id=owner_id)
+    rows = rows.filter(date__lte=d) if inclusive else rows.filter(date__lt=d)
+    last = list(rows.order_by('-date', '-seq').values_list(*COUNTERS)[:1])
+    return last[0] if last else (0, ) * len(COUNTERS)
+
+
+def window(owner_type, owner_id, start=None, end=None):
+    """
+    return the counts and rates of the owner's votes between the dates (both included, optional)
+    """
+    end_counts = counts_at(owner_type, owner_id, end or date.today())
+    start_counts = counts_at(owner_type, owner_id, start, inclusive=False) if start else (0, ) * len(COUNTERS)
+    counts = dict(zip(COUNTERS, (e - s for e, s in zip(end_counts, start_counts))))
+
+    n = counts['votazioni']
+    result = dict(counts)
+    for counter in COUNTERS[1:]:
+        result[counter + '_rate'] = round(float(counts[counter]) / n, 4) if n else None
+    return result
+
+
+def rolling(owner_type, owner_id, days=(30, 90, 365), today=None):
+    """
+    return a dict mapping each number of days to the window of the last days
+    """
+    today = today or date.today()
+    return dict(
+        (n, window(owner_type, owner_id, today - timedelta(days=n - 1), today))
+        for n in days
+    )
@@ -47,9 +47,43 @@ MANAGERS = ADMINS
 DATABASES = {
     'default': env.db('DB_DEFAULT_URL'),
 }
+
+# An optional read replica: web reads and analytics are routed to it,
+# imports write to the primary (see opp.routers)
+if env('DB_REPLICA_URL', default=''):
+    DATABASES['replica'] = env.db('DB_REPLICA_URL')
+    # tests read the replica through the test primary
+    DATABASES['replica']['TEST_MIRROR'] = 'default'
+
+# Persistent connections, reused across requests for this many seconds (see opp.connections)
+for db in DATABASES.values():
+    db.setdefault('CONN_MAX_AGE', env.int('DB_CONN_MAX_AGE', default=300))
+
+# Persistent connections are checked at most once in this many seconds
+DB_HEALTH_CHECK_INTERVAL = env.int('DB_HEALTH_CHECK_INTERVAL', default=30)
+
+# Max connections of the pool shared by the threads of the workers
+DB_POOL_SIZE = env.int('DB_POOL_SIZE', default=4)
+DATABASE_REPLICA_ALIAS = 'replica'
+DATABASE_ROUTERS = ['opp.routers.PrimaryReplicaRouter']
+
+# Reads are routed to the primary for this many seconds after an import
+REPLICA_LAG_SECONDS = env.int('REPLICA_LAG_SECONDS', default=30)
 ########## END DATABASE CONFIGURATION
 
 
+########## CACHE CONFIGURATION
+# See: https://docs.djangoproject.com/en/dev/ref/settings/#caches
+# The cache is shared by the web processes, the workers and the import commands
+# (the time of the last import in opp.routers, the pages version in opp.pagecache),
+# so it can't be a per-process one: memcache://, redis:// or dbcache://, the default,
+# whose table is created with ``manage.py createcachetable opp_cache``
+CACHES = {
+    'default': env.cache('CACHE_URL', default='dbcache://opp_cache'),
+}
+########## END CACHE CONFIGURATION
+
+
 ########## GENERAL CONFIGURATION
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#time-zone
 TIME_ZONE = 'Europe/Rome'
@@ -105,9 +139,58 @@ SECRET_KEY = env('SECRET_KEY')  # Raises ImproperlyConfigured exception if SECRE
 # Hosts/domain names that are valid for this site
 # See https://docs.djangoproject.com/en/1.5/ref/settings/#allowed-hosts
 ALLOWED_HOSTS = []
+
+# Addresses allowed to read the /internal/metrics/ endpoint (Prometheus scrapers)
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=['127.0.0.1'])
 ########## END SITE CONFIGURATION
 
 
+########## PAGE ARCHIVE CONFIGURATION
+# Raw pages fetched by the readers are archived here (see parser.archive),
+# to be re-parsed with the reparse command; set to an empty value to disable
+PAGE_ARCHIVE_ROOT = env('PAGE_ARCHIVE_ROOT', default=root('archive'))
+
+# lock files coalescing identical requests among concurrent import processes
+FETCH_LOCKS_ROOT = env('FETCH_LOCKS_ROOT', default='/tmp/opp_fetch_locks')
+
+# houses and legislatures crawled by the crawl command (see parser.registry);
+# C16 is registered too, but its pages are not covered by a parse test yet
+CRAWL_TARGETS = env.list('CRAWL_TARGETS', default=['C17'])
+
+# max requests per second, and burst, for each host (see parser.ratelimit)
+SCRAPER_RATE_LIMITS = {
+    'www.camera.it': (2, 4),
+    'documenti.camera.it': (4, 8),
+    'www.senato.it': (2, 4),
+}
+SCRAPER_DEFAULT_RATE_LIMIT = (2, 4)
+########## END PAGE ARCHIVE CONFIGURATION
+
+
+########## RESPONSE CACHE CONFIGURATION
+# API responses are cached under a data version, bumped after each import (see opp.pagecache)
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=6 * 3600)
+
+# threads rendering the pages touched by an import into the cache, before the version is bumped
+CACHE_WARMING_THREADS = env.int('CACHE_WARMING_THREADS', default=4)
+########## END RESPONSE CACHE CONFIGURATION
+
+
+########## BENCHMARK CONFIGURATION
+# Recorded pages of the houses websites, replayed by the benchmark_reader command
+SCRAPER_CORPUS_ROOT = root('benchmarks/corpus')
+
+# Results of the benchmark_reader runs, one JSON record per line
+BENCHMARK_RESULTS_FILE = root('benchmarks/results.jsonl')
+
+# Results of the benchmark_startup runs, one JSON record per line
+STARTUP_BENCHMARK_RESULTS_FILE = root('benchmarks/startup.jsonl')
+
+# Results of the benchmark_queries runs (query plans and timings), one JSON record per line
+QUERY_PLANS_RESULTS_FILE = root('benchmarks/query_plans.jsonl')
+########## END BENCHMARK CONFIGURATION
+
+
 ########## FIXTURE CONFIGURATION
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#std:setting-FIXTURE_DIRS
 FIXTURE_DIRS = (
@@ -152,7 +235,12 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'opp.routers.PrimaryPinningMiddleware',
 )
+
+# Requests issuing more queries than this are logged as warnings
+# by opp.instrumentation.QueryCountMiddleware
+QUERY_COUNT_WARNING_THRESHOLD = env.int('QUERY_COUNT_WARNING_THRESHOLD', default=50)
 ########## END MIDDLEWARE CONFIGURATION
 
 
@@ -257,6 +345,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'queries': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 ########## END LOGGING CONFIGURATION
@@ -36,16 +36,6 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 ########## END DATABASE CONFIGURATION
 
 
-########## CACHE CONFIGURATION
-# See: https://docs.djangoproject.com/en/dev/ref/settings/#caches
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
-}
-########## END CACHE CONFIGURATION
-
-
 ########## TOOLBAR CONFIGURATION
 # See: https://github.com/django-debug-toolbar/django-debug-toolbar#installation
 INSTALLED_APPS += (
@@ -58,6 +48,7 @@ INTERNAL_IPS = ('127.0.0.1',)
 # See: https://github.com/django-debug-toolbar/django-debug-toolbar#installation
 MIDDLEWARE_CLASSES += (
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'opp.instrumentation.QueryCountMiddleware',
 )
 
 # See: https://github.com/django-debug-toolbar/django-debug-toolbar#installation
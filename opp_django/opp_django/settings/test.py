@@ -1,10 +1,11 @@
 from base import *
 
 ########## TEST SETTINGS
-TEST_RUNNER = 'discover_runner.DiscoverRunner'
-TEST_DISCOVER_TOP_LEVEL = SITE_ROOT
-TEST_DISCOVER_ROOT = SITE_ROOT
-TEST_DISCOVER_PATTERN = "test_*.py"
+# the Django 1.6 discover runner, creating the tables of the unmanaged models
+TEST_RUNNER = 'opp.runner.ManagedModelTestRunner'
+
+# South migrations are not run, tables are created by syncdb
+SOUTH_TESTS_MIGRATE = False
 ########## IN-MEMORY TEST DATABASE
 DATABASES = {
     "default": {
@@ -16,3 +17,11 @@ DATABASES = {
         "PORT": "",
     },
 }
+
+########## TEST CACHE
+# the tests run in a single process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -7,6 +7,7 @@ admin.autodiscover()
 
 urlpatterns = patterns('',
     url(r'^$', TemplateView.as_view(template_name='base.html')),
+    url(r'^', include('opp.urls')),
 
     # Examples:
     # url(r'^$', 'opp_django.views.home', name='home'),
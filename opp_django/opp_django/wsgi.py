@@ -35,3 +35,8 @@ application = get_wsgi_application()
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
+# health checks of the persistent DB connections
+import opp.connections
+
+from opp.metrics import MetricsWSGIMiddleware
+application = MetricsWSGIMiddleware(application)
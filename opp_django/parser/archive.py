@@ -0,0 +1,133 @@
+"""
+Archive of the raw pages fetched by the readers.
+
+Pages are appended to compressed segment files, WARC-like: each record
+is an independent gzip member holding a JSON header line and the page body,
+so a segment can be read sequentially with any gzip tool, or randomly
+through the index.
+
+The index (``index.tsv``) is append-only too, one line per record::
+
+    uri <TAB> fetched_at <TAB> segment <TAB> offset <TAB> length
+
+Appends are serialized among processes with a lock file,
+so that concurrent imports may share the same archive.
+
+a simple usage::
+
+    from parser.archive import PageArchive
+    archive = PageArchive(settings.PAGE_ARCHIVE_ROOT)
+    archive.append(uri, content)
+    archive.get(uri)
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import gzip
+import json
+import os
+from StringIO import StringIO
+
+__author__ = 'guglielmo'
+
+
+class PageArchive(object):
+
+    SEGMENT_MAX_BYTES = 128 * 1024 * 1024
+    SEGMENT_TEMPLATE = 'segment-{0:05d}.pages.gz'
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, 'index.tsv')
+        self.lock_path = os.path.join(path, '.lock')
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._index = None
+        self._index_size = 0
+
+    @contextmanager
+    def lock(self):
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def current_segment(self):
+        """
+        return the name of the segment to append to, rolling to a new one when full
+        """
+        segments = sorted(f for f in os.listdir(self.path) if f.startswith('segment-'))
+        if not segments:
+            return self.SEGMENT_TEMPLATE.format(1)
+        last = segments[-1]
+        if os.path.getsize(os.path.join(self.path, last)) < self.SEGMENT_MAX_BYTES:
+            return last
+        return self.SEGMENT_TEMPLATE.format(len(segments) + 1)
+
+    @staticmethod
+    def encode(uri, fetched_at, content):
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as g:
+            g.write(json.dumps({'uri': uri, 'fetched_at': fetched_at, 'length': len(content)}))
+            g.write("\n")
+            g.write(content)
+        return buf.getvalue()
+
+    def append(self, uri, content, fetched_at=None):
+        """
+        append a page to the archive
+        """
+        fetched_at = fetched_at or datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        record = self.encode(uri, fetched_at, content)
+        with self.lock():
+            segment = self.current_segment()
+            with open(os.path.join(self.path, segment), 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(record)
+            with open(self.index_path, 'a') as f:
+                f.write("\t".join((uri, fetched_at, segment, str(offset), str(len(record)))) + "\n")
+
+    def index(self):
+        """
+        return a dict mapping each uri to its last (fetched_at, segment, offset, length) entry,
+        reading only the lines appended since the last call
+        """
+        if self._index is None:
+            self._index = {}
+            self._index_size = 0
+        if not os.path.exists(self.index_path):
+            return self._index
+        with open(self.index_path) as f:
+            f.seek(self._index_size)
+            for line in f:
+                if not line.endswith("\n"):
+                    # an append in progress
+                    break
+                uri, fetched_at, segment, offset, length = line.rstrip("\n").split("\t")
+                self._index[uri] = (fetched_at, segment, int(offset), int(length))
+                self._index_size += len(line)
+        return self._index
+
+    def read_record(self, segment, offset, length):
+        with open(os.path.join(self.path, segment), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        with gzip.GzipFile(fileobj=StringIO(data)) as g:
+            header, content = g.read().split("\n", 1)
+        return json.loads(header), content
+
+    def get(self, uri):
+        """
+        return the last archived content for the uri, or None
+        """
+        entry = self.index().get(uri)
+        if entry is None:
+            return None
+        fetched_at, segment, offset, length = entry
+        return self.read_record(segment, offset, length)[1]
+
+    def uris(self, contains=None):
+        return [uri for uri in self.index() if contains is None or contains in uri]
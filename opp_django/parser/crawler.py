@@ -0,0 +1,90 @@
+"""
+Scheduling of concurrent crawls of several houses and legislatures.
+
+A crawl is split in (house, legislature, month) tasks, run by a pool
+of threads; each task reads the month with its own reader, taken
+from the registry (see parser.registry). Requests to each host are
+throttled by its own rate limit (see parser.ratelimit), so the crawl of
+a house does not slow down the others. The DB connections opened by a
+task (e.g. to look up the digests of the pages) are closed at its end,
+as the threads of the pool are not request-bound.
+
+Results are yielded as tasks complete, for the caller to write them
+in its own thread::
+
+    from parser.crawler import Crawler
+    crawler = Crawler([('C', 17), ('S', 17)], ['2014-03', '2014-04'], threads=8)
+    for task, sittings in crawler.crawl():
+        ...
+"""
+from multiprocessing.pool import ThreadPool
+from django.db import connections
+from opp.routers import carry_pin
+from parser.registry import get_reader_class
+
+__author__ = 'guglielmo'
+
+
+class CrawlTask(object):
+    __slots__ = ('house', 'legislature', 'month', 'reader', 'error')
+
+    def __init__(self, house, legislature, month):
+        self.house = house
+        self.legislature = legislature
+        self.month = month
+        self.reader = None
+        self.error = None
+
+    def __str__(self):
+        return "{0}{1} {2}".format(self.house, self.legislature, self.month)
+
+
+class Crawler(object):
+
+    def __init__(self, targets, months, threads=4, logger=None, reader_factory=None):
+        """
+        :targets:        a list of (house, legislature) tuples
+        :months:         a list of "YYYY-MM" strings
+        :reader_factory: a function building the reader of a task,
+                         defaults to the registered reader, with the logger
+        """
+        # fail early on targets with no reader
+        for house, legislature in targets:
+            get_reader_class(house, legislature)
+
+        self.tasks = [
+            CrawlTask(house, int(legislature), month)
+            for month in months
+            for house, legislature in targets
+        ]
+        self.threads = threads
+        self.logger = logger
+        self.reader_factory = reader_factory or self.default_reader
+
+    def default_reader(self, task):
+        return get_reader_class(task.house, task.legislature)(logger=self.logger, legislature=task.legislature)
+
+    def run_task(self, task):
+        task.reader = self.reader_factory(task)
+        try:
+            return task, task.reader.read([task.month])
+        except Exception as e:
+            task.error = e
+            return task, None
+        finally:
+            for conn in connections.all():
+                conn.close()
+
+    def crawl(self):
+        """
+        yield (task, sittings) tuples as tasks complete;
+        sittings is None for failed tasks, and task.error is set
+        """
+        pool = ThreadPool(min(self.threads, len(self.tasks)) or 1)
+        try:
+            # the tasks of a pinned crawl read from the primary too
+            for task, sittings in pool.imap_unordered(carry_pin(self.run_task), self.tasks):
+                yield task, sittings
+        finally:
+            pool.close()
+            pool.join()
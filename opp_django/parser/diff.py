@@ -0,0 +1,233 @@
+"""
+Differences between the records read and the DB, for the dry runs.
+
+The DB state of the sittings, votations and single votes touched by
+the records is loaded in bulk, a few queries per level, and compared
+with the records through set operations on their keys, and on digests
+of the written fields: nothing is queried row by row.
+
+a simple usage::
+
+    from parser.diff import OppDBVotationsDiff
+    differ = OppDBVotationsDiff(logger)
+    diff = differ.diff(sittings, house='C', legislature=17)
+    differ.report(diff)
+"""
+from datetime import date, datetime
+from hashlib import sha1
+import json
+import logging
+from django.db.models import Q
+from opp.models import Seduta, Votazione, VotazioneHasCarica
+from opp.timing import stage
+from parser.writers import OppDBVotationsWriter
+
+__author__ = 'guglielmo'
+
+
+def fields_digest(fields):
+    """
+    digest of a dict of fields, insensitive to the types of the values (1 and '1' are the same)
+    """
+    normalized = dict((k, unicode(v) if v is not None else u'') for k, v in fields.items())
+    return sha1(json.dumps(normalized, sort_keys=True)).hexdigest()
+
+
+def sitting_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Changes(object):
+    """
+    Keys of the new, changed and missing (in the DB, but not in the records) items of a level
+    """
+    __slots__ = ('new', 'changed', 'missing')
+
+    def __init__(self):
+        self.new = []
+        self.changed = []
+        self.missing = []
+
+    def __len__(self):
+        return len(self.new) + len(self.changed) + len(self.missing)
+
+    def as_dict(self):
+        return {'new': len(self.new), 'changed': len(self.changed), 'missing': len(self.missing)}
+
+
+class OppDBVotationsDiff(object):
+
+    # votations fields compared, as written by OppDBVotationsWriter
+    VOTATION_FIELDS = (
+        'titolo', 'tipologia', 'esito', 'url',
+        'presenti', 'votanti', 'astenuti', 'maggioranza', 'favorevoli', 'contrari',
+    )
+
+    BATCH_SIZE = 500
+
+    def __init__(self, logger=None, writer=None):
+        self.logger = logger or logging.getLogger('management')
+        # the writer maps the records to the DB values, exactly as they would be written
+        self.writer = writer or OppDBVotationsWriter(self.logger)
+
+    def diff(self, sittings, house='C', legislature=17):
+        """
+        Compare the sittings, with their votations and votes, with the DB.
+
+        Sittings marked as unchanged by the reader are not compared.
+
+        returns a dict of Changes, for sittings, votations and votes:
+        sittings are keyed by number, votations by (sitting, number),
+        votes by (sitting, votation number, name), or by charge id for the missing ones
+        """
+        result = {'sittings': Changes(), 'votations': Changes(), 'votes': Changes()}
+        read = set(int(s.num) for s in sittings)
+        sittings = [s for s in sittings if not s.unchanged]
+        if not sittings:
+            return result
+
+        with stage('diff'):
+            db_sittings = self.load_sittings(sittings, house, legislature)
+            self.diff_sittings(sittings, read, db_sittings, result['sittings'])
+
+            db_votations = self.load_votations(db_sittings)
+            scraped = self.diff_votations(sittings, db_votations, result['votations'])
+
+            db_votes = self.load_votes([db_votations[k][0] for k in scraped if k in db_votations])
+            self.diff_votes(scraped, db_votations, db_votes, result['votes'], house, legislature)
+
+        return result
+
+    def load_sittings(self, sittings, house, legislature):
+        """
+        return a dict mapping the numbers of the sittings of the records, and of the others
+        in the same months, to their (id, date, reference_url) tuples
+        """
+        dates = [sitting_date(s.date) for s in sittings]
+        first = min(dates).replace(day=1)
+        numbers = [int(s.num) for s in sittings]
+        return dict(
+            (number, (id, d, url))
+            for id, number, d, url in Seduta.objects.filter(
+                Q(number__in=numbers) | Q(date__gte=first, date__lte=max(dates)),
+                house=house, legislatura=legislature
+            ).values_list('id', 'number', 'date', 'reference_url')
+        )
+
+    def diff_sittings(self, sittings, read, db_sittings, changes):
+        """
+        :read: the numbers of all the sittings read, unchanged ones included
+        """
+        scraped = dict(
+            (int(s.num), fields_digest({'date': sitting_date(s.date), 'url': s.reference_url}))
+            for s in sittings
+        )
+        stored = dict(
+            (number, fields_digest({'date': d, 'url': url}))
+            for number, (_, d, url) in db_sittings.items()
+        )
+        changes.new.extend(sorted(set(scraped) - set(stored)))
+        changes.missing.extend(sorted(set(stored) - read))
+        changes.changed.extend(sorted(n for n in set(scraped) & set(stored) if scraped[n] != stored[n]))
+
+    def load_votations(self, db_sittings):
+        """
+        return a dict mapping the (sitting number, votation number) keys
+        of the votations of the sittings to their (id, digest) tuples
+        """
+        numbers = dict((id, number) for number, (id, _, _) in db_sittings.items())
+        ids = list(numbers)
+        votations = {}
+        for i in range(0, len(ids), self.BATCH_SIZE):
+            rows = Votazione.objects.filter(sitting_id__in=ids[i:i + self.BATCH_SIZE]).values_list(
+                'id', 'sitting_id', 'numero_votazione', *self.VOTATION_FIELDS
+            )
+            for row in rows:
+                id, sitting_id, number, values = row[0], row[1], row[2], row[3:]
+                digest = fields_digest(dict(zip(self.VOTATION_FIELDS, values)))
+                votations[(numbers[sitting_id], number)] = (id, digest)
+        return votations
+
+    def diff_votations(self, sittings, db_votations, changes):
+        """
+        returns a dict mapping the keys of the votations read to their details
+        """
+        scraped = {}
+        digests = {}
+        for s in sittings:
+            for v in s.votations:
+                if v.details is None:
+                    continue
+                key = (int(s.num), int(v.details.number))
+                scraped[key] = v.details
+                fields = self.writer.votation_fields(v)
+                digests[key] = fields_digest(dict((f, fields.get(f)) for f in self.VOTATION_FIELDS))
+
+        # only votations of the sittings read can be missing
+        read_sittings = set(int(s.num) for s in sittings)
+        stored = set(k for k in db_votations if k[0] in read_sittings)
+
+        changes.new.extend(sorted(set(scraped) - stored))
+        changes.missing.extend(sorted(stored - set(scraped)))
+        changes.changed.extend(sorted(k for k in set(scraped) & stored if digests[k] != db_votations[k][1]))
+        return scraped
+
+    def load_votes(self, ids):
+        """
+        return a dict mapping the ids of the votations to sets of (charge id, voto) tuples
+        """
+        votes = dict((id, set()) for id in ids)
+        for i in range(0, len(ids), self.BATCH_SIZE):
+            rows = VotazioneHasCarica.objects.filter(vote_id__in=ids[i:i + self.BATCH_SIZE]).values_list(
+                'vote_id', 'charge_id', 'voting'
+            )
+            for vote_id, charge_id, voting in rows:
+                votes[vote_id].add((charge_id, voting))
+        return votes
+
+    def diff_votes(self, scraped, db_votations, db_votes, changes, house, legislature):
+        for key, details in sorted(scraped.items()):
+            names = {}
+            votes = set()
+            for i, voting in details.iter_votes():
+                name = details.deputies[i]
+                charge_id = self.writer.resolve_name(name, house=house, legislature=legislature)
+                if charge_id is None:
+                    # not written either
+                    continue
+                names[charge_id] = name
+                votes.add((charge_id, self.writer.vote_value(voting)))
+
+            stored = db_votes.get(db_votations[key][0], set()) if key in db_votations else set()
+            if votes == stored:
+                continue
+
+            # votes of charges on both sides, with different values, are changed
+            added, removed = votes - stored, stored - votes
+            removed_charges = set(charge_id for charge_id, _ in removed)
+            added_charges = set(charge_id for charge_id, _ in added)
+            for charge_id, _ in sorted(added):
+                target = changes.changed if charge_id in removed_charges else changes.new
+                target.append(key + (names[charge_id], ))
+            for charge_id, _ in sorted(removed):
+                if charge_id not in added_charges:
+                    changes.missing.append(key + (charge_id, ))
+
+    def report(self, result, max_items=10):
+        """
+        log the counts of the changes, and their first max_items keys
+        """
+        for level in ('sittings', 'votations', 'votes'):
+            changes = result[level]
+            self.logger.info("{0}: {1} new, {2} changed, {3} missing".format(
+                level, len(changes.new), len(changes.changed), len(changes.missing)
+            ))
+            for kind in Changes.__slots__:
+                keys = getattr(changes, kind)
+                if keys:
+                    self.logger.info("  {0} {1}: {2}{3}".format(
+                        kind, level, ", ".join(str(k) for k in keys[:max_items]),
+                        " ..." if len(keys) > max_items else ""
+                    ))
@@ -0,0 +1,94 @@
+"""
+Content digests of the pages read from the houses websites.
+
+For each url, the digest of the page body and the data extracted from it
+at the last successful import are stored in the ``opp_page_digest`` table.
+Readers skip parsing, and writers skip DB work, for pages whose
+digest did not change.
+
+Digests are computed after stripping volatile markup (scripts, comments,
+ASP.NET view states, hidden inputs, whitespace), that changes at every request.
+
+New digests are only staged while reading, and must be committed
+once the import has been successfully written::
+
+    digests = PageDigests()
+    reader = Camera17VotationsReader(digests=digests)
+    sittings = reader.read()
+    writer.write_votations(sittings)
+    digests.commit()
+"""
+import json
+from django.db import transaction
+from opp.connections import pool
+from opp.models import PageDigest
+from opp.routers import pin_to_primary
+from parser.records import as_json
+from parser.watermark import page_digest
+
+__author__ = 'guglielmo'
+
+
+class PageDigests(object):
+    """
+    The committed digests of the pages, read from the primary, through the
+    connections pool, as readers may run in threads (see parser.crawler).
+
+    Only the digests of the pages being read are queried, in batches when
+    the reader knows them in advance (see ``prefetch``); the data extracted
+    from a page are loaded only when its digest did not change.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self):
+        # uri -> committed digest, or None, of the pages looked up
+        self.committed = {}
+        self.staged = {}
+
+    @staticmethod
+    def digest(content):
+        return page_digest(content)
+
+    def prefetch(self, uris):
+        """
+        read the committed digests of the uris, not looked up yet, in batches
+        """
+        uris = [uri for uri in uris if uri not in self.committed]
+        for i in range(0, len(uris), self.BATCH_SIZE):
+            batch = uris[i:i + self.BATCH_SIZE]
+            self.committed.update((uri, None) for uri in batch)
+            with pin_to_primary(), pool.connection():
+                self.committed.update(PageDigest.objects.filter(uri__in=batch).values_list('uri', 'digest'))
+
+    def lookup(self, uri, digest):
+        """
+        return the data extracted from the page at the last successful import,
+        if its digest did not change, or None
+        """
+        if uri not in self.committed:
+            self.prefetch([uri])
+        if self.committed[uri] != digest:
+            return None
+        with pin_to_primary(), pool.connection():
+            extracted = PageDigest.objects.filter(uri=uri, digest=digest).values_list('extracted', flat=True)
+            extracted = extracted.first()
+        return json.loads(extracted) if extracted is not None else None
+
+    def stage(self, uri, digest, extracted):
+        self.staged[uri] = (digest, json.dumps(extracted, default=as_json))
+
+    def commit(self):
+        """
+        store the staged digests, after a successful import
+        """
+        uris = list(self.staged.keys())
+        with transaction.atomic():
+            for i in range(0, len(uris), 500):
+                PageDigest.objects.filter(uri__in=uris[i:i + 500]).delete()
+            PageDigest.objects.bulk_create([
+                PageDigest(uri=uri, digest=digest, extracted=extracted)
+                for uri, (digest, extracted) in self.staged.items()
+            ], batch_size=500)
+        self.committed.update((uri, digest) for uri, (digest, _) in self.staged.items())
+        self.staged = {}
+        return len(uris)
@@ -0,0 +1,149 @@
+"""
+Streaming reader of the JSON dumps of the sittings.
+
+Dumps are written by JSONVotationsWriter, either as a JSON array of
+sittings, or as JSON Lines (one sitting per line, for .jsonl files).
+Both are read incrementally, one sitting at a time, so that memory
+is bounded by the size of a sitting, not of the dump.
+
+Each sitting is yielded with the byte offset where the next one starts,
+so that a load can be resumed from there after a failure::
+
+    from parser.dumps import iter_dump
+    for sitting, offset in iter_dump('leg17.jsonl', offset=0):
+        ...
+"""
+import json
+import os
+from parser.records import Sitting, SymbolTable, VOTE_CODES
+
+__author__ = 'guglielmo'
+
+
+CHUNK_SIZE = 1 << 20
+
+WHITESPACE = ' \t\r\n'
+
+
+def dump_format(f):
+    """
+    'json' for dumps of a JSON array, 'jsonl' for JSON Lines, from the first character
+    """
+    f.seek(0)
+    while True:
+        c = f.read(1)
+        if not c:
+            return 'jsonl'
+        if c not in WHITESPACE:
+            return 'json' if c == '[' else 'jsonl'
+
+
+def iter_jsonl(f, offset=0):
+    """
+    yield the (dict, offset of the next line) of each line
+    """
+    f.seek(offset)
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        offset += len(line)
+        if line.strip():
+            yield json.loads(line), offset
+
+
+def iter_json_array(f, offset=0, chunk_size=CHUNK_SIZE):
+    """
+    yield the (dict, offset of the next item) of each item of a JSON array,
+    decoding them one at a time from a buffer; offset 0 is the beginning
+    of the array, otherwise an offset yielded before
+    """
+    decoder = json.JSONDecoder()
+    f.seek(offset)
+    buf, pos, eof = '', 0, False
+    started = offset > 0
+
+    while True:
+        # skip the separators
+        while True:
+            while pos < len(buf) and (buf[pos] in WHITESPACE or buf[pos] == ',' or (buf[pos] == '[' and not started)):
+                started = started or buf[pos] == '['
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            offset += pos
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+        if pos >= len(buf) or buf[pos] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            # item not complete in the buffer: read more, doubling it, so that
+            # large items are decoded in a few attempts
+            more = f.read(max(chunk_size, len(buf) - pos))
+            eof = not more
+            offset += pos
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield item, offset + end
+        pos = end
+
+
+def iter_dump(path, offset=0):
+    """
+    yield the (Sitting, offset of the next sitting) of a dump, from an offset
+    yielded before (or from the beginning); the votations of all the sittings
+    share the deputies and vote codes tables
+    """
+    deputies, vote_codes = SymbolTable(), SymbolTable(VOTE_CODES)
+    with open(path, 'rb') as f:
+        items = iter_json_array(f, offset) if dump_format(f) == 'json' else iter_jsonl(f, offset)
+        for d, next_offset in items:
+            yield Sitting.from_dict(d, deputies, vote_codes), next_offset
+
+
+def batches(sittings, size):
+    """
+    group the (Sitting, offset) tuples in lists of sittings with at least size votations,
+    yielding each list with the offset after its last sitting
+    """
+    batch, n = [], 0
+    offset = None
+    for sitting, offset in sittings:
+        batch.append(sitting)
+        n += len(sitting.votations)
+        if n >= size:
+            yield batch, offset
+            batch, n = [], 0
+    if batch:
+        yield batch, offset
+
+
+class ResumeFile(object):
+    """
+    The offset a load was interrupted at, in a file next to the dump
+    """
+
+    def __init__(self, dump_path):
+        self.path = dump_path + '.offset'
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0)
+        except IOError:
+            return 0
+
+    def save(self, offset):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+        os.rename(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
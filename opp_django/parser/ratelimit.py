@@ -0,0 +1,86 @@
+"""
+Per-host rate limits of the requests to the houses websites.
+
+Each host has its own token bucket, so that crawling the Camera
+does not slow down the Senato, and vice-versa, while all the readers
+of a process, in any thread, share the limits of the same host.
+
+Limits are read from settings.SCRAPER_RATE_LIMITS, mapping hosts
+to the max number of requests per second (burst allowed)::
+
+    SCRAPER_RATE_LIMITS = {
+        'documenti.camera.it': (4, 8),
+        'www.senato.it': (2, 4),
+    }
+
+a simple usage::
+
+    from parser.ratelimit import limits
+    limits.acquire('www.camera.it')
+"""
+import threading
+import time
+from django.conf import settings
+
+__author__ = 'guglielmo'
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        take a token, waiting for it when the bucket is empty;
+        returns the seconds waited
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            # the token is reserved now, waiting happens out of the lock
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class HostLimits(object):
+    """
+    The token buckets of the hosts, built lazily
+    """
+
+    def __init__(self, limits=None, default=None):
+        """
+        :limits:  a dict mapping hosts to (rate, burst) tuples
+        :default: the (rate, burst) of hosts not in limits, None for no limit
+        """
+        self.limits = limits or {}
+        self.default = default
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                limit = self.limits.get(host, self.default)
+                self.buckets[host] = TokenBucket(*limit) if limit else None
+            return self.buckets[host]
+
+    def acquire(self, host):
+        bucket = self.bucket(host)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire()
+
+
+limits = HostLimits(
+    getattr(settings, 'SCRAPER_RATE_LIMITS', None),
+    getattr(settings, 'SCRAPER_DEFAULT_RATE_LIMIT', None)
+)
@@ -8,40 +8,164 @@ Operations are broken down into an atomic API, so that optimized reading
 operations may be invoked at a higher level.
 """
 from datetime import date, datetime, timedelta
-import logging, logging.config
-from bs4 import BeautifulSoup
+import logging
 from django.conf import settings
 import re
-import requests
+import time
+from urlparse import urlparse
+from opp import metrics
+from opp.timing import stage
+from parser import ratelimit
+from parser.records import Sitting, SymbolTable, VotationDetail, VotationRef, VOTE_CODES
+from parser.registry import register
+from parser.singleflight import SingleFlight
 
 __author__ = 'guglielmo'
 
 
-class Camera17VotationsReader(object):
+# identical requests in flight are coalesced among all the readers of the process,
+# and among processes sharing settings.FETCH_LOCKS_ROOT
+flights = SingleFlight(getattr(settings, 'FETCH_LOCKS_ROOT', None))
+
+
+@register('C', 16, 17)
+class CameraVotationsReader(object):
     """
     Class that reads votations information from http://www.camera.it
     and put it into a python data structure.
 
+    The legislature is a parameter, defaulting to LEGISLATURE;
+    readers are usually built through the registry (see parser.registry).
+
     a simple (cool) usage::
 
-        from parser.readers import Camera17VotationsReader
-        reader = Camera17VotationsReader()
+        from parser.readers import CameraVotationsReader
+        reader = CameraVotationsReader(legislature=17)
         reader.get_votation_details('152_15')
     """
 
+    HOUSE = 'C'
     LEGISLATURE = 17
     DOCUMENTS_CAMERA_BASE_URL = "http://documenti.camera.it/votazioni/votazionitutte"
     DOCUMENTS_CAMERA_LIST_URL = "{}/risultatidb.asp".format(DOCUMENTS_CAMERA_BASE_URL)
     DOCUMENTS_CAMERA_DETAIL_URL = "{}/schedaVotazione.asp".format(DOCUMENTS_CAMERA_BASE_URL)
-    RESOCONTI_ASSEMBLEA_URL = "http://www.camera.it/leg{}/207".format(LEGISLATURE)
-    SEDUTA_REFERENCE_URL = "http://www.camera.it/Leg{}/410".format(LEGISLATURE)
 
-    def __init__(self, logger=None):
-        if logger is None:
-            logging.config.dictConfig(settings.LOGGING)
-            self.logger = logging.getLogger('console')
-        else:
-            self.logger = logger
+    # templates of the URLs depending on the legislature
+    RESOCONTI_ASSEMBLEA_URL_TEMPLATE = "http://www.camera.it/leg{}/207"
+    SEDUTA_REFERENCE_URL_TEMPLATE = "http://www.camera.it/Leg{}/410"
+
+    # retries of a failed request (connection errors, timeouts, 5xx), with backoff
+    FETCH_RETRIES = 2
+    FETCH_BACKOFF = 2.0
+
+    # seconds to connect, and to wait for the response, before a request times out
+    FETCH_TIMEOUT = 30
+
+    def __init__(self, logger=None, archive=None, digests=None, legislature=None):
+        self.legislature = legislature or self.LEGISLATURE
+        self.resoconti_assemblea_url = self.RESOCONTI_ASSEMBLEA_URL_TEMPLATE.format(self.legislature)
+        self.seduta_reference_url = self.SEDUTA_REFERENCE_URL_TEMPLATE.format(self.legislature)
+
+        # logging is configured once, by Django, from settings.LOGGING
+        self.logger = logger or logging.getLogger('console')
+
+        # when given, a PageArchive where all fetched pages are appended
+        self.archive = archive
+
+        # when given, a PageDigests store, used to skip parsing unchanged pages;
+        # ('sitting', date) and ('votation', ref) keys of unchanged records are collected
+        self.digests = digests
+        self.unchanged = set()
+
+        # names of the deputies and vote strings, shared by all the votation details read
+        self.deputies = SymbolTable()
+        self.vote_codes = SymbolTable(VOTE_CODES)
+
+    def fetch(self, uri):
+        """
+        fetch the uri and return the content of the response
+
+        when the same uri is already being fetched, by another reader
+        or another process, wait for it and share its content
+        """
+        return flights.do(uri, lambda: self.fetch_remote(uri))
+
+    def fetch_remote(self, uri):
+        """
+        fetch the uri from the house site
+
+        requests wait for the rate limit of the host,
+        failed requests are retried FETCH_RETRIES times
+        """
+        # imported lazily, not to slow down the start of commands not fetching anything
+        import requests
+
+        host = urlparse(uri).netloc
+        attempt = 0
+        with stage('fetch'):
+            start = time.time()
+            while True:
+                ratelimit.limits.acquire(host)
+                try:
+                    r = requests.get(uri, timeout=self.FETCH_TIMEOUT)
+                    if r.status_code < 500:
+                        break
+                    error = "status {0}".format(r.status_code)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                if attempt >= self.FETCH_RETRIES:
+                    raise requests.HTTPError("{0} failed after {1} retries: {2}".format(uri, attempt, error))
+                attempt += 1
+                metrics.http_retries.inc(host=host)
+                self.logger.warning("{0}: {1}, retrying".format(uri, error))
+                time.sleep(self.FETCH_BACKOFF * attempt)
+
+        metrics.fetch_latency.observe(time.time() - start, host=host)
+        metrics.pages_fetched.inc(host=host)
+        metrics.bytes_fetched.inc(len(r.content), host=host)
+        if self.archive is not None:
+            self.archive.append(uri, r.content)
+        return r.content
+
+    def parse(self, content):
+        """
+        parse an html page and return its BeautifulSoup tree
+        """
+        from bs4 import BeautifulSoup
+
+        with stage('parse'):
+            return BeautifulSoup(content)
+
+    def fetch_and_extract(self, uri, extract, load):
+        """
+        fetch the uri, parse it and extract data with the extract function
+
+        when the page did not change since the last successful import,
+        the data extracted back then are loaded back from their JSON view,
+        with the load function, and the page is not parsed
+
+        returns the extracted data and whether the page was unchanged
+        """
+        content = self.fetch(uri)
+        if self.digests is None:
+            return extract(self.parse(content)), False
+
+        digest = self.digests.digest(content)
+        extracted = self.digests.lookup(uri, digest)
+        metrics.record_cache('page_digest', extracted is not None)
+        if extracted is not None:
+            return load(extracted), True
+
+        extracted = extract(self.parse(content))
+        self.digests.stage(uri, digest, extracted)
+        return extracted, False
+
+    def sittings_uri(self, year_month):
+        """
+        the uri of the index page of the sittings of a "YYYY-MM" month
+        """
+        year, month = year_month.split('-')
+        return "{}?annomese={},{}".format(self.resoconti_assemblea_url, year, month)
 
     def get_sittings(self, year_month):
         """
@@ -52,27 +176,32 @@ class Camera17VotationsReader(object):
         year, month = year_month.split('-')
 
         # get resoconti assemblea page for this year and month
-        ym_resoconti_uri = "{}?annomese={},{}".format(self.RESOCONTI_ASSEMBLEA_URL, year, month)
-        r = requests.get(ym_resoconti_uri)
+        ym_resoconti_uri = self.sittings_uri(year_month)
         self.logger.info("parsing: {}".format(ym_resoconti_uri))
+        sittings, _ = self.fetch_and_extract(
+            ym_resoconti_uri,
+            lambda s: self.extract_sittings(s, year, month),
+            lambda sittings: [Sitting.from_dict(s) for s in sittings]
+        )
 
+        self.logger.info("returning {} sittings".format(len(sittings)))
+        return sittings
+
+    def extract_sittings(self, s, year, month):
         # get all links of class 'eleres_seduta'
-        s = BeautifulSoup(r.content)
         a_sedute = s.find_all('a', class_='eleres_seduta')
         seduta_regexp = re.compile(r"(.+) n. (.+?) .+? (.+)")
 
         sittings = []
         for s in a_sedute:
             (domain, num, day) = seduta_regexp.match(s.text).groups()
-            sittings.append({
-                'num': num,
-                'date': "{}-{}-{}".format(year, month, day),
-                'reference_url': "{}?idSeduta={}".format(
-                            self.SEDUTA_REFERENCE_URL, num
+            sittings.append(Sitting(
+                num=num,
+                date="{}-{}-{}".format(year, month, day),
+                reference_url="{}?idSeduta={}".format(
+                            self.seduta_reference_url, num
                 )
-            })
-
-        self.logger.info("returning {} sittings".format(len(sittings)))
+            ))
         return sittings
 
     def get_last_sittings(self, n_months_back=1):
@@ -101,69 +230,97 @@ class Camera17VotationsReader(object):
         get the list of all votations for a sitting in a given date
         the date is a python date object, or a 'YYYY-MM-DD' string
 
-        for each votations, the following data are returned:
+        for each votations, a VotationRef is returned, with:
 
           - ref_numbers - sitting and votation numbers,
                           separated by an underscore character (181_1)
           - uri         - the uri of the votation details page
         """
-        uri_template = self.DOCUMENTS_CAMERA_LIST_URL + "?" + \
-            "action=Votazioni&PagCorr={}&Legislatura={}&" \
-            "CDDGIORNO={}&CDDMESE={}&CDDANNO={}"
-
-        if isinstance(sitting_date, str):
+        if isinstance(sitting_date, basestring):
+            date_key = sitting_date
             sitting_date = datetime.strptime(sitting_date, '%Y-%m-%d')
+        else:
+            date_key = sitting_date.strftime('%Y-%m-%d')
 
-        # fetch first page
+        # browse all pages
         pagina = 1
-        s_uri = uri_template.format(pagina, self.LEGISLATURE, sitting_date.day, sitting_date.month, sitting_date.year)
-        r = requests.get(s_uri)
-        c = BeautifulSoup(r.content)
-        self.logger.debug("fetching from url: {}".format(s_uri))
+        ret_votations = []
+        all_unchanged = True
+        while (True):
+            s_uri = self.votations_uri(sitting_date, pagina)
+            self.logger.debug("fetching from url: {}".format(s_uri))
+            (page_votations, has_next), unchanged = self.fetch_and_extract(
+                s_uri, self.extract_votations,
+                lambda extracted: ([VotationRef.from_dict(v) for v in extracted[0]], extracted[1])
+            )
+            all_unchanged = all_unchanged and unchanged
+            ret_votations.extend(page_votations)
+
+            if has_next:
+                # fetch next page
+                pagina += 1
+            else:
+                # this was the last page; break the infinite while loop
+                break
+
+        if all_unchanged:
+            self.unchanged.add(('sitting', date_key))
+        return ret_votations
+
+    def votations_uri(self, sitting_date, page=1):
+        """
+        the uri of a page of the votations listing of the sitting, of the given date
+        """
+        if isinstance(sitting_date, basestring):
+            sitting_date = datetime.strptime(sitting_date, '%Y-%m-%d')
+        return self.DOCUMENTS_CAMERA_LIST_URL + "?" + \
+            "action=Votazioni&PagCorr={}&Legislatura={}&CDDGIORNO={}&CDDMESE={}&CDDANNO={}".format(
+                page, self.legislature, sitting_date.day, sitting_date.month, sitting_date.year
+            )
 
+    def votation_details_uri(self, votation_ref):
+        return self.DOCUMENTS_CAMERA_DETAIL_URL + "?" + \
+            "Legislatura={}&RifVotazione={}".format(self.legislature, votation_ref)
 
+    def extract_votations(self, c):
+        """
+        return the list of votations in a parsed listing page,
+        and whether a next page is available
+        """
         # when there are no votes, return an empty list
         p_campo = c.find_all('p', 'campo')
         if p_campo and 'attenzione' in p_campo[0].string.lower():
             self.logger.info("  Non ci sono votazioni nella seduta.")
-            return []
-        else:
-            # initializa return list
-            ret_votations = []
-
-            # infinite loop to browse different pages
-            while (True):
-                # append votations in the page to return list
-                for a_voto in c.select('div.itemV a'):
-                    votation_uri = self.DOCUMENTS_CAMERA_BASE_URL + a_voto['href']
-                    votation_ref_numbers = re.match(r'.*RifVotazione=(.*)&tipo.*', votation_uri).group(1)
-                    _, num_votazione = votation_ref_numbers.split("_")
-
-                    ret_votations.append({ 'ref_numbers': votation_ref_numbers, 'uri': votation_uri })
+            return [], False
 
-                if c.select('a#Prossima'):
-                    # fetch next page
-                    pagina += 1
-                    s_uri = uri_template.format(pagina, self.LEGISLATURE, sitting_date.day, sitting_date.month, sitting_date.year)
-                    r = requests.get(s_uri)
-                    c = BeautifulSoup(r.content)
-                    self.logger.debug("fetching from url: {}".format(s_uri))
-                else:
-                    # this was the last page; break the infinite while loop
-                    break
+        # append votations in the page to return list
+        votations = []
+        for a_voto in c.select('div.itemV a'):
+            votation_uri = self.DOCUMENTS_CAMERA_BASE_URL + a_voto['href']
+            votation_ref_numbers = re.match(r'.*RifVotazione=(.*)&tipo.*', votation_uri).group(1)
+            votations.append(VotationRef(votation_ref_numbers, votation_uri))
 
-            return ret_votations
+        return votations, bool(c.select('a#Prossima'))
 
 
     def get_votation_details(self, votation_ref):
         # prepare uri and fetch content
-        uri_template = self.DOCUMENTS_CAMERA_DETAIL_URL + "?" + \
-            "Legislatura={}&RifVotazione={}"
-        v_uri = uri_template.format(self.LEGISLATURE, votation_ref)
-        r = requests.get(v_uri)
-        c = BeautifulSoup(r.content)
+        v_uri = self.votation_details_uri(votation_ref)
         self.logger.debug("fetching from url: {}".format(v_uri))
+        votation, unchanged = self.fetch_and_extract(
+            v_uri,
+            lambda c: self.parse_votation_details(c, votation_ref),
+            lambda d: VotationDetail.from_dict(d, self.deputies, self.vote_codes)
+        )
 
+        if unchanged:
+            self.unchanged.add(('votation', votation_ref))
+        return votation
+
+    def parse_votation_details(self, c, votation_ref):
+        """
+        extract the votation details from the parsed schedaVotazione page
+        """
         # scrape title
         votation_title = c.find_all('div', id='titolo')[0].string.strip()
 
@@ -183,54 +340,110 @@ class Camera17VotationsReader(object):
             k, v = [td.string.strip() for td in tr.find_all('td')]
             votation_summary[k] = v
 
-        votation_result = c.select('table.esito tr')[-1].find_all('td')[0].contents[0]
+        # NavigableStrings are turned into plain strings, not to keep references to the tree
+        votation_result = unicode(c.select('table.esito tr')[-1].find_all('td')[0].contents[0])
 
 
+        votation = VotationDetail(
+            title=votation_title,
+            number=votation_number,
+            type=votation_type,
+            summary=votation_summary,
+            result=votation_result,
+            deputies=self.deputies,
+            vote_codes=self.vote_codes
+        )
+
         # get all the single votes
-        votation_detail = {}
         trs = c.select('table.deputati tr')[1:]
         for tr in trs:
-            k1, v1, _, k2, v2 = [td.string for td in tr.find_all('td')]
-            votation_detail.update({
-                k1: v1,
-                k2: v2,
-            })
-
+            k1, v1, _, k2, v2 = [
+                unicode(td.string) if td.string is not None else None for td in tr.find_all('td')
+            ]
+            for name, vote in ((k1, v1), (k2, v2)):
+                if name is not None:
+                    votation.set_vote(name, vote)
 
-        # prepare return structure
-        ret_votation = {
-            'title': votation_title,
-            'number': votation_number,
-            'type': votation_type,
-            'summary': votation_summary,
-            'result': votation_result,
-            'detail': votation_detail,
-        }
+        return votation
 
-        return ret_votation
 
-
-    def read(self):
+    def read(self, year_months=None):
         """
         full read operation
 
-        reads through recursively: sittings, votations, votation details
+        reads through recursively: sittings, votations, votation details,
+        and returns a list of Sitting records
 
-        for the current and previous month
+        for the given list of months ("YYYY-MM" strings),
+        or for the current and previous month
 
         watch out, may take long time and lots of requests!!!
         """
-        sittings = self.get_last_sittings()
+        if year_months is None:
+            sittings = self.get_last_sittings()
+        else:
+            sittings = []
+            for ym in year_months:
+                sittings.extend(self.get_sittings(ym))
+
+        # the digests of the pages to read are looked up in batches
+        if self.digests is not None:
+            self.digests.prefetch([self.votations_uri(sitting.date) for sitting in sittings])
+
         for sitting in sittings:
-            votations = self.get_votations(sitting['date'])
+            votations = self.get_votations(sitting.date)
 
+            # votations of sittings with unchanged listing pages were already imported
+            if ('sitting', sitting.date) in self.unchanged:
+                sitting.unchanged = True
+                continue
+
+            if self.digests is not None:
+                self.digests.prefetch([self.votation_details_uri(v.ref_numbers) for v in votations])
             for votation in votations:
-                votation.update({
-                    'votation_details': self.get_votation_details(votation['ref_numbers'])
-                })
+                votation.details = self.get_votation_details(votation.ref_numbers)
+                votation.unchanged = ('votation', votation.ref_numbers) in self.unchanged
+
+            sitting.votations = votations
+
+        return sittings
+
+
+class Camera17VotationsReader(CameraVotationsReader):
+    """
+    Reader of the votations of the 17th legislature at the Camera
+    """
+    LEGISLATURE = 17
 
-            sitting.update({
-                'votations': votations
-            })
 
-        return sittings
\ No newline at end of file
+class ArchivedVotationsReader(CameraVotationsReader):
+    """
+    Reader parsing the pages stored in a PageArchive, with no network access.
+
+    Used to re-parse pages after markup changes or parsing fixes::
+
+        from parser.archive import PageArchive
+        reader = ArchivedVotationsReader(PageArchive(settings.PAGE_ARCHIVE_ROOT))
+        reader.read(['2014-03'])
+    """
+
+    def __init__(self, archive, logger=None, legislature=None):
+        super(ArchivedVotationsReader, self).__init__(logger=logger, legislature=legislature)
+        self.source = archive
+
+    def fetch(self, uri):
+        with stage('fetch'):
+            content = self.source.get(uri)
+        if content is None:
+            raise LookupError("{0} not in archive".format(uri))
+        return content
+
+    def archived_months(self):
+        """
+        return the sorted list of months ("YYYY-MM") whose index page is archived
+        """
+        months = set()
+        for uri in self.source.uris(contains=self.resoconti_assemblea_url + "?annomese="):
+            year, month = uri.split("annomese=")[1].split(",")
+            months.add("{0}-{1}".format(year, month))
+        return sorted(months)
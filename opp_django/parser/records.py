@@ -0,0 +1,204 @@
+"""
+Record types returned by the readers.
+
+Records use ``__slots__``, and the single votes of a votation are stored
+as a compact array of vote codes, indexed by the position of the deputies
+in a deputies table shared by all the votations read by a reader,
+instead of a dict mapping each name to its vote string.
+
+Each record has a JSON-compatible view (``as_dict``), with the structure
+of the nested dicts returned by the readers in the past, and can be
+built back from it (``from_dict``).
+"""
+from array import array
+
+__author__ = 'guglielmo'
+
+
+class SymbolTable(object):
+    """
+    Interns symbols (names, vote strings) into small integers
+    """
+    __slots__ = ('symbols', 'indexes')
+
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.indexes = {}
+        for symbol in symbols:
+            self.index(symbol)
+
+    def index(self, symbol):
+        i = self.indexes.get(symbol)
+        if i is None:
+            i = self.indexes[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return i
+
+    def __getitem__(self, i):
+        return self.symbols[i]
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __getstate__(self):
+        return self.symbols
+
+    def __setstate__(self, symbols):
+        self.__init__(symbols)
+
+
+# vote strings, as they appear in the votation detail pages,
+# the first symbols of the vote codes tables
+VOTE_CODES = (
+    u'Favorevole', u'Contrario', u'Astensione', u'Non ha votato', u'In missione', u'Presidente di turno',
+)
+
+# vote codes are stored as signed bytes
+MAX_VOTE_CODES = 127
+
+
+class Record(object):
+    """
+    Base class of the records, pickling their slots
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+
+class Sitting(Record):
+    __slots__ = ('num', 'date', 'reference_url', 'votations', 'unchanged')
+
+    def __init__(self, num, date, reference_url, votations=None, unchanged=False):
+        self.num = num
+        self.date = date
+        self.reference_url = reference_url
+        self.votations = votations if votations is not None else []
+        self.unchanged = unchanged
+
+    def as_dict(self):
+        d = {
+            'num': self.num,
+            'date': self.date,
+            'reference_url': self.reference_url,
+            'votations': [v.as_dict() for v in self.votations],
+        }
+        if self.unchanged:
+            d['unchanged'] = True
+        return d
+
+    @classmethod
+    def from_dict(cls, d, deputies=None, vote_codes=None):
+        return cls(
+            d['num'], d['date'], d['reference_url'],
+            votations=[VotationRef.from_dict(v, deputies, vote_codes) for v in d.get('votations', [])],
+            unchanged=d.get('unchanged', False)
+        )
+
+
+class VotationRef(Record):
+    __slots__ = ('ref_numbers', 'uri', 'details', 'unchanged')
+
+    def __init__(self, ref_numbers, uri, details=None, unchanged=False):
+        self.ref_numbers = ref_numbers
+        self.uri = uri
+        self.details = details
+        self.unchanged = unchanged
+
+    def as_dict(self):
+        d = {'ref_numbers': self.ref_numbers, 'uri': self.uri}
+        if self.details is not None:
+            d['votation_details'] = self.details.as_dict()
+        if self.unchanged:
+            d['unchanged'] = True
+        return d
+
+    @classmethod
+    def from_dict(cls, d, deputies=None, vote_codes=None):
+        details = d.get('votation_details')
+        return cls(
+            d['ref_numbers'], d['uri'],
+            details=VotationDetail.from_dict(details, deputies, vote_codes) if details is not None else None,
+            unchanged=d.get('unchanged', False)
+        )
+
+
+class VotationDetail(Record):
+    """
+    Details of a votation.
+
+    The vote of the deputy at position i in the deputies table is
+    ``vote_codes[votes[i]]``; -1 marks deputies not in the votation.
+    Both tables are shared among the votations read by a reader;
+    vote codes tables start with VOTE_CODES, and hold at most MAX_VOTE_CODES.
+    """
+    __slots__ = ('title', 'number', 'type', 'summary', 'result', 'deputies', 'vote_codes', 'votes')
+
+    def __init__(self, title, number, type, summary, result, deputies=None, vote_codes=None):
+        self.title = title
+        self.number = number
+        self.type = type
+        self.summary = summary
+        self.result = result
+        self.deputies = deputies if deputies is not None else SymbolTable()
+        self.vote_codes = vote_codes if vote_codes is not None else SymbolTable(VOTE_CODES)
+        self.votes = array('b')
+
+    def set_vote(self, name, vote):
+        i = self.deputies.index(name)
+        if i >= len(self.votes):
+            self.votes.extend([-1] * (i + 1 - len(self.votes)))
+        vote = (vote or u'').strip()
+        if vote not in self.vote_codes.indexes and len(self.vote_codes) >= MAX_VOTE_CODES:
+            raise ValueError("too many distinct votes, {0} not stored".format(vote))
+        self.votes[i] = self.vote_codes.index(vote)
+
+    def iter_votes(self):
+        """
+        yield the (deputy index, vote string) tuples
+        """
+        for i, code in enumerate(self.votes):
+            if code >= 0:
+                yield i, self.vote_codes[code]
+
+    @property
+    def detail(self):
+        """
+        a dict mapping each deputy's name to the vote string
+        """
+        return dict((self.deputies[i], vote) for i, vote in self.iter_votes())
+
+    def __len__(self):
+        return sum(1 for code in self.votes if code >= 0)
+
+    def as_dict(self):
+        return {
+            'title': self.title,
+            'number': self.number,
+            'type': self.type,
+            'summary': self.summary,
+            'result': self.result,
+            'detail': self.detail,
+        }
+
+    @classmethod
+    def from_dict(cls, d, deputies=None, vote_codes=None):
+        details = cls(d['title'], d['number'], d['type'], d['summary'], d['result'],
+                      deputies=deputies, vote_codes=vote_codes)
+        for name, vote in d['detail'].items():
+            details.set_vote(name, vote)
+        return details
+
+
+def as_json(obj):
+    """
+    ``default`` hook for json.dumps, serializing records through their JSON-compatible view
+    """
+    if hasattr(obj, 'as_dict'):
+        return obj.as_dict()
+    raise TypeError("{0!r} is not JSON serializable".format(obj))
@@ -0,0 +1,67 @@
+"""
+Registry of the readers, by house and legislature.
+
+Reader classes register themselves for the (house, legislature)
+couples they're able to read, and get the legislature as a parameter::
+
+    @register('C', 17, 18)
+    class CameraVotationsReader(object):
+        ...
+
+a simple usage::
+
+    from parser.registry import get_reader
+    reader = get_reader('C', 17, logger=logger)
+"""
+from importlib import import_module
+
+__author__ = 'guglielmo'
+
+
+# modules registering readers, imported at the first lookup
+READER_MODULES = (
+    'parser.readers',
+)
+
+# (house, legislature) -> reader class
+readers = {}
+
+
+def register(house, *legislatures):
+    """
+    class decorator registering a reader for the legislatures of the house
+    """
+    def decorator(cls):
+        for legislature in legislatures:
+            readers[(house.upper(), int(legislature))] = cls
+        return cls
+    return decorator
+
+
+def load():
+    for module in READER_MODULES:
+        import_module(module)
+
+
+def get_reader_class(house, legislature):
+    load()
+    try:
+        return readers[(house.upper(), int(legislature))]
+    except KeyError:
+        raise LookupError("no reader registered for house {0}, legislature {1}".format(house, legislature))
+
+
+def get_reader(house, legislature, **kwargs):
+    """
+    return a reader of the votations of the house in the legislature;
+    keyword arguments are passed to the reader
+    """
+    return get_reader_class(house, legislature)(legislature=int(legislature), **kwargs)
+
+
+def registered():
+    """
+    return the sorted list of the (house, legislature) couples with a reader
+    """
+    load()
+    return sorted(readers.keys())
@@ -0,0 +1,213 @@
+"""
+Recording and replaying of the pages read from the houses websites.
+
+A corpus is a directory of gzipped pages, with a ``manifest.json`` index
+mapping each recorded url to its file, and the list of recorded months.
+
+The ``ReplayServer`` serves a corpus as an HTTP proxy: readers pointed
+to it (through the ``HTTP_PROXY`` environment variable, honoured by requests)
+read the recorded pages instead of hitting the real websites, with
+configurable latency and error rates.
+
+Used by the ``record_camera_corpus`` and ``benchmark_reader`` management commands.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from parser.readers import Camera17VotationsReader
+
+__author__ = 'guglielmo'
+
+
+class Corpus(object):
+    """
+    A directory of recorded pages
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'months': [], 'pages': {}}
+
+    @staticmethod
+    def filename(uri):
+        return hashlib.sha1(uri).hexdigest() + '.html.gz'
+
+    def add(self, uri, content):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        filename = self.filename(uri)
+        with gzip.open(os.path.join(self.path, filename), 'wb') as f:
+            f.write(content)
+        self.manifest['pages'][uri] = filename
+
+    def add_month(self, year_month):
+        if year_month not in self.manifest['months']:
+            self.manifest['months'].append(year_month)
+            self.manifest['months'].sort()
+
+    def get(self, uri):
+        """
+        return the recorded content for the uri, or None
+        """
+        filename = self.manifest['pages'].get(uri)
+        if filename is None:
+            return None
+        with gzip.open(os.path.join(self.path, filename), 'rb') as f:
+            return f.read()
+
+    @property
+    def months(self):
+        return self.manifest['months']
+
+    def __len__(self):
+        return len(self.manifest['pages'])
+
+    def save(self):
+        with open(self.manifest_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+
+
+class RecordingVotationsReader(Camera17VotationsReader):
+    """
+    A reader adding every fetched page to a corpus
+    """
+
+    def __init__(self, corpus, logger=None):
+        super(RecordingVotationsReader, self).__init__(logger)
+        self.corpus = corpus
+
+    def fetch(self, uri):
+        content = super(RecordingVotationsReader, self).fetch(uri)
+        self.corpus.add(uri, content)
+        return content
+
+
+class ReplayVotationsReader(Camera17VotationsReader):
+    """
+    A reader of a replayed corpus: pages still failing after the retries
+    are counted in failed, and their records left out, instead of aborting the read
+    """
+    FETCH_BACKOFF = 0.01
+
+    def __init__(self, logger=None, retries=None):
+        super(ReplayVotationsReader, self).__init__(logger)
+        if retries is not None:
+            self.FETCH_RETRIES = retries
+        self.failed = []
+
+    def fetch_remote(self, uri):
+        import requests
+
+        try:
+            return super(ReplayVotationsReader, self).fetch_remote(uri)
+        except requests.HTTPError as e:
+            self.logger.warning("{0}".format(e))
+            self.failed.append(uri)
+            raise
+
+    def get_sittings(self, year_month):
+        import requests
+
+        try:
+            return super(ReplayVotationsReader, self).get_sittings(year_month)
+        except requests.HTTPError:
+            return []
+
+    def get_votations(self, sitting_date):
+        import requests
+
+        try:
+            return super(ReplayVotationsReader, self).get_votations(sitting_date)
+        except requests.HTTPError:
+            return []
+
+    def get_votation_details(self, votation_ref):
+        import requests
+
+        try:
+            return super(ReplayVotationsReader, self).get_votation_details(votation_ref)
+        except requests.HTTPError:
+            return None
+
+    def read(self, year_months=None):
+        sittings = super(ReplayVotationsReader, self).read(year_months)
+        for sitting in sittings:
+            sitting.votations = [v for v in sitting.votations if v.details is not None]
+        return sittings
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(random.uniform(server.latency / 2.0, server.latency * 1.5))
+
+        if server.error_rate and random.random() < server.error_rate:
+            server.count('errors')
+            self.send_error(503, 'Service Unavailable (simulated)')
+            return
+
+        # proxied requests carry the full uri in the path
+        content = server.corpus.get(self.path)
+        if content is None:
+            server.count('misses')
+            self.send_error(404, 'Not recorded')
+            return
+
+        server.count('hits')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP proxy replaying a corpus, with random latency (in seconds)
+    and a rate of simulated 503 errors.
+
+    a simple usage::
+
+        server = ReplayServer(Corpus('benchmarks/corpus'), latency=0.05)
+        server.start()
+        os.environ['HTTP_PROXY'] = server.proxy_url
+    """
+    daemon_threads = True
+
+    def __init__(self, corpus, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0):
+        HTTPServer.__init__(self, (host, port), ReplayRequestHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    @property
+    def proxy_url(self):
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,209 @@
+"""
+Coalescing of identical in-flight requests.
+
+When concurrent imports request the same page at the same time,
+only one of them (the leader) actually fetches it; the others wait
+for it to complete and share its result.
+
+Within a process, callers are coalesced with an event per key.
+Among processes (workers, concurrent commands), with a marker file
+per key in flight: the leader is elected, and later hands its result
+over, holding an exclusive lock on one of LOCK_SLOTS lock files, chosen
+by the hash of the key, but it does not hold the lock while it fetches.
+The leader writes the result next to the lock files and removes its
+marker; the processes polling the marker read the result back.
+Results are only shared with callers already waiting, they're not a cache.
+The results of the readers' fetches are the raw contents of the pages:
+each caller still parses them (see parser.digests, to skip that).
+
+a simple usage::
+
+    from parser.singleflight import SingleFlight
+    flights = SingleFlight(settings.FETCH_LOCKS_ROOT)
+    content = flights.do(uri, lambda: requests.get(uri).content)
+"""
+from contextlib import contextmanager
+import fcntl
+from hashlib import sha1
+import os
+import threading
+import time
+from opp import metrics
+
+__author__ = 'guglielmo'
+
+
+class Flight(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    # keys are spread among a fixed number of lock files
+    LOCK_SLOTS = 256
+
+    # results files older than this are removed by the leaders, at most once per PRUNE_INTERVAL
+    RESULTS_MAX_AGE = 600
+    PRUNE_INTERVAL = 60
+
+    # leaders still in flight after this many seconds are deemed dead, and replaced
+    LEADER_TIMEOUT = 300
+
+    # seconds between the checks of the processes waiting for a leader
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path=None):
+        """
+        :path: the directory of the lock files; when None, calls are coalesced only within the process
+        """
+        self.path = path
+        if path is not None and not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # created by another process in the meantime
+                pass
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.pruned_at = 0
+
+    def do(self, key, func):
+        """
+        return func(), unless a call with the same key is already in flight,
+        then wait for it and return its result, or raise its exception
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            metrics.coalesced_requests.inc(scope='thread')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            if self.path is None:
+                flight.result = func()
+            else:
+                flight.result = self.do_locked(key, func)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def do_locked(self, key, func):
+        """
+        coalesce calls among processes, with a marker file;
+        the slot lock is only held to elect the leader and to hand its result over
+        """
+        digest = sha1(key.encode('utf-8') if isinstance(key, unicode) else key).hexdigest()
+        name = os.path.join(self.path, digest)
+        lock_name = os.path.join(self.path, 'slot-{0:03d}.lock'.format(int(digest, 16) % self.LOCK_SLOTS))
+
+        # results written since the call began are shared, even by a leader
+        # that completed between the call and the first election
+        waiting_since = time.time()
+        while True:
+            with self.slot(lock_name):
+                result = self.read_result(name, waiting_since)
+                if result is not None:
+                    metrics.coalesced_requests.inc(scope='process')
+                    return result
+                # no result: nobody in flight, or the leader is still fetching, or it failed
+                if self.elect(name):
+                    break
+            time.sleep(self.POLL_INTERVAL)
+
+        try:
+            result = func()
+        except Exception:
+            with self.slot(lock_name):
+                self.remove(name + '.inflight')
+            raise
+        with self.slot(lock_name):
+            self.write_result(name, result)
+            self.remove(name + '.inflight')
+        return result
+
+    @staticmethod
+    @contextmanager
+    def slot(lock_name):
+        """
+        hold the exclusive lock of a slot
+        """
+        with open(lock_name, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def elect(self, name):
+        """
+        become the leader of the key, unless another live leader is in flight;
+        called holding the slot lock
+        """
+        marker = name + '.inflight'
+        try:
+            if time.time() - os.path.getmtime(marker) < self.LEADER_TIMEOUT:
+                return False
+        except OSError:
+            # no leader in flight
+            pass
+        with open(marker, 'w') as f:
+            f.write(str(os.getpid()))
+        return True
+
+    @staticmethod
+    def remove(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    @staticmethod
+    def read_result(name, since):
+        """
+        return the result written after since, or None
+        """
+        try:
+            if os.path.getmtime(name + '.result') < since:
+                return None
+            with open(name + '.result', 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def write_result(self, name, result):
+        # written atomically, then old results are pruned
+        with open(name + '.tmp', 'wb') as f:
+            f.write(result)
+        os.rename(name + '.tmp', name + '.result')
+        self.prune()
+
+    def prune(self):
+        if time.time() - self.pruned_at < self.PRUNE_INTERVAL:
+            return
+        self.pruned_at = time.time()
+        expired = self.pruned_at - self.RESULTS_MAX_AGE
+        for f in os.listdir(self.path):
+            if not f.endswith('.result'):
+                continue
+            try:
+                if os.path.getmtime(os.path.join(self.path, f)) < expired:
+                    os.remove(os.path.join(self.path, f))
+            except OSError:
+                pass
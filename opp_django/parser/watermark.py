@@ -0,0 +1,152 @@
+"""
+Fast-start pre-check of the periodic import commands.
+
+Commands run with ``--if-changed`` are skipped when the index pages
+of the sittings of the current and previous months did not change since
+the last successful run of the same command (the watermark, keeping the
+digests of each command apart, as commands may watch the same pages),
+before Django is even loaded::
+
+    ./manage.py check_sedute_camera --if-changed
+
+The pre-check runs in manage.py, fetching the pages with the standard
+library only; when something changed, the new digests are kept pending,
+and committed by the command, once it succeeded. A run leaving sittings
+to import discards the digests instead, so that the next run retries them.
+
+Only the sittings are listed in the index pages: commands importing the
+votations of sittings already listed can't be pre-checked this way.
+
+This module must not import Django, nor anything heavy; the pre-check
+only imports the readers, to watch the pages they read.
+"""
+from datetime import date, timedelta
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib2
+
+__author__ = 'guglielmo'
+
+
+# commands supporting the pre-check, mapped to the house they check
+WATCHED_COMMANDS = {
+    'check_sedute_camera': 'C',
+}
+
+WATERMARK_FILE = os.environ.get(
+    'OPP_WATERMARK_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'watermark.json')
+)
+
+FETCH_TIMEOUT = 20
+
+# markup changing at every request, stripped before computing digests
+VOLATILE_PATTERNS = (
+    re.compile(r'<script\b.*?</script>', re.DOTALL | re.IGNORECASE),
+    re.compile(r'<!--.*?-->', re.DOTALL),
+    re.compile(r'<input[^>]+type="hidden"[^>]*>', re.IGNORECASE),
+    re.compile(r'ASPSESSIONID\w*=\w+', re.IGNORECASE),
+    re.compile(r'\s+'),
+)
+
+# digests computed by the pre-check, by command, to be committed by the command
+pending = {}
+
+
+def page_digest(content):
+    """
+    digest of a page, insensitive to its volatile markup
+    """
+    for pattern in VOLATILE_PATTERNS:
+        content = pattern.sub(' ', content)
+    return hashlib.sha1(content).hexdigest()
+
+
+def watched_urls(house, today=None):
+    """
+    the index pages of the sittings of the current and previous months,
+    as read by the reader of the latest legislature registered for the house
+    """
+    # imported here: the readers load the Django settings (not Django itself)
+    from parser.registry import get_reader, registered
+
+    legislature = max(l for h, l in registered() if h == house)
+    reader = get_reader(house, legislature)
+    today = today or date.today()
+    first = today.replace(day=1)
+    months = (first - timedelta(days=1), first)
+    return [reader.sittings_uri(m.strftime('%Y-%m')) for m in months]
+
+
+def load():
+    """
+    return the digests of the watched pages, by command
+    """
+    try:
+        with open(WATERMARK_FILE) as f:
+            watermark = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    # digests of the pages not keyed by command are discarded
+    return dict((command, digests) for command, digests in watermark.items() if isinstance(digests, dict))
+
+
+def store(watermark):
+    tmp = WATERMARK_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(watermark, f, indent=2, sort_keys=True)
+    os.rename(tmp, WATERMARK_FILE)
+
+
+def commit():
+    """
+    store the pending digests, after a successful run
+    """
+    if not pending:
+        return
+    watermark = load()
+    for command, digests in pending.items():
+        watermark.setdefault(command, {}).update(digests)
+    store(watermark)
+    pending.clear()
+
+
+def discard(command):
+    """
+    forget the digests of the command, after a run leaving something to retry,
+    so that the next run is not skipped, whether the pages changed or not
+    """
+    pending.pop(command, None)
+    watermark = load()
+    if watermark.pop(command, None) is not None:
+        store(watermark)
+
+
+def precheck(argv):
+    """
+    return False when the command in argv can be skipped, as nothing changed;
+    on any error, the command is run
+    """
+    if '--if-changed' not in argv or len(argv) < 2 or argv[1] not in WATCHED_COMMANDS:
+        return True
+
+    command = argv[1]
+    house = WATCHED_COMMANDS[command]
+    watermark = load().get(command, {})
+    digests = {}
+    try:
+        for url in watched_urls(house):
+            digests[url] = page_digest(urllib2.urlopen(url, timeout=FETCH_TIMEOUT).read())
+    except Exception as e:
+        sys.stderr.write("watermark pre-check failed, running the command: {0}\n".format(e))
+        return True
+
+    if all(watermark.get(url) == digest for url, digest in digests.items()):
+        sys.stderr.write("nothing changed since the last run, {0} skipped\n".format(command))
+        return False
+
+    pending[command] = digests
+    return True
@@ -1,13 +1,20 @@
 import json
-import logging, logging.config
-from django.conf import settings
-from opp.models import Seduta
+import logging
+from django.db import transaction
+from opp.models import Carica, CaricaProfile, CumulativeVoteCount, Seduta, Votazione, VotazioneHasCarica, \
+    VotazioneAtto, VotazioneGruppoBreakdown, VotazioneSearchPosting
+from opp import acts, breakdown, metrics, pagecache, profiles, search, votecounts
+from opp.timing import stage
+from parser.records import as_json
 
 __author__ = 'guglielmo'
 
 class JSONVotationsWriter(object):
     """
-    Write sittings to a JSON stream (may be a file)
+    Write sittings to a JSON stream (may be a file),
+    using the JSON-compatible view of the records;
+    .jsonl files get a sitting per line (JSON Lines),
+    that can be loaded back incrementally (see parser.dumps)
     """
 
     def __init__(self, data, json_filename=None):
@@ -15,45 +22,276 @@ class JSONVotationsWriter(object):
         self.json_filename = json_filename
 
     def write(self):
-        if self.json_filename:
-            f = open(self.json_filename, 'w')
-            f.write(json.dumps(self.data, indent=4))
+        if self.json_filename and self.json_filename.endswith('.jsonl'):
+            with open(self.json_filename, 'w') as f:
+                for sitting in self.data:
+                    f.write(json.dumps(sitting, default=as_json) + "\n")
+        elif self.json_filename:
+            with open(self.json_filename, 'w') as f:
+                f.write(json.dumps(self.data, indent=4, default=as_json))
         else:
-            print(json.dumps(self.data, indent=4))
+            print(json.dumps(self.data, indent=4, default=as_json))
 
 
 class OppDBVotationsWriter(object):
     """
-
+    Write sittings and votations into the Openparlamento DB
     """
 
+    # labels of the votation summary, as scraped, mapped to Votazione fields
+    SUMMARY_FIELDS = {
+        'presenti': 'presenti',
+        'votanti': 'votanti',
+        'astenuti': 'astenuti',
+        'maggioranza': 'maggioranza',
+        'hanno votato si': 'favorevoli',
+        'favorevoli': 'favorevoli',
+        'hanno votato no': 'contrari',
+        'contrari': 'contrari',
+    }
+
+    # single votes, as scraped, mapped to the voto values in the DB
+    VOTE_VALUES = {
+        'favorevole': VotazioneHasCarica.FAVOREVOLE,
+        'contrario': VotazioneHasCarica.CONTRARIO,
+        'astensione': VotazioneHasCarica.ASTENUTO,
+        'astenuto': VotazioneHasCarica.ASTENUTO,
+        'non ha votato': VotazioneHasCarica.ASSENTE,
+        'assente': VotazioneHasCarica.ASSENTE,
+        'in missione': VotazioneHasCarica.IN_MISSIONE,
+        'presidente di turno': VotazioneHasCarica.PRESIDENTE,
+        'presidente': VotazioneHasCarica.PRESIDENTE,
+    }
+
+    # charge types of the members of each house
+    HOUSE_CHARGE_TYPES = {
+        'C': ('Deputato', ),
+        'S': ('Senatore', 'Senatore a vita'),
+    }
+
     def __init__(self, logger=None):
-        if logger is None:
-            logging.config.dictConfig(settings.LOGGING)
-            self.logger = logging.getLogger('console')
-        else:
-            self.logger = logger
+        # logging is configured once, by Django, from settings.LOGGING
+        self.logger = logger or logging.getLogger('console')
 
+        self._charges_by_name = {}
+        self._resolved_names = {}
 
     def write_sittings(self, sittings, house='C', legislature=17):
         """
         Create sittings if non-existing.
         Log creation or detection of the sitting.
+
+        :sittings: a list of parser.records.Sitting
         """
         for sitting in sittings:
             # get_or_create the seduta in the DB
-            s, created = Seduta.objects.get_or_create(
-                house=house,
-                legislatura=legislature,
-                number=sitting['num'],
-                defaults={
-                    'is_imported': 0,
-                    'date':sitting['date'],
-                    'reference_url': sitting['reference_url']
-                }
-            )
+            with stage('write'):
+                s, created = Seduta.objects.get_or_create(
+                    house=house,
+                    legislatura=legislature,
+                    number=sitting.num,
+                    defaults={
+                        'is_imported': 0,
+                        'date':sitting.date,
+                        'reference_url': sitting.reference_url
+                    }
+                )
             if created:
-                self.logger.info("seduta created. num: {0}, day: {1}, id: {2}".format(sitting['num'], sitting['date'], s.id))
+                metrics.rows_written.inc(table=Seduta._meta.db_table)
+                self.logger.info("seduta created. num: {0}, day: {1}, id: {2}".format(sitting.num, sitting.date, s.id))
             else:
-                self.logger.info("seduta found. num: {0}, day: {1}, id: {2}".format(sitting['num'], sitting['date'], s.id))
+                self.logger.info("seduta found. num: {0}, day: {1}, id: {2}".format(sitting.num, sitting.date, s.id))
+
+    # votations marked as imported at once
+    BATCH_SIZE = 500
+
+    def write_votations(self, sittings, house='C', legislature=17, counts=True):
+        """
+        Create or update the votations of the given sittings,
+        then update the full-text search index for them.
+
+        Sittings and votations marked as unchanged by the reader are skipped.
+
+        Sittings must already exist in the DB (see write_sittings).
+        Votations are marked as imported only once all their derived rows are written,
+        so that a failed import is retried.
+
+        :sittings: a list of parser.records.Sitting, with their votations details
+        :counts: whether to update the vote counts and the profiles of the voters too,
+                 or leave them to a later update_counts (see opp.tasks)
+        """
+        written = []
+        for sitting in sittings:
+            if sitting.unchanged:
+                continue
+            with stage('write'):
+                s = Seduta.objects.get(house=house, legislatura=legislature, number=sitting.num)
+            for votation in sitting.votations:
+                if votation.unchanged:
+                    continue
+                details = votation.details
+                fields = self.votation_fields(votation)
+
+                defaults = dict(
+                    finale=0, nb_commenti=0, is_imported=0, ut_fav=0, ut_contr=0,
+                    is_maggioranza_sotto_salva=0, **fields
+                )
+                with stage('write'):
+                    v, created = Votazione.objects.get_or_create(
+                        sitting=s,
+                        numero_votazione=details.number,
+                        defaults=defaults
+                    )
+                if not created:
+                    for field, value in fields.items():
+                        setattr(v, field, value)
+                self.write_votes(v, details, house=house, legislature=legislature)
+                v.is_imported = 0
+                with stage('write'):
+                    v.save()
+                metrics.votations_imported.inc(house=house)
+                metrics.rows_written.inc(table=Votazione._meta.db_table)
+                v.sitting = s
+                written.append(v)
+                self.logger.info("votazione {0}. num: {1}, seduta: {2}, id: {3}".format(
+                    'created' if created else 'updated', details.number, sitting.num, v.id
+                ))
+
+        with stage('index'):
+            n_postings = search.index_votations(written)
+        metrics.rows_written.inc(n_postings, table=VotazioneSearchPosting._meta.db_table)
+        self.logger.info("{0} votations indexed, {1} postings".format(len(written), n_postings))
+
+        with stage('breakdown'):
+            n_breakdowns = breakdown.compute_breakdowns([v.id for v in written])
+        metrics.rows_written.inc(n_breakdowns, table=VotazioneGruppoBreakdown._meta.db_table)
+        self.logger.info("{0} group breakdowns computed".format(n_breakdowns))
+
+        with stage('acts'):
+            n_linked, n_final = acts.link_votations(house, legislature, votation_ids=[v.id for v in written])
+        metrics.rows_written.inc(n_linked, table=VotazioneAtto._meta.db_table)
+        self.logger.info("{0} votations linked to their acts, {1} final votes".format(n_linked, n_final))
+
+        if counts:
+            self.update_counts(written)
+
+        ids = [v.id for v in written]
+        with stage('write'):
+            for i in range(0, len(ids), self.BATCH_SIZE):
+                Votazione.objects.filter(id__in=ids[i:i + self.BATCH_SIZE]).update(is_imported=1)
+        for v in written:
+            v.is_imported = 1
+
+        # pages to warm, once the import succeeded
+        pagecache.touched.add(
+            sittings=[v.sitting.id for v in written],
+            votations=[(v.sitting.date, v.numero_votazione, v.id) for v in written]
+        )
+
+        return written
+
+    def update_counts(self, votations):
+        """
+        Update the cumulative vote counts and the profiles of the voters of the given votations.
+
+        :votations: a list of Votazione, with their sitting
+        """
+        charge_ids, group_ids = votecounts.voters([v.id for v in votations])
+        with stage('vote_counts'):
+            n_counts = votecounts.update_for_votations(votations, charge_ids, group_ids)
+        metrics.rows_written.inc(n_counts, table=CumulativeVoteCount._meta.db_table)
+        self.logger.info("{0} cumulative vote counts written".format(n_counts))
+
+        with stage('profiles'):
+            n_profiles = profiles.rebuild(charge_ids)
+        metrics.rows_written.inc(n_profiles, table=CaricaProfile._meta.db_table)
+        self.logger.info("{0} charge profiles rebuilt".format(n_profiles))
+
+        pagecache.touched.add(charges=charge_ids, groups=group_ids)
+        return n_counts
+
+    def votation_fields(self, votation):
+        """
+        Return the Votazione fields, as written, of a parser.records.VotationRef with its details
+        """
+        details = votation.details
+        fields = {
+            'titolo': details.title,
+            'tipologia': details.type,
+            'esito': details.result,
+            'url': votation.uri,
+        }
+        for label, value in details.summary.items():
+            field = self.SUMMARY_FIELDS.get(search.normalize(label).strip())
+            if field:
+                fields[field] = int(value)
+        return fields
+
+    def vote_value(self, voting):
+        """
+        Return the voto value, as written, of a single vote, as scraped
+        """
+        voting = voting.strip()
+        return self.VOTE_VALUES.get(voting.lower(), voting)
+
+    def charges_by_name(self, house='C', legislature=17):
+        """
+        Return a dict mapping the normalized "SURNAME NAME" of the
+        members of the house in the legislature, to their charge ids.
+
+        The dict is computed once per writer, with a single query.
+        """
+        key = (house, legislature)
+        metrics.record_cache('charges_by_name', key in self._charges_by_name)
+        if key not in self._charges_by_name:
+            charges = Carica.objects.filter(
+                legislatura=legislature,
+                charge_type__name__in=self.HOUSE_CHARGE_TYPES[house]
+            ).values_list('id', 'politician__surname', 'politician__name')
+            self._charges_by_name[key] = dict(
+                (self.name_key(u"{0} {1}".format(surname, name)), charge_id)
+                for charge_id, surname, name in charges
+            )
+        return self._charges_by_name[key]
+
+    @staticmethod
+    def name_key(name):
+        return u' '.join(search.normalize(name).split())
+
+    def resolve_name(self, name, house='C', legislature=17):
+        """
+        Return the charge id of the member of the house with the given name, or None.
+        Names are resolved once per writer.
+        """
+        resolved = self._resolved_names.setdefault((house, legislature), {})
+        if name not in resolved:
+            charges = self.charges_by_name(house=house, legislature=legislature)
+            resolved[name] = charges.get(self.name_key(name))
+        return resolved[name]
+
+    def write_votes(self, votation, details, house='C', legislature=17):
+        """
+        Replace the single votes of a votation, in bulk.
+
+        :details: the parser.records.VotationDetail of the votation, as scraped
+        """
+        with stage('resolve'):
+            votes = []
+            for i, voting in details.iter_votes():
+                name = details.deputies[i]
+                charge_id = self.resolve_name(name, house=house, legislature=legislature)
+                if charge_id is None:
+                    self.logger.warning("could not resolve name {0} in votation {1}".format(name, votation.id))
+                    continue
+                votes.append(VotazioneHasCarica(
+                    vote_id=votation.id, charge_id=charge_id,
+                    voting=self.vote_value(voting),
+                    rebel=0, maggioranza_sotto_salva=0
+                ))
+
+        with stage('write'), transaction.atomic():
+            VotazioneHasCarica.objects.filter(vote_id=votation.id).delete()
+            VotazioneHasCarica.objects.bulk_create(votes, batch_size=1000)
+        metrics.rows_written.inc(len(votes), table=VotazioneHasCarica._meta.db_table)
 
+        return len(votes)